@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+Offline benchmarks of the API. The services are replaced by local
+stand-ins (`stubs`) loaded with synthetic datasets (`datasets`), see
+`caravaggio_rest_api.benchmarks.runner` and `python -m
+caravaggio_rest_api.benchmarks --help`.
+"""
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+Runs the end-to-end benchmarks and writes the JSON report:
+
+    python -m caravaggio_rest_api.benchmarks --scale 10000 --output report.json
+    python -m caravaggio_rest_api.benchmarks --compare baseline.json
+
+The benchmarks use the `Benchmark` settings, no service is needed.
+"""
+import argparse
+import json
+import os
+import sys
+
+
+def get_parser():
+    from caravaggio_rest_api.benchmarks import runner
+
+    parser = argparse.ArgumentParser(prog="python -m caravaggio_rest_api.benchmarks", description=__doc__)
+    parser.add_argument("--scale", type=int, default=runner.DEFAULT_SCALE, help="Number of companies.")
+    parser.add_argument("--requests", type=int, default=runner.DEFAULT_REQUESTS, help="Requests per scenario.")
+    parser.add_argument("--warmup", type=int, default=runner.DEFAULT_WARMUP, help="Warmup requests per scenario.")
+    parser.add_argument(
+        "--allocations",
+        type=int,
+        default=runner.DEFAULT_ALLOCATION_REQUESTS,
+        help="Requests per scenario measured with tracemalloc (0 disables it).",
+    )
+    parser.add_argument("--page-size", type=int, default=None, help="The `limit` of the paginated scenarios.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the synthetic dataset.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latency (seconds) of the stub Solr server.")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        dest="scenarios",
+        choices=[scenario.name for scenario in runner.SCENARIOS],
+        help="Scenario to run (all by default), can be repeated.",
+    )
+    parser.add_argument("--label", default=None, help="Label of the report, ex. the commit.")
+    parser.add_argument("--output", default=None, help="Path of the JSON report (standard output by default).")
+    parser.add_argument("--compare", default=None, help="Path of a previous report to compare with.")
+    return parser
+
+
+def main(argv=None):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "caravaggio_rest_api.benchmarks.settings")
+    os.environ.setdefault("DJANGO_CONFIGURATION", "Benchmark")
+
+    import configurations
+
+    configurations.setup()
+
+    from django.core.management import call_command
+
+    from caravaggio_rest_api.benchmarks import datasets, report, runner
+
+    options = get_parser().parse_args(argv)
+
+    call_command("migrate", interactive=False, verbosity=0)
+
+    benchmark = runner.BenchmarkRunner(
+        runner.create_benchmark_user(),
+        scale=options.scale,
+        requests=options.requests,
+        warmup=options.warmup,
+        allocation_requests=options.allocations,
+        page_size=options.page_size,
+        seed=options.seed if options.seed is not None else datasets.DEFAULT_SEED,
+        latency=options.latency,
+        scenarios=[scenario for scenario in runner.SCENARIOS if scenario.name in options.scenarios]
+        if options.scenarios
+        else None,
+    )
+    results = benchmark.run()
+    results["label"] = options.label
+
+    if options.compare:
+        results["comparison"] = report.compare_reports(report.load_report(options.compare), results)
+
+    if options.output:
+        report.write_report(results, options.output)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+    failed = [name for name, scenario in results["scenarios"].items() if "error" in scenario]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+Synthetic datasets of the example `Company` model. The companies are
+generated with a seeded random generator, the same seed and size always
+produce the same dataset.
+
+Every company is available in the two representations the API reads: the
+row returned by the Cassandra driver and the document returned by Solr.
+"""
+import json
+import random
+import uuid
+
+from datetime import date, datetime, timedelta
+
+try:
+    from dse.cqlengine import columns
+    from dse.util import Date
+except ImportError:
+    from cassandra.cqlengine import columns
+    from cassandra.util import Date
+
+from haystack import connections
+
+from caravaggio_rest_api.dse.columns import KeyEncodedMap
+from caravaggio_rest_api.example.company.models import Address, Company
+
+DEFAULT_SEED = 42
+
+START_DATE = datetime(2015, 1, 1)
+
+SYLLABLES = ["ba", "cor", "da", "fin", "gen", "lo", "ma", "net", "pro", "qua", "ri", "sys", "ta", "vo", "xen", "zi"]
+
+WORDS = [
+    "analytics",
+    "cloud",
+    "data",
+    "distributed",
+    "energy",
+    "fiber",
+    "health",
+    "insurance",
+    "learning",
+    "logistics",
+    "machine",
+    "marketplace",
+    "mobile",
+    "payments",
+    "platform",
+    "robotics",
+    "security",
+    "software",
+    "storage",
+    "telecommunications",
+]
+
+SPECIALTIES = [
+    "Internet",
+    "Hardware",
+    "Telecommunications",
+    "Machine Learning",
+    "Big Data",
+    "Fintech",
+    "Healthcare",
+    "E-Commerce",
+    "Security",
+    "SaaS",
+]
+
+CITIES = [
+    ("New York", "NY", "USA", 40.7128, -74.0060),
+    ("Corvallis", "OR", "USA", 44.5646, -123.2620),
+    ("San Francisco", "CA", "USA", 37.7749, -122.4194),
+    ("Barcelona", "Catalonia", "ESP", 41.3851, 2.1734),
+    ("Madrid", "Madrid", "ESP", 40.4168, -3.7038),
+    ("London", "England", "GBR", 51.5074, -0.1278),
+    ("Berlin", "Berlin", "DEU", 52.5200, 13.4050),
+    ("Tel Aviv", "Tel Aviv", "ISR", 32.0853, 34.7818),
+]
+
+STREET_TYPES = ["Street", "Avenue", "Road", "Boulevard"]
+
+WEBSITES = ["website", "twitter", "facebook", "crunchbase", "linkedin_url"]
+
+
+class CompanyDatasetGenerator(object):
+    """
+    Generates `count` companies of the user `user`.
+    """
+
+    def __init__(self, count, seed=DEFAULT_SEED, user="benchmark"):
+        self.count = count
+        self.seed = seed
+        self.user = user
+
+    def get_uuid(self, rng):
+        return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+    def get_name(self, rng):
+        return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+
+    def get_sentence(self, rng, words):
+        return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+    def generate_company(self, rng, position):
+        name = "{0} {1}".format(self.get_name(rng), position)
+        domain = "{0}.com".format(name.lower().replace(" ", "-"))
+        city, state, country_code, latitude, longitude = rng.choice(CITIES)
+        latitude = round(latitude + rng.uniform(-0.1, 0.1), 5)
+        longitude = round(longitude + rng.uniform(-0.1, 0.1), 5)
+        created_at = START_DATE + timedelta(minutes=rng.randint(0, 60 * 24 * 365 * 5))
+
+        return Company(
+            _id=self.get_uuid(rng),
+            user=self.user,
+            created_at=created_at,
+            updated_at=created_at + timedelta(days=rng.randint(0, 365)),
+            is_deleted=False,
+            name=name,
+            short_description=self.get_sentence(rng, rng.randint(8, 20)),
+            domain=domain,
+            foundation_date=date(rng.randint(1980, 2019), rng.randint(1, 12), rng.randint(1, 28)),
+            last_round=date(rng.randint(2015, 2020), rng.randint(1, 12), rng.randint(1, 28)),
+            round_notes=self.get_sentence(rng, rng.randint(4, 10)),
+            country_code=country_code,
+            stock_symbol=name[:3].upper(),
+            contact_email="info@{0}".format(domain),
+            headcount=rng.randint(1, 10000),
+            company_score=round(rng.random(), 4),
+            founders=[self.get_uuid(rng) for _ in range(rng.randint(1, 4))],
+            address=Address(
+                street_type=rng.choice(STREET_TYPES),
+                street_name=self.get_name(rng),
+                street_number=rng.randint(1, 999),
+                city=city,
+                region=state,
+                state=state,
+                country_code=country_code,
+                zipcode="{0:05d}".format(rng.randint(0, 99999)),
+            ),
+            specialties=rng.sample(SPECIALTIES, rng.randint(1, 4)),
+            latest_twitter_followers=[rng.randint(0, 100000) for _ in range(rng.randint(0, 6))],
+            websites={key: "https://{0}/{1}".format(domain, key) for key in rng.sample(WEBSITES, rng.randint(1, 5))},
+            crawler_config=json.dumps({"crunchbase": {"uuid": self.get_uuid(rng).hex, "permalink": domain}}),
+            extra_data=json.dumps({"twitter_followers": rng.randint(0, 100000), "tags": rng.sample(WORDS, 3)}),
+            latitude=latitude,
+            longitude=longitude,
+            coordinates="{0},{1}".format(latitude, longitude),
+            point="POINT({0} {1})".format(longitude, latitude),
+            linestring="LINESTRING ({0} {1}, {2} {3})".format(longitude, latitude, longitude + 1, latitude + 1),
+        )
+
+    def generate(self):
+        rng = random.Random(self.seed)
+        return [self.generate_company(rng, position) for position in range(self.count)]
+
+
+def generate_companies(count, seed=DEFAULT_SEED, user="benchmark"):
+    return CompanyDatasetGenerator(count, seed=seed, user=user).generate()
+
+
+def to_row(instance):
+    """
+    The row of the instance as it is returned by the driver (with the
+    `dict_factory` of cqlengine).
+    """
+    row = {}
+    for name, column in instance._columns.items():
+        value = getattr(instance, name)
+        # The driver returns the timestamps as naive datetimes and the dates
+        # as `Date`, as the values of the instance
+        if value is not None and not isinstance(column, (columns.DateTime, columns.Date)):
+            value = column.to_database(value)
+        row[column.db_field_name] = value
+    return row
+
+
+def to_solr_value(value):
+    if isinstance(value, datetime):
+        return "{0}Z".format(value.replace(tzinfo=None).isoformat(timespec="milliseconds"))
+    elif isinstance(value, date):
+        return "{0}T00:00:00Z".format(value.isoformat())
+    elif isinstance(value, Date):
+        return to_solr_value(value.date())
+    elif isinstance(value, uuid.UUID):
+        return str(value)
+    elif isinstance(value, (list, tuple)):
+        return [to_solr_value(item) for item in value]
+    return value
+
+
+def to_solr_document(instance, index=None):
+    """
+    The stored fields of the instance as they are returned by Solr, the
+    attributes of the fields of the search index (the fields of the UDTs are
+    informed as `<column>.<field>`), including the `<field>_exact` fields of the
+    faceted fields. The `KeyEncodedMap` columns are returned
+    as dynamic fields, one field for each key (`<column>_<key>`).
+    """
+    index = index or connections["default"].get_unified_index().get_index(type(instance))
+
+    document = {}
+    for name, field in index.fields.items():
+        # The `<field>_exact` fields of the faceted fields have the value of
+        # the field
+        facet_for = getattr(field, "facet_for", None)
+        model_attr = index.fields[facet_for].model_attr if facet_for else field.model_attr
+        if field.use_template or model_attr is None:
+            continue
+
+        column = instance._columns.get(model_attr, None)
+        if isinstance(column, KeyEncodedMap):
+            document.update(column.to_database(getattr(instance, model_attr)) or {})
+            continue
+
+        value = instance
+        for attr in model_attr.split("."):
+            value = getattr(value, attr, None)
+
+        if value is not None and value != []:
+            document[field.index_fieldname] = to_solr_value(value)
+
+    return document
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+Micro-benchmarks of the functions that dominate the CPU time of the
+searches, with a stored baseline and a regression budget, see
+`caravaggio_rest_api.benchmarks.micro.cases` and `python -m
+caravaggio_rest_api.benchmarks.micro --help`.
+"""
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+Runs the micro-benchmarks and checks them against the stored baseline, the
+exit status is 1 if any of them is slower than its budget:
+
+    python -m caravaggio_rest_api.benchmarks.micro
+    python -m caravaggio_rest_api.benchmarks.micro --benchmark solr_to_python --docs 1000
+    python -m caravaggio_rest_api.benchmarks.micro --update-baseline
+
+The benchmarks use the `Benchmark` settings, no service is needed.
+"""
+import argparse
+import json
+import os
+import sys
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+DEFAULT_THRESHOLD = 1.3
+
+
+def get_parser():
+    from caravaggio_rest_api.benchmarks.micro import cases
+
+    parser = argparse.ArgumentParser(prog="python -m caravaggio_rest_api.benchmarks.micro", description=__doc__)
+    parser.add_argument(
+        "--benchmark",
+        action="append",
+        dest="benchmarks",
+        choices=[benchmark.name for benchmark in cases.BENCHMARKS],
+        help="Benchmark to run (all by default), can be repeated.",
+    )
+    parser.add_argument("--docs", type=int, action="append", help="Number of documents, can be repeated.")
+    parser.add_argument("--fields", type=int, action="append", help="Number of fields, can be repeated.")
+    parser.add_argument("--repeats", type=int, default=cases.DEFAULT_REPEATS, help="Repetitions of every case.")
+    parser.add_argument(
+        "--min-time", type=float, default=cases.DEFAULT_MIN_TIME, help="Minimum duration (seconds) of a repetition."
+    )
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Path of the baseline report.")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Maximum ratio between the times and the times of the baseline.",
+    )
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results as the new baseline.")
+    parser.add_argument("--output", default=None, help="Path of the JSON report (standard output by default).")
+    return parser
+
+
+def main(argv=None):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "caravaggio_rest_api.benchmarks.settings")
+    os.environ.setdefault("DJANGO_CONFIGURATION", "Benchmark")
+
+    import configurations
+
+    configurations.setup()
+
+    from caravaggio_rest_api.benchmarks import report
+    from caravaggio_rest_api.benchmarks.micro import cases
+
+    options = get_parser().parse_args(argv)
+
+    benchmarks = None
+    if options.benchmarks:
+        benchmarks = [benchmark for benchmark in cases.BENCHMARKS if benchmark.name in options.benchmarks]
+
+    results = cases.run_benchmarks(
+        cases.get_cases(benchmarks, docs=options.docs, fields=options.fields),
+        repeats=options.repeats,
+        min_time=options.min_time,
+    )
+
+    if options.update_baseline:
+        report.write_report(results, options.baseline)
+    elif os.path.exists(options.baseline):
+        results["budgets"] = report.check_budgets(report.load_report(options.baseline), results, options.threshold)
+
+    if options.output:
+        report.write_report(results, options.output)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+    regressions = [name for name, budget in results.get("budgets", {}).items() if budget["regressed"]]
+    for name in regressions:
+        sys.stderr.write(
+            "{0} regressed: {1[ratio]} times the baseline\n".format(name, results["budgets"][name])
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
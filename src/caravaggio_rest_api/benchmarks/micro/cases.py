@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+Micro-benchmarks of the hot functions of the searches: the decoding of the
+Solr values, the processing of the results of Solr and DSE, the building of
+the queries and the facets, the conversion of the `KeyEncodedMap` columns
+and the serialization of the companies.
+
+Every benchmark is parameterized by the number of documents (`docs`) and the
+number of fields of each document (`fields`), and measured with `timeit`
+over the synthetic companies of `caravaggio_rest_api.benchmarks.datasets`.
+Every repetition is preceded by the measure of a reference workload, the
+times relative to it are compared with the baseline, which absorbs the
+differences between machines and the variations of the load of the
+machine during the run.
+"""
+import json
+import logging
+import platform
+import timeit
+
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+
+import django
+
+from haystack import connections
+from haystack.constants import DJANGO_CT, DJANGO_ID
+from haystack.fields import LocationField, MultiValueField
+from haystack.models import SearchResult
+from pysolr import Results
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from caravaggio_rest_api.benchmarks import datasets, stubs
+from caravaggio_rest_api.benchmarks.report import REPORT_VERSION, summarize
+from caravaggio_rest_api.dse.backends.dse_backend import DSEBackend
+from caravaggio_rest_api.drf_haystack.filters import CaravaggioHaystackFacetFilter, CaravaggioHaystackFilter
+from caravaggio_rest_api.drf_haystack.query import CaravaggioFacetQueryBuilder, CaravaggioFilterQueryBuilder
+from caravaggio_rest_api.example.company.api.serializers import CompanySerializerV1
+from caravaggio_rest_api.example.company.api.views import CompanySearchViewSet
+from caravaggio_rest_api.example.company.models import Company
+from caravaggio_rest_api.haystack.backends.solr_backend import CassandraSolrSearchBackend
+
+LOGGER = logging.getLogger(__name__)
+
+DOCS = (10, 100, 1000)
+FIELDS = (5, 10, 20)
+
+DEFAULT_REPEATS = 10
+DEFAULT_MIN_TIME = 0.1
+
+# Calls of the reference workload measured before every repetition
+REFERENCE_NUMBER = 20
+
+
+@lru_cache(maxsize=None)
+def get_companies(count):
+    return datasets.generate_companies(count)
+
+
+@lru_cache(maxsize=None)
+def get_solr_documents(count):
+    return [datasets.to_solr_document(company) for company in get_companies(count)]
+
+
+def get_index():
+    return connections["default"].get_unified_index().get_index(Company)
+
+
+def get_scalar_fields(count):
+    """
+    The first `count` fields of the search index with a single value of the
+    model (not the location, the multi-valued fields or the `<field>_exact`
+    fields).
+    """
+    names = [
+        name
+        for name, field in get_index().fields.items()
+        if field.model_attr
+        and not field.use_template
+        and not getattr(field, "facet_for", None)
+        and not isinstance(field, (LocationField, MultiValueField))
+    ]
+    return names[:count]
+
+
+def get_documents(docs, fields):
+    """
+    The Solr documents of `docs` companies with their first `fields` fields,
+    as `_finish_search` passes them to `_process_results`.
+    """
+    documents = []
+    for position, document in enumerate(get_solr_documents(docs)):
+        document = OrderedDict(list(document.items())[:fields])
+        document[DJANGO_CT] = Company._meta.label_lower
+        document[DJANGO_ID] = position
+        documents.append(document)
+    return documents
+
+
+def get_rows(docs, fields):
+    """
+    The rows of `docs` companies with their first `fields` columns, as the
+    DSE backend passes them to `_process_results`.
+    """
+    rows = []
+    for position, company in enumerate(get_companies(docs)):
+        row = datasets.to_row(company)
+        row = OrderedDict(list(row.items())[:fields])
+        row[DJANGO_CT] = Company._meta.label_lower
+        row[DJANGO_ID] = position
+        rows.append(row)
+    return rows
+
+
+def get_values(docs, field):
+    """
+    The values of a field in the documents of `docs` companies.
+    """
+    return [str(document[field]) for document in get_solr_documents(docs) if field in document]
+
+
+def get_dse_backend():
+    # The DSE backend without the Cassandra connection of Django, the
+    # benchmarked methods do not use it
+    options = connections.connections_info["default"]
+    backend = DSEBackend.__new__(DSEBackend)
+    CassandraSolrSearchBackend.__init__(backend, "default", **options)
+    return backend
+
+
+class MicroBenchmark(object):
+    """
+    A function measured over an input of `docs` documents with `fields`
+    fields. `setup` builds the input and `run` calls the function over the
+    whole input.
+
+    `docs_grid` and `fields_grid` are the parameters benchmarked by default,
+    `threshold` overrides the regression budget of the benchmark (the
+    maximum ratio between the time and the time of the baseline).
+    """
+
+    name = None
+    docs_grid = DOCS
+    fields_grid = FIELDS
+    threshold = None
+
+    def __init__(self, docs, fields):
+        self.docs = docs
+        self.fields = fields
+
+    @property
+    def case_name(self):
+        return "{0}[docs={1},fields={2}]".format(self.name, self.docs, self.fields)
+
+    def setup(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError()
+
+
+class SolrToPythonBenchmark(MicroBenchmark):
+    """
+    `CassandraSolrSearchBackend._to_python` of every value of the documents.
+    """
+
+    name = "solr_to_python"
+
+    def setup(self):
+        self.backend = connections["default"].get_backend()
+        self.values = [value for document in get_documents(self.docs, self.fields) for value in document.values()]
+
+    def run(self):
+        to_python = self.backend._to_python
+        for value in self.values:
+            to_python(value)
+
+
+class SolrProcessResultsBenchmark(MicroBenchmark):
+    """
+    `CassandraSolrSearchBackend._process_results` of a response of Solr.
+    """
+
+    name = "solr_process_results"
+
+    def setup(self):
+        self.backend = connections["default"].get_backend()
+        core = stubs.StubSolrCore(get_documents(self.docs, self.fields))
+        self.raw_results = Results(core.select({"rows": [str(self.docs)]}))
+
+    def run(self):
+        self.backend._process_results(self.raw_results, model=Company, result_class=SearchResult)
+
+
+class DSEProcessResultsBenchmark(MicroBenchmark):
+    """
+    `DSEBackend._process_results` of the rows of a CQL search.
+    """
+
+    name = "dse_process_results"
+
+    def setup(self):
+        self.backend = get_dse_backend()
+        self.rows = get_rows(self.docs, self.fields)
+
+    def run(self):
+        self.backend._process_results(self.rows, model=Company, result_class=SearchResult)
+
+
+class BuildQueryFragmentBenchmark(MicroBenchmark):
+    """
+    `CassandraSolrSearchQuery.build_query_fragment` of an `exact` and an `in`
+    filter (with the values of the `docs` documents) for every field.
+    """
+
+    name = "build_query_fragment"
+
+    def setup(self):
+        self.query = connections["default"].get_query()
+        self.filters = []
+        for field in get_scalar_fields(self.fields):
+            values = get_values(self.docs, field)
+            self.filters.append((field, "exact", values[0]))
+            self.filters.append((field, "in", values))
+
+    def run(self):
+        for field, filter_type, value in self.filters:
+            self.query.build_query_fragment(field, filter_type, value)
+
+
+class FilterQueryBuilderBenchmark(MicroBenchmark):
+    """
+    `CaravaggioFilterQueryBuilder.build_query` of the `<field>__in` filters
+    of the query string, with the values of the `docs` documents.
+    """
+
+    name = "filter_query_builder"
+
+    def setup(self):
+        view = CompanySearchViewSet()
+        self.builder = CaravaggioFilterQueryBuilder(backend=CaravaggioHaystackFilter(), view=view)
+
+        searchable = set(view.serializer_class.Meta.fields)
+        fields = [field for field in get_scalar_fields(len(get_index().fields)) if field in searchable]
+        self.filters = {
+            "{0}__in".format(field): [view.lookup_sep.join(get_values(self.docs, field))]
+            for field in fields[: self.fields]
+        }
+
+    def run(self):
+        self.builder.build_query(**self.filters)
+
+
+class FacetQueryBuilderBenchmark(MicroBenchmark):
+    """
+    `CaravaggioFacetQueryBuilder.build_query` of the `facet.field.<field>`
+    parameters. The facets do not depend on the number of documents.
+    """
+
+    name = "facet_query_builder"
+    docs_grid = (1,)
+    fields_grid = (2, 4, 8)
+
+    def setup(self):
+        view = CompanySearchViewSet()
+        self.builder = CaravaggioFacetQueryBuilder(backend=CaravaggioHaystackFacetFilter(), view=view)
+
+        fields = view.facet_serializer_class.Meta.fields[: self.fields]
+        self.filters = {"facet.field.{0}".format(field): ["limit:10,mincount:1"] for field in fields}
+        self.filters["facet.mincount"] = ["1"]
+
+    def run(self):
+        self.builder.build_query(**self.filters)
+
+
+class KwargsToDSEFormatBenchmark(MicroBenchmark):
+    """
+    `DSEBackend.kwargs_to_dse_format` of the parameters of a faceted search
+    that requests `fields` fields and facets. The parameters do not depend
+    on the number of documents.
+    """
+
+    name = "kwargs_to_dse_format"
+    docs_grid = (1,)
+
+    def setup(self):
+        self.backend = get_dse_backend()
+
+        fields = get_scalar_fields(self.fields)
+        self.kwargs = {
+            "fl": " ".join(fields + ["score"]),
+            "rows": 20,
+            "df": "text",
+            "facet": "on",
+            "facet.field": fields,
+            "facet.mincount": 1,
+            "facet.range": "headcount",
+            "facet.range.other": "none",
+            "spellcheck": "true",
+            "spellcheck.count": 1,
+            "cursorMark": "*",
+        }
+        for field in fields:
+            self.kwargs["f.{0}.facet.limit".format(field)] = 10
+
+    def run(self):
+        # The method consumes the parameters
+        self.backend.kwargs_to_dse_format(dict(self.kwargs))
+
+
+class KeyEncodedMapToPythonBenchmark(MicroBenchmark):
+    """
+    `KeyEncodedMap.to_python` of `docs` maps with `fields` keys.
+    """
+
+    name = "key_encoded_map_to_python"
+
+    def setup(self):
+        self.column = Company._columns["websites"]
+        self.values = [
+            self.column.to_database(
+                {"site_{0}".format(key): "https://{0}.example.com/{1}".format(key, doc) for key in range(self.fields)}
+            )
+            for doc in range(self.docs)
+        ]
+
+    def run(self):
+        to_python = self.column.to_python
+        for value in self.values:
+            to_python(value)
+
+
+class KeyEncodedMapToDatabaseBenchmark(KeyEncodedMapToPythonBenchmark):
+    """
+    `KeyEncodedMap.to_database` of `docs` maps with `fields` keys.
+    """
+
+    name = "key_encoded_map_to_database"
+
+    def setup(self):
+        super(KeyEncodedMapToDatabaseBenchmark, self).setup()
+        self.values = [self.column.to_python(value) for value in self.values]
+
+    def run(self):
+        to_database = self.column.to_database
+        for value in self.values:
+            to_database(value)
+
+
+class CompanySerializerBenchmark(MicroBenchmark):
+    """
+    `CompanySerializerV1.to_representation` of `docs` companies with the
+    first `fields` fields of the serializer.
+    """
+
+    name = "company_serializer"
+
+    def setup(self):
+        request = Request(APIRequestFactory().get("/"))
+        fields = [field for field in CompanySerializerV1.Meta.fields if field != "user"]
+        self.serializer = CompanySerializerV1(fields=fields[: self.fields], context={"request": request})
+        self.companies = get_companies(self.docs)
+
+    def run(self):
+        to_representation = self.serializer.to_representation
+        for company in self.companies:
+            to_representation(company)
+
+
+BENCHMARKS = [
+    SolrToPythonBenchmark,
+    SolrProcessResultsBenchmark,
+    DSEProcessResultsBenchmark,
+    BuildQueryFragmentBenchmark,
+    FilterQueryBuilderBenchmark,
+    FacetQueryBuilderBenchmark,
+    KwargsToDSEFormatBenchmark,
+    KeyEncodedMapToPythonBenchmark,
+    KeyEncodedMapToDatabaseBenchmark,
+    CompanySerializerBenchmark,
+]
+
+
+def get_cases(benchmarks=None, docs=None, fields=None):
+    """
+    The instances of the benchmarks for every combination of parameters.
+    `docs` and `fields` replace the default grids (the benchmarks that do
+    not depend on the number of documents keep their grid).
+    """
+    cases = []
+    for benchmark_class in benchmarks or BENCHMARKS:
+        docs_grid = docs if docs and len(benchmark_class.docs_grid) > 1 else benchmark_class.docs_grid
+        for docs_count in docs_grid:
+            for fields_count in fields or benchmark_class.fields_grid:
+                cases.append(benchmark_class(docs_count, fields_count))
+    return cases
+
+
+def reference_workload():
+    documents = [{"_id": str(position), "name": "company {0}".format(position)} for position in range(200)]
+    return json.loads(json.dumps(sorted(documents, key=lambda document: document["name"])))
+
+
+def measure(benchmark, repeats=DEFAULT_REPEATS, min_time=DEFAULT_MIN_TIME):
+    """
+    The times (microseconds) of a call of the benchmark, and the times
+    relative to the time of the reference workload measured just before
+    each repetition. The number of calls of every repetition is increased
+    until they take `min_time` seconds.
+    """
+    benchmark.setup()
+    timer = timeit.Timer(benchmark.run)
+    reference = timeit.Timer(reference_workload)
+
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    times, relative_times = [], []
+    for _ in range(repeats):
+        reference_time = reference.timeit(REFERENCE_NUMBER) / REFERENCE_NUMBER
+        elapsed = timer.timeit(number) / number
+        times.append(elapsed)
+        relative_times.append(elapsed / reference_time)
+
+    return number, summarize(times, scale=1000000), summarize(relative_times, digits=6)
+
+
+def run_benchmarks(cases, repeats=DEFAULT_REPEATS, min_time=DEFAULT_MIN_TIME):
+    """
+    Measures the cases and returns the report.
+    """
+    results = OrderedDict()
+    for case in cases:
+        LOGGER.info("Running the micro-benchmark {0}".format(case.case_name))
+        number, times, relative_times = measure(case, repeats=repeats, min_time=min_time)
+        results[case.case_name] = OrderedDict(
+            [
+                ("benchmark", case.name),
+                ("docs", case.docs),
+                ("fields", case.fields),
+                ("number", number),
+                ("time_us", times),
+                ("relative_time", relative_times),
+                ("threshold", case.threshold),
+            ]
+        )
+
+    return OrderedDict(
+        [
+            ("version", REPORT_VERSION),
+            ("created_at", datetime.utcnow().isoformat()),
+            (
+                "environment",
+                OrderedDict(
+                    [
+                        ("python", platform.python_version()),
+                        ("django", django.get_version()),
+                        ("platform", platform.platform()),
+                    ]
+                ),
+            ),
+            ("config", OrderedDict([("repeats", repeats), ("min_time", min_time)])),
+            ("results", results),
+        ]
+    )
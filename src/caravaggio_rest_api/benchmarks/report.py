@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+The JSON reports of the benchmarks, and the comparison of two reports (ex.
+the reports of two commits).
+"""
+import json
+import re
+
+# The statistics of the scenarios, also used by the replay of the access log
+from caravaggio_rest_api.utils import summarize  # noqa: F401
+
+REPORT_VERSION = 1
+
+SERVER_TIMING_REGEX = re.compile(r"([\w.-]+)\s*;\s*dur=([\d.]+)")
+
+# The metrics compared between reports, and if a higher value is better
+COMPARED_METRICS = (
+    ("requests_per_second", ("requests_per_second",), True),
+    ("latency_p50", ("latency", "p50"), False),
+    ("latency_p95", ("latency", "p95"), False),
+    ("peak_bytes", ("allocations", "peak_bytes", "mean"), False),
+)
+
+
+def parse_server_timing(header):
+    """
+    The durations (seconds) of the phases of the `Server-Timing` header.
+    """
+    return {name: float(duration) / 1000 for name, duration in SERVER_TIMING_REGEX.findall(header or "")}
+
+
+def get_metric(scenario, path):
+    value = scenario
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key, None)
+    return value
+
+
+def compare_reports(baseline, current):
+    """
+    The ratio current/baseline of the main metrics of every scenario present
+    in both reports, and if the change is an improvement.
+    """
+    comparison = {}
+    for name, scenario in current["scenarios"].items():
+        baseline_scenario = baseline["scenarios"].get(name, None)
+        if baseline_scenario is None:
+            continue
+
+        metrics = {}
+        for metric, path, higher_is_better in COMPARED_METRICS:
+            before, after = get_metric(baseline_scenario, path), get_metric(scenario, path)
+            if not before or after is None:
+                continue
+            ratio = after / before
+            metrics[metric] = {
+                "baseline": before,
+                "current": after,
+                "ratio": round(ratio, 3),
+                "improved": ratio > 1 if higher_is_better else ratio < 1,
+            }
+        comparison[name] = metrics
+    return comparison
+
+
+def check_budgets(baseline, current, threshold):
+    """
+    Compares the micro-benchmarks with the baseline. A case regresses when
+    its median time relative to the reference workload (`relative_time`) is
+    greater than the one of the baseline multiplied by the threshold (the
+    `threshold` of the case if it has one). The median of the repetitions
+    is more stable across runs than the best one.
+    """
+    budgets = {}
+    for name, case in current["results"].items():
+        baseline_case = baseline["results"].get(name, None)
+        if baseline_case is None:
+            continue
+
+        before, after = baseline_case["relative_time"]["p50"], case["relative_time"]["p50"]
+        budget = before * (case.get("threshold", None) or threshold)
+        budgets[name] = {
+            "baseline": before,
+            "current": after,
+            "budget": round(budget, 3),
+            "ratio": round(after / before, 3),
+            "regressed": after > budget,
+        }
+    return budgets
+
+
+def load_report(path):
+    with open(path, "r", encoding="utf-8") as report_file:
+        return json.load(report_file)
+
+
+def write_report(report, path):
+    with open(path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=2, sort_keys=True)
+        report_file.write("\n")
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+End-to-end benchmarks of the example `Company` API: the requests go through
+the whole stack (middlewares, DRF, filters, haystack, the Solr backend,
+cqlengine, the serializers) with the DRF test client, against the local
+stand-ins of Solr and Cassandra.
+
+For every scenario we report the requests per second, the latency of the
+requests and of their phases (the `Server-Timing` header, see
+`caravaggio_rest_api.timing`) and the memory allocated by every request
+(tracemalloc).
+"""
+import logging
+import platform
+import tracemalloc
+
+from collections import Counter, OrderedDict
+from datetime import datetime
+from time import perf_counter
+from urllib.parse import quote_plus, urlencode
+
+import django
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from haystack import connections as haystack_connections
+from rest_framework.test import APIClient
+
+from caravaggio_rest_api.benchmarks import datasets, stubs
+from caravaggio_rest_api.benchmarks.report import REPORT_VERSION, parse_server_timing, summarize
+from caravaggio_rest_api.example.company.models import Company
+from caravaggio_rest_api.users.models import CaravaggioClient
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SCALE = 1000
+DEFAULT_REQUESTS = 100
+DEFAULT_WARMUP = 10
+DEFAULT_ALLOCATION_REQUESTS = 20
+
+
+class Scenario(object):
+    """
+    A GET request to the endpoint `url_name` (plus `suffix`) with the query
+    parameters `params`, a list of pairs. `paginated` scenarios accept the
+    page size.
+    """
+
+    def __init__(self, name, url_name, params=None, suffix="", paginated=True):
+        self.name = name
+        self.url_name = url_name
+        self.params = params or []
+        self.suffix = suffix
+        self.paginated = paginated
+
+    def get_params(self, page_size=None):
+        params = list(self.params)
+        if self.paginated and page_size:
+            params.append(("limit", page_size))
+        return params
+
+    def get_path(self, companies, iteration, page_size=None):
+        # The parameters without value (None) are sent without `=`, ex. the
+        # `facet.field.<field>` parameters of the facets
+        query = "&".join(
+            quote_plus(name) if value is None else urlencode([(name, value)])
+            for name, value in self.get_params(page_size)
+        )
+        path = "{0}{1}".format(reverse(self.url_name), self.suffix)
+        return "{0}?{1}".format(path, query) if query else path
+
+
+class RetrieveScenario(Scenario):
+    """
+    The retrieve of a company, a different one in every request.
+    """
+
+    def __init__(self, name, url_name):
+        super(RetrieveScenario, self).__init__(name, url_name, paginated=False)
+
+    def get_path(self, companies, iteration, page_size=None):
+        company = companies[iteration % len(companies)]
+        return "{0}{1}/".format(reverse(self.url_name), company._id)
+
+
+SCENARIOS = [
+    Scenario("search_text", "company-search-list", [("text", "distributed")]),
+    Scenario(
+        "search_filters",
+        "company-search-list",
+        [("country_code", "USA"), ("specialties", "internet"), ("order_by", "-foundation_date")],
+    ),
+    Scenario("search_index_fields", "company-search-list", [("text", "cloud"), ("fields", "_id,name,country_code")]),
+    Scenario(
+        "search_facets",
+        "company-search-list",
+        [
+            ("facet.field.country_code", None),
+            ("facet.field.specialties", None),
+            ("facet.field.stock_symbol", None),
+            ("selected_facets", "country_code_exact:usa"),
+        ],
+        suffix="facets/",
+        paginated=False,
+    ),
+    Scenario("geosearch", "company-geosearch-list", [("km", 10), ("from", "44.59641,-123.25022")]),
+    Scenario("list", "company-list"),
+    RetrieveScenario("retrieve", "company-list"),
+]
+
+
+def create_benchmark_user(email="benchmark@buildgroupai.com"):
+    """
+    The user of the requests, in the database of the benchmark settings.
+    """
+    client = CaravaggioClient.objects.create(email=email, name="Benchmark")
+    return get_user_model().objects.create(
+        username="{0}-{1}".format(client.id, email), email=email, first_name="Benchmark", client=client
+    )
+
+
+class BenchmarkRunner(object):
+    """
+    Runs the scenarios over a synthetic dataset of `scale` companies. Every
+    scenario sends `warmup` requests that are not measured, `requests`
+    measured requests and `allocation_requests` requests with tracemalloc
+    enabled (its overhead would distort the latencies).
+
+    `latency` (seconds) is added to the responses of the stub Solr server.
+    """
+
+    def __init__(
+        self,
+        user,
+        scale=DEFAULT_SCALE,
+        requests=DEFAULT_REQUESTS,
+        warmup=DEFAULT_WARMUP,
+        allocation_requests=DEFAULT_ALLOCATION_REQUESTS,
+        page_size=None,
+        seed=datasets.DEFAULT_SEED,
+        latency=0.0,
+        scenarios=None,
+    ):
+        self.user = user
+        self.scale = scale
+        self.requests = requests
+        self.warmup = warmup
+        self.allocation_requests = allocation_requests
+        self.page_size = page_size
+        self.seed = seed
+        self.latency = latency
+        self.scenarios = scenarios if scenarios is not None else SCENARIOS
+
+        self.companies = None
+        self.session = None
+        self.server = None
+
+    def get_config(self):
+        return OrderedDict(
+            [
+                ("scale", self.scale),
+                ("requests", self.requests),
+                ("warmup", self.warmup),
+                ("allocation_requests", self.allocation_requests),
+                ("page_size", self.page_size),
+                ("seed", self.seed),
+                ("latency", self.latency),
+            ]
+        )
+
+    def prepare(self):
+        """
+        Generates the dataset and loads it into the stand-ins.
+        """
+        self.companies = datasets.generate_companies(self.scale, seed=self.seed, user=self.user.username)
+
+        self.session = stubs.FakeSession()
+        self.session.add_model(Company, [datasets.to_row(company) for company in self.companies])
+
+        # The core of the model in the search backend (<keyspace>.<table>)
+        backend = haystack_connections["default"].get_backend()
+        core_name = "{0}.{1}".format(backend.keyspace, Company._raw_column_family_name())
+        self.server = stubs.StubSolrServer(
+            {core_name: [datasets.to_solr_document(company) for company in self.companies]}, latency=self.latency
+        )
+
+    def get_client(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client
+
+    def send(self, client, scenario, iteration):
+        path = scenario.get_path(self.companies, iteration, self.page_size)
+        start = perf_counter()
+        response = client.get(path)
+        return response, perf_counter() - start
+
+    def measure_allocations(self, client, scenario):
+        """
+        The memory allocated during every request: the peak and the memory
+        still allocated at the end (cached objects, leaks...).
+        """
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+
+        peaks, retained = [], []
+        try:
+            for iteration in range(self.allocation_requests):
+                tracemalloc.clear_traces()
+                self.send(client, scenario, iteration)
+                current, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak)
+                retained.append(current)
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+
+        return OrderedDict(
+            [("peak_bytes", summarize(peaks, digits=0)), ("retained_bytes", summarize(retained, digits=0))]
+        )
+
+    def run_scenario(self, client, scenario):
+        for iteration in range(self.warmup):
+            self.send(client, scenario, iteration)
+
+        solr_requests = self.server.requests
+        statements = sum(self.session.statements.values())
+
+        status_codes = Counter()
+        latencies = []
+        phases = OrderedDict()
+
+        start = perf_counter()
+        for iteration in range(self.requests):
+            response, latency = self.send(client, scenario, iteration)
+            status_codes[str(response.status_code)] += 1
+            latencies.append(latency)
+            for name, duration in parse_server_timing(response.get("Server-Timing", None)).items():
+                phases.setdefault(name, []).append(duration)
+        elapsed = perf_counter() - start
+
+        result = OrderedDict(
+            [
+                ("path", scenario.get_path(self.companies, 0, self.page_size)),
+                ("requests", self.requests),
+                ("status_codes", dict(status_codes)),
+                ("requests_per_second", round(self.requests / elapsed, 3) if elapsed else None),
+                ("latency", summarize(latencies, scale=1000)),
+                ("phases", OrderedDict((name, summarize(values, scale=1000)) for name, values in phases.items())),
+                ("solr_requests", (self.server.requests - solr_requests) / float(self.requests or 1)),
+                ("cql_statements", (sum(self.session.statements.values()) - statements) / float(self.requests or 1)),
+            ]
+        )
+
+        if self.allocation_requests:
+            result["allocations"] = self.measure_allocations(client, scenario)
+
+        return result
+
+    def run(self):
+        """
+        Runs all the scenarios and returns the report. A scenario that fails
+        is reported with its error, the rest of scenarios still run.
+        """
+        if self.companies is None:
+            self.prepare()
+
+        results = OrderedDict()
+        client = self.get_client()
+        with self.server, stubs.stub_search_connection(self.server.url), stubs.fake_cassandra_connection(
+            self.session
+        ):
+            for scenario in self.scenarios:
+                LOGGER.info("Running the benchmark scenario {0}".format(scenario.name))
+                try:
+                    results[scenario.name] = self.run_scenario(client, scenario)
+                except Exception as ex:
+                    LOGGER.exception("The benchmark scenario {0} failed".format(scenario.name))
+                    results[scenario.name] = {"error": "{0}: {1}".format(type(ex).__name__, ex)}
+
+        return OrderedDict(
+            [
+                ("version", REPORT_VERSION),
+                ("created_at", datetime.utcnow().isoformat()),
+                (
+                    "environment",
+                    OrderedDict(
+                        [
+                            ("python", platform.python_version()),
+                            ("django", django.get_version()),
+                            ("platform", platform.platform()),
+                        ]
+                    ),
+                ),
+                ("config", self.get_config()),
+                ("scenarios", results),
+            ]
+        )
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+Settings of the offline benchmarks: an in-memory SQLite database for the
+users and tokens, local memory caches and no access log or throttling. Solr
+and Cassandra are replaced at runtime by the stand-ins of
+`caravaggio_rest_api.benchmarks.stubs`.
+
+    DJANGO_SETTINGS_MODULE=caravaggio_rest_api.benchmarks.settings
+    DJANGO_CONFIGURATION=Benchmark
+"""
+import os
+
+from caravaggio_rest_api.settings import Common
+
+
+class Benchmark(Common):
+    """
+    The settings of the offline benchmarks.
+    """
+
+    DEBUG = False
+
+    INSTALLED_APPS = [app for app in Common.INSTALLED_APPS if app != "django_cassandra_engine.sessions"]
+
+    DATABASES = {"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}}
+
+    SESSION_ENGINE = "django.contrib.sessions.backends.cache"
+
+    CACHES = {
+        alias: {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "benchmark_{0}".format(alias)}
+        for alias in Common.CACHES.keys()
+    }
+
+    REST_FRAMEWORK = dict(Common.REST_FRAMEWORK, LOG_ACCESSES=False, DEFAULT_THROTTLE_CLASSES=())
+
+    THROTTLE_ENABLED = False
+
+    # The errors of the search backend must not be hidden behind empty results
+    HAYSTACK_CONNECTIONS = {"default": dict(Common.HAYSTACK_CONNECTIONS["default"], SILENTLY_FAIL=False)}
+
+    SERVER_TIMING_ENABLED = True
+
+    PROFILING_SAMPLE_RATE = 0
+
+    LOGGING = {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "handlers": {"console": {"level": "WARNING", "class": "logging.StreamHandler"}},
+        "root": {"handlers": ["console"], "level": os.getenv("BENCHMARK_LOG_LEVEL", "WARNING")},
+    }
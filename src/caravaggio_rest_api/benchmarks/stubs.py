@@ -0,0 +1,868 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+Local stand-ins of the services of the API, to run the benchmarks without
+Solr and Cassandra:
+
+- `StubSolrServer`: a local HTTP server that answers the `select` requests
+  of the cores with canned documents, in the JSON format of Solr.
+- `FakeSession`: a session of the driver that answers the CQL statements
+  with the row dicts of in-memory tables, and applies the writes of
+  cqlengine to them. Registered as the default connection of cqlengine
+  with `fake_cassandra_connection`.
+- `FakeRedis`: an in-memory Redis client (the commands used by the cache
+  and the coalescing of the searches, and pub/sub), for the
+  `REDIS_CLIENT_CLASS` option of `django_redis`. The clients of the same
+  location share the data, like the processes of an instance.
+
+The stand-ins do not evaluate the queries (except the restrictions of the
+CQL statements over the columns), they only give realistic responses with
+the same cost of parsing and hydration than the real services. They are
+also used by the tests that do not need a DSE cluster.
+"""
+import json
+import logging
+import operator
+import queue
+import re
+import threading
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+try:
+    from dse.cqlengine import columns, connection
+    from dse.protocol import ProtocolException
+except ImportError:
+    from cassandra.cqlengine import columns, connection
+    from cassandra.protocol import ProtocolException
+
+from haystack import connections as haystack_connections
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_QTIME = 1
+DEFAULT_FACET_LIMIT = 100
+
+FAKE_CONNECTION_NAME = "benchmark"
+
+LOCAL_PARAMS_REGEX = re.compile(r"^\{![^}]*\}")
+
+
+class StubSolrCore(object):
+    """
+    The documents of a core and the canned responses of its `select`
+    handler. The response has the requested page of the documents, the facet
+    counts of the requested fields and the `nextCursorMark` of the cursor
+    pagination.
+    """
+
+    def __init__(self, documents, qtime=DEFAULT_QTIME):
+        self.documents = documents
+        self.qtime = qtime
+        self._facet_counts = {}
+
+    def get_facet_counts(self, field):
+        counts = self._facet_counts.get(field, None)
+        if counts is None:
+            counts = Counter()
+            for document in self.documents:
+                value = document.get(field, None)
+                if isinstance(value, list):
+                    counts.update(str(item) for item in value)
+                elif value is not None:
+                    counts[str(value)] += 1
+            counts = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+            self._facet_counts[field] = counts
+        return counts
+
+    def get_facets(self, params):
+        facet_fields = {}
+        for field in params.get("facet.field", []):
+            field = LOCAL_PARAMS_REGEX.sub("", field)
+            limit = int(get_param(params, "f.{0}.facet.limit".format(field), get_param(params, "facet.limit", 100)))
+            mincount = int(
+                get_param(params, "f.{0}.facet.mincount".format(field), get_param(params, "facet.mincount", 1))
+            )
+
+            counts = [(value, count) for value, count in self.get_facet_counts(field) if count >= mincount]
+            if limit >= 0:
+                counts = counts[:limit]
+            facet_fields[field] = [item for pair in counts for item in pair]
+
+        facet_ranges = {}
+        for field in params.get("facet.range", []):
+            field = LOCAL_PARAMS_REGEX.sub("", field)
+            facet_ranges[field] = {
+                "counts": [],
+                "gap": get_param(params, "f.{0}.facet.range.gap".format(field)),
+                "start": get_param(params, "f.{0}.facet.range.start".format(field)),
+                "end": get_param(params, "f.{0}.facet.range.end".format(field)),
+            }
+
+        return {
+            "facet_queries": {},
+            "facet_fields": facet_fields,
+            "facet_ranges": facet_ranges,
+            "facet_intervals": {},
+            "facet_heatmaps": {},
+        }
+
+    def get_fields(self, params):
+        """
+        The stored fields requested in `fl`, None for all of them.
+        """
+        fields = set()
+        for value in params.get("fl", []):
+            fields.update(field for field in re.split(r"[,\s]+", value) if field and ":" not in field)
+        return None if not fields or "*" in fields else fields
+
+    def select(self, params):
+        rows = int(get_param(params, "rows", 10))
+        cursor_mark = get_param(params, "cursorMark")
+        if cursor_mark is not None:
+            start = 0 if cursor_mark == "*" else int(cursor_mark)
+        else:
+            start = int(get_param(params, "start", 0))
+
+        fields = self.get_fields(params)
+
+        docs = []
+        for position, document in enumerate(self.documents[start : start + rows], start=start):
+            doc = dict(document) if fields is None else {k: v for k, v in document.items() if k in fields}
+            doc["score"] = 1.0 / (position + 1)
+            docs.append(doc)
+
+        response = {
+            "responseHeader": {
+                "status": 0,
+                "QTime": self.qtime,
+                "params": {name: values[0] if len(values) == 1 else values for name, values in params.items()},
+            },
+            "response": {"numFound": len(self.documents), "start": start, "maxScore": 1.0, "docs": docs},
+        }
+
+        if get_param(params, "facet") in ("on", "true"):
+            response["facet_counts"] = self.get_facets(params)
+
+        if "json.facet" in params:
+            response["facets"] = {"count": len(self.documents)}
+
+        if cursor_mark is not None:
+            response["nextCursorMark"] = str(min(start + rows, len(self.documents)))
+
+        if "debug" in params:
+            response["debug"] = {"timing": {"time": float(self.qtime)}}
+
+        return response
+
+
+def get_param(params, name, default=None):
+    values = params.get(name, None)
+    return values[-1] if values else default
+
+
+class StubSolrRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        LOGGER.debug(format, *args)
+
+    def send_json(self, status, content):
+        self.send_body(status, json.dumps(content))
+
+    def send_body(self, status, body):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_select(self, params):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+
+        stub = self.server.stub
+        core = stub.cores.get(parts[-2], None) if len(parts) >= 2 and parts[-1] == "select" else None
+        if core is None:
+            self.send_json(404, {"error": {"msg": "Unknown path {0}".format(url.path), "code": 404}})
+            return
+
+        stub.count_request()
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        try:
+            body = json.dumps(core.select(params))
+        except Exception as ex:
+            LOGGER.exception("Unable to answer the request {0}".format(self.path))
+            self.send_json(500, {"error": {"msg": str(ex), "code": 500}})
+            return
+        self.send_body(200, body)
+
+    def do_GET(self):
+        self.handle_select(parse_qs(urlparse(self.path).query, keep_blank_values=True))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+
+        params = parse_qs(urlparse(self.path).query, keep_blank_values=True)
+        for name, values in parse_qs(body, keep_blank_values=True).items():
+            params.setdefault(name, []).extend(values)
+        self.handle_select(params)
+
+
+class StubSolrServer(object):
+    """
+    A local Solr with the given cores (name of the core: list of documents).
+    `latency` (seconds) is added to every request to simulate the network
+    and the search time.
+    """
+
+    def __init__(self, cores, qtime=DEFAULT_QTIME, latency=0.0, host="127.0.0.1", port=0):
+        self.cores = {name: StubSolrCore(documents, qtime=qtime) for name, documents in cores.items()}
+        self.latency = latency
+        self.address = (host, port)
+
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{0}:{1}/solr".format(host, port)
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        self._server = ThreadingHTTPServer(self.address, StubSolrRequestHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-solr-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+@contextmanager
+def stub_search_connection(url, using="default"):
+    """
+    Points the haystack connection `using` to the stub Solr server during
+    the block.
+    """
+    options = haystack_connections.connections_info[using]
+    previous_url = options["URL"]
+
+    options["URL"] = url
+    haystack_connections.reload(using)
+    try:
+        yield haystack_connections[using]
+    finally:
+        options["URL"] = previous_url
+        haystack_connections.reload(using)
+
+
+OPERATORS = {
+    "=": operator.eq,
+    "IN": lambda value, values: value in values,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+TABLE_REGEX = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(?:\"?\w+\"?\.)?\"?(\w+)\"?", re.IGNORECASE)
+COLUMNS_REGEX = re.compile(r"^\s*SELECT\s+(.*?)\s+FROM\b", re.IGNORECASE | re.DOTALL)
+WHERE_REGEX = re.compile(r"\"(\w+)\"\s*(=|IN|>=|<=|>|<)\s*%\((\w+)\)s", re.IGNORECASE)
+LIMIT_REGEX = re.compile(r"\bLIMIT\s+(\d+)", re.IGNORECASE)
+
+# The parts of the write statements rendered by cqlengine
+INSERT_REGEX = re.compile(r"^\s*INSERT\s+INTO\s+\S+\s*\(([^)]*)\)\s*VALUES\s*\(((?:%\(\w+\)s|[^)])*)\)", re.IGNORECASE)
+UPDATE_REGEX = re.compile(r"\bSET\s+(.*?)\s+WHERE\s+(.*?)(?:\s+IF\s+(.*))?$", re.IGNORECASE | re.DOTALL)
+DELETE_REGEX = re.compile(
+    r"^\s*DELETE\s+(.*?)\s*FROM\s+.*?\s+WHERE\s+(.*?)(?:\s+IF\s+(.*))?$", re.IGNORECASE | re.DOTALL
+)
+USING_REGEX = re.compile(r"\s+USING\s+(?:TTL|TIMESTAMP)\s+\S+(?:\s+AND\s+(?:TTL|TIMESTAMP)\s+\S+)*", re.IGNORECASE)
+ASSIGNMENT_REGEX = re.compile(
+    r"\"(?P<column>\w+)\"(?:\[%\((?P<item>\w+)\)s\])?\s*=\s*"
+    r"(?:\"\w+\"\s*(?P<operation>[+-])\s*%\((?P<value>\w+)\)s"
+    r"|%\((?P<prepend>\w+)\)s\s*\+\s*\"\w+\""
+    r"|%\((?P<assign>\w+)\)s)"
+)
+PLACEHOLDER_REGEX = re.compile(r"%\((\w+)\)s")
+
+
+def _to_datetime(value):
+    # cqlengine writes the timestamps as milliseconds since the epoch, the
+    # driver returns naive datetimes
+    if isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value / 1000.0)
+    return value
+
+
+def _assign(current, value):
+    return value
+
+
+def _add(current, value):
+    if current is None:
+        return value
+    elif isinstance(current, dict):
+        return dict(current, **value)
+    elif isinstance(current, (set, frozenset)):
+        return set(current) | set(value)
+    return current + value
+
+
+def _subtract(current, value):
+    if current is None:
+        return None
+    elif isinstance(current, dict):
+        return {key: item for key, item in current.items() if key not in value}
+    elif isinstance(current, (set, frozenset)):
+        return set(current) - set(value)
+    elif isinstance(current, list):
+        return [item for item in current if item not in value]
+    return current - value
+
+
+def _prepend(current, value):
+    return value + (current or [])
+
+
+def _set_item(current, item, value):
+    current = list(current) if isinstance(current, list) else dict(current or {})
+    current[item] = value
+    return current
+
+
+class FakeTable(object):
+    """
+    The rows of a table, indexed by the values of the partition key. The
+    rows are identified by the values of the `primary_key` columns (the
+    partition key by default). `converters` are applied to the values of the
+    written columns (name of the column: function).
+    """
+
+    def __init__(self, rows, partition_key, primary_key=None, converters=None):
+        self.rows = rows
+        self.partition_key = partition_key
+        self.primary_key = primary_key or partition_key
+        self.converters = converters or {}
+
+        self.partitions = {}
+        for row in rows:
+            self.partitions.setdefault(self.get_partition(row), []).append(row)
+
+    def get_partition(self, values):
+        return tuple(values[name] for name in self.partition_key)
+
+    def get_rows(self, restrictions):
+        values = dict((name, value) for name, op, value in restrictions if op == "=")
+        if all(name in values for name in self.partition_key):
+            rows = self.partitions.get(self.get_partition(values), [])
+        else:
+            rows = self.rows
+
+        return [row for row in rows if all(OPERATORS[op](row.get(name), value) for name, op, value in restrictions)]
+
+    def get_row(self, key):
+        for row in self.partitions.get(self.get_partition(key), []):
+            if all(row.get(name) == key[name] for name in self.primary_key):
+                return row
+        return None
+
+    def upsert(self, key, values):
+        """
+        Creates or updates the row of the primary key `key` with the
+        `values`, a dict of name of the column: function that receives the
+        current value of the column and returns the new one.
+        """
+        row = self.get_row(key)
+        if row is None:
+            row = {name: key[name] for name in self.primary_key}
+            self.rows.append(row)
+            self.partitions.setdefault(self.get_partition(key), []).append(row)
+
+        for name, update in values.items():
+            converter = self.converters.get(name, None)
+            value = update(row.get(name, None))
+            row[name] = converter(value) if converter and value is not None else value
+        return row
+
+    def delete(self, rows):
+        for row in rows:
+            self.rows.remove(row)
+            self.partitions[self.get_partition(row)].remove(row)
+
+
+class FakeResultSet(object):
+    """
+    The `ResultSet` of the driver, a page of rows.
+    """
+
+    def __init__(self, rows, paging_state=None):
+        self.current_rows = rows
+        self.paging_state = paging_state
+
+    @property
+    def has_more_pages(self):
+        return self.paging_state is not None
+
+    @property
+    def was_applied(self):
+        # The result of a lightweight transaction (IF EXISTS...)
+        if len(self.current_rows) == 1 and "[applied]" in self.current_rows[0]:
+            return self.current_rows[0]["[applied]"]
+        return True
+
+    def one(self):
+        return self.current_rows[0] if self.current_rows else None
+
+    def all(self):
+        return list(self.current_rows)
+
+    def __iter__(self):
+        return iter(self.current_rows)
+
+    def __len__(self):
+        return len(self.current_rows)
+
+
+class FakeResponseFuture(object):
+    """
+    The `ResponseFuture` of the driver, already resolved. Used by the
+    concurrent executions (`execute_concurrent`).
+    """
+
+    _col_names = None
+    _col_types = None
+
+    def __init__(self, query, result=None, error=None):
+        self.query = query
+        self._result = result
+        self._error = error
+
+    @property
+    def has_more_pages(self):
+        return self._result is not None and self._result.has_more_pages
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def clear_callbacks(self):
+        pass
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=(), **kwargs):
+        if self._error is not None:
+            errback(self._error, *errback_args)
+        else:
+            callback(self._result.current_rows, *callback_args)
+
+
+class FakeCluster(object):
+    protocol_version = 4
+
+    def shutdown(self):
+        pass
+
+
+class FakeSession(object):
+    """
+    A session of the driver over in-memory tables. The SELECT statements
+    return the rows that satisfy the restrictions over the columns (`=`,
+    `IN`, `>`...), the projection of the selected columns, the LIMIT and the
+    pages of `fetch_size` rows (the paging state is the position of the
+    next row). The INSERT, UPDATE and DELETE statements of
+    cqlengine (also in batches) are applied to the tables, with the result
+    of the lightweight transactions (`IF EXISTS`, `IF NOT EXISTS`). The rest
+    of the statements are accepted and ignored.
+    """
+
+    def __init__(self):
+        self.cluster = FakeCluster()
+        self.hosts = []
+        self.tables = {}
+        self.statements = Counter()
+
+    def add_table(self, name, rows, partition_key, primary_key=None, converters=None):
+        self.tables[name] = FakeTable(rows, partition_key, primary_key=primary_key, converters=converters)
+
+    def add_model(self, model, rows):
+        self.add_table(
+            model._raw_column_family_name(),
+            rows,
+            [column.db_field_name for column in model._partition_keys.values()],
+            primary_key=[column.db_field_name for column in model._primary_keys.values()],
+            converters={
+                column.db_field_name: _to_datetime
+                for column in model._columns.values()
+                if isinstance(column, columns.DateTime)
+            },
+        )
+
+    def execute_async(self, query, parameters=None, timeout=None, paging_state=None, **kwargs):
+        try:
+            return FakeResponseFuture(query, result=self.execute(query, parameters, paging_state=paging_state))
+        except Exception as ex:
+            return FakeResponseFuture(query, error=ex)
+
+    def execute(self, query, parameters=None, timeout=None, paging_state=None, **kwargs):
+        query_string = getattr(query, "query_string", query)
+        fetch_size = getattr(query, "fetch_size", None)
+        parameters = parameters or {}
+
+        statement_type = query_string.split(None, 1)[0].upper()
+        self.statements[statement_type] += 1
+        if statement_type == "BEGIN":
+            # The statements of the batch, one per line
+            for line in query_string.splitlines()[1:-1]:
+                self.execute_write(line.strip(), parameters)
+            return FakeResultSet([])
+        elif statement_type in ("INSERT", "UPDATE", "DELETE"):
+            return self.execute_write(query_string, parameters)
+        elif statement_type != "SELECT":
+            return FakeResultSet([])
+
+        table = self.tables.get(TABLE_REGEX.search(query_string).group(1), None)
+        if table is None:
+            return FakeResultSet([])
+
+        rows = table.get_rows(self.get_restrictions(query_string, parameters))
+
+        limit = LIMIT_REGEX.search(query_string)
+        if limit:
+            rows = rows[: int(limit.group(1))]
+
+        selected = COLUMNS_REGEX.search(query_string).group(1).strip()
+        if selected.upper().startswith("COUNT("):
+            return FakeResultSet([{"count": len(rows)}])
+        elif selected != "*":
+            names = [name.strip().strip('"') for name in selected.split(",")]
+            rows = [{name: row.get(name) for name in names} for row in rows]
+
+        if not isinstance(fetch_size, int) or fetch_size <= 0:
+            return FakeResultSet(rows)
+
+        try:
+            start = int(paging_state) if paging_state else 0
+        except ValueError:
+            # The error of Cassandra for the paging states it can not decode
+            raise ProtocolException(ProtocolException.error_code, "Invalid value for the paging state", None)
+        end = start + fetch_size
+        return FakeResultSet(rows[start:end], str(end).encode("ascii") if end < len(rows) else None)
+
+    @staticmethod
+    def get_restrictions(query_string, parameters):
+        # The values of `IN` come wrapped in a quoter of cqlengine (`InQuoter`)
+        return [
+            (name, op.upper(), getattr(parameters[key], "value", parameters[key]))
+            for name, op, key in WHERE_REGEX.findall(query_string)
+        ]
+
+    def execute_write(self, query_string, parameters):
+        table = self.tables.get(TABLE_REGEX.search(query_string).group(1), None)
+        if table is None:
+            return FakeResultSet([])
+
+        query_string = USING_REGEX.sub("", query_string)
+        statement_type = query_string.split(None, 1)[0].upper()
+
+        if statement_type == "INSERT":
+            match = INSERT_REGEX.match(query_string)
+            names = [name.strip().strip('"') for name in match.group(1).split(",")]
+            keys = PLACEHOLDER_REGEX.findall(match.group(2))
+            values = {name: parameters[key] for name, key in zip(names, keys)}
+
+            if re.search(r"\bIF\s+NOT\s+EXISTS\b", query_string, re.IGNORECASE):
+                if table.get_row(values) is not None:
+                    return FakeResultSet([{"[applied]": False}])
+                table.upsert(values, {name: partial(_assign, value=value) for name, value in values.items()})
+                return FakeResultSet([{"[applied]": True}])
+
+            table.upsert(values, {name: partial(_assign, value=value) for name, value in values.items()})
+            return FakeResultSet([])
+
+        if statement_type == "UPDATE":
+            match = UPDATE_REGEX.search(query_string)
+            assignments, where, condition = match.groups()
+        else:
+            match = DELETE_REGEX.match(query_string)
+            assignments, where, condition = match.groups()
+
+        key = {name: value for name, op, value in self.get_restrictions(where, parameters) if op == "="}
+        is_lwt = condition is not None and condition.strip().upper() == "EXISTS"
+
+        if statement_type == "UPDATE":
+            if is_lwt and table.get_row(key) is None:
+                return FakeResultSet([{"[applied]": False}])
+            table.upsert(key, self.get_updates(assignments, parameters))
+        else:
+            rows = table.get_rows(self.get_restrictions(where, parameters))
+            if is_lwt and not rows:
+                return FakeResultSet([{"[applied]": False}])
+
+            names = [name.strip().strip('"') for name in assignments.split(",") if name.strip()]
+            if names:
+                # The columns (or the items of a map) of the rows
+                for row in rows:
+                    for name in names:
+                        item = re.match(r"^(\w+)\"?\[%\((\w+)\)s\]$", name)
+                        if item and isinstance(row.get(item.group(1)), dict):
+                            row[item.group(1)].pop(parameters[item.group(2)], None)
+                        else:
+                            row[name] = None
+            else:
+                table.delete(rows)
+
+        return FakeResultSet([{"[applied]": True}]) if is_lwt else FakeResultSet([])
+
+    @staticmethod
+    def get_updates(assignments, parameters):
+        updates = {}
+        for match in ASSIGNMENT_REGEX.finditer(assignments):
+            if match.group("item"):
+                item, value = parameters[match.group("item")], parameters[match.group("assign")]
+                update = partial(_set_item, item=item, value=value)
+            elif match.group("operation"):
+                function = _add if match.group("operation") == "+" else _subtract
+                update = partial(function, value=parameters[match.group("value")])
+            elif match.group("prepend"):
+                update = partial(_prepend, value=parameters[match.group("prepend")])
+            else:
+                update = partial(_assign, value=parameters[match.group("assign")])
+            updates[match.group("column")] = update
+        return updates
+
+
+@contextmanager
+def fake_cassandra_connection(session, name=FAKE_CONNECTION_NAME):
+    """
+    Registers the fake session as the default connection of cqlengine
+    during the block.
+    """
+    previous = connection._connections.get(connection.DEFAULT_CONNECTION, None)
+
+    conn = connection.Connection(name, hosts=session.hosts)
+    conn.cluster, conn.session = session.cluster, session
+    connection._connections[name] = conn
+    connection.set_default_connection(name)
+    try:
+        yield conn
+    finally:
+        connection.unregister_connection(name)
+        if previous is not None:
+            connection._connections[connection.DEFAULT_CONNECTION] = previous
+            connection.cluster, connection.session = previous.cluster, previous.session
+
+
+class FakeRedisServer(object):
+    """
+    The data and the subscriptions of a fake Redis (see `FakeRedis`).
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.subscriptions = []
+        self.published = Counter()
+        self.lock = threading.RLock()
+
+    def get_value(self, name):
+        value, expires = self.data.get(name, (None, None))
+        if expires is not None and expires <= time.monotonic():
+            del self.data[name]
+            return None
+        return value
+
+    def drop_subscriptions(self):
+        """
+        Closes all the subscriptions, as a restart of Redis.
+        """
+        with self.lock:
+            subscriptions, self.subscriptions = self.subscriptions, []
+        for pubsub in subscriptions:
+            pubsub.messages.put(ConnectionError("Connection closed by server."))
+
+
+_fake_redis_servers = {}
+_fake_redis_servers_lock = threading.Lock()
+
+
+def get_fake_redis_server(location):
+    with _fake_redis_servers_lock:
+        return _fake_redis_servers.setdefault(location, FakeRedisServer())
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+class FakePubSub(object):
+    def __init__(self, server):
+        self.server = server
+        self.channels = set()
+        self.messages = queue.Queue()
+
+    def subscribe(self, *channels):
+        with self.server.lock:
+            if self not in self.server.subscriptions:
+                self.server.subscriptions.append(self)
+            for channel in channels:
+                self.channels.add(_to_bytes(channel))
+                self.messages.put({"type": "subscribe", "channel": _to_bytes(channel), "data": len(self.channels)})
+
+    def get_message(self, timeout=0.0):
+        try:
+            message = self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    def close(self):
+        with self.server.lock:
+            if self in self.server.subscriptions:
+                self.server.subscriptions.remove(self)
+
+
+class FakeLock(object):
+    """
+    The lock of `redis-py` (`acquire` without blocking and `release`).
+    """
+
+    def __init__(self, client, name, timeout=None):
+        self.client = client
+        self.name = name
+        self.timeout = timeout
+        self.local = threading.local()
+        self.local.token = None
+
+    def acquire(self, blocking=None, token=None):
+        token = _to_bytes(token)
+        px = int(self.timeout * 1000) if self.timeout is not None else None
+        if self.client.set(self.name, token, nx=True, px=px):
+            self.local.token = token
+            return True
+        return False
+
+    def release(self):
+        token, self.local.token = self.local.token, None
+        with self.client.server.lock:
+            if token is None or self.client.server.get_value(self.name) != token:
+                raise RuntimeError("Cannot release a lock that is no longer owned")
+            del self.client.server.data[self.name]
+
+
+class FakePipeline(object):
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        def queue_command(*args, **kwargs):
+            self.commands.append(partial(command, *args, **kwargs))
+            return self
+
+        return queue_command
+
+    def execute(self):
+        with self.client.server.lock:
+            results = [command() for command in self.commands]
+        self.commands = []
+        return results
+
+
+class FakeRedis(object):
+    """
+    An in-memory Redis client with the commands of the cache backends
+    (`get`, `set`, `mget`, `delete`...), `lock` and pub/sub. The clients of
+    the same location (host, port and db of the connection pool) share the
+    data.
+    """
+
+    def __init__(self, connection_pool=None, location=None, **kwargs):
+        if location is None and connection_pool is not None:
+            params = connection_pool.connection_kwargs
+            location = (params.get("host", None), params.get("port", None), params.get("db", None))
+        self.server = get_fake_redis_server(location)
+
+    def get(self, name):
+        with self.server.lock:
+            return self.server.get_value(name)
+
+    def mget(self, *names):
+        with self.server.lock:
+            return [self.server.get_value(name) for name in names]
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False, **kwargs):
+        timeout = px / 1000.0 if px is not None else ex
+        with self.server.lock:
+            exists = self.server.get_value(name) is not None
+            if (nx and exists) or (xx and not exists):
+                return None
+            expires = time.monotonic() + timeout if timeout is not None else None
+            self.server.data[name] = (_to_bytes(value), expires)
+            return True
+
+    def exists(self, *names):
+        with self.server.lock:
+            return sum(1 for name in names if self.server.get_value(name) is not None)
+
+    def delete(self, *names):
+        with self.server.lock:
+            return sum(1 for name in names if self.server.data.pop(name, None) is not None)
+
+    def flushdb(self):
+        with self.server.lock:
+            self.server.data.clear()
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def lock(self, name, timeout=None, **kwargs):
+        return FakeLock(self, name, timeout=timeout)
+
+    def publish(self, channel, message):
+        channel = _to_bytes(channel)
+        with self.server.lock:
+            self.server.published[channel] += 1
+            subscriptions = [pubsub for pubsub in self.server.subscriptions if channel in pubsub.channels]
+        for pubsub in subscriptions:
+            pubsub.messages.put({"type": "message", "channel": channel, "data": _to_bytes(message)})
+        return len(subscriptions)
+
+    def pubsub(self, **kwargs):
+        return FakePubSub(self.server)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+import json
+import logging
+
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+
+from caravaggio_rest_api.benchmarks import datasets, report, runner, stubs
+from caravaggio_rest_api.benchmarks.micro import cases
+from caravaggio_rest_api.benchmarks.micro.__main__ import BASELINE_PATH
+
+from caravaggio_rest_api.example.company.models import Company
+
+_logger = logging.getLogger()
+
+
+class BenchmarkSuiteTest(CaravaggioBaseTest):
+    """ Test module for the offline benchmarks """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.companies = datasets.generate_companies(20, user=cls.user.username)
+
+    def step01_dataset(self):
+        again = datasets.generate_companies(20, user=self.user.username)
+        self.assertEqual([company._id for company in self.companies], [company._id for company in again])
+        self.assertEqual([company.name for company in self.companies], [company.name for company in again])
+
+        row = datasets.to_row(self.companies[0])
+        self.assertEqual(row["_id"], self.companies[0]._id)
+        self.assertTrue(all(key.startswith("websites_") for key in row["websites"].keys()))
+
+        document = datasets.to_solr_document(self.companies[0])
+        self.assertEqual(document["_id"], str(self.companies[0]._id))
+        self.assertEqual(document["country_code_exact"], document["country_code"])
+        self.assertTrue(document["created_at"].endswith("Z"))
+        json.dumps(document)
+
+    def step02_fake_session(self):
+        session = stubs.FakeSession()
+        session.add_model(Company, [datasets.to_row(company) for company in self.companies])
+
+        with stubs.fake_cassandra_connection(session):
+            company = Company.objects.get(_id=self.companies[3]._id)
+            self.assertEqual(company.name, self.companies[3].name)
+
+            ids = [self.companies[1]._id, self.companies[5]._id]
+            self.assertEqual(set(c._id for c in Company.objects.filter(_id__in=ids)), set(ids))
+
+            self.assertEqual(len(list(Company.objects.all().limit(7))), 7)
+            self.assertEqual(Company.objects.count(), 20)
+
+        self.assertGreater(session.statements["SELECT"], 0)
+
+        # The pages of `fetch_size` rows
+        session.add_table("pages", [{"id": position} for position in range(5)], ["id"])
+        query = type("Query", (), {"query_string": "SELECT * FROM pages", "fetch_size": 2})()
+        first = session.execute(query)
+        self.assertEqual([row["id"] for row in first], [0, 1])
+        self.assertTrue(first.has_more_pages)
+        last = session.execute(query, paging_state=b"4")
+        self.assertEqual([row["id"] for row in last], [4])
+        self.assertFalse(last.has_more_pages)
+
+    def step03_stub_solr(self):
+        documents = [datasets.to_solr_document(company) for company in self.companies]
+        with stubs.StubSolrServer({"caravaggio.company": documents}) as server:
+            params = urlencode(
+                [("q", "*:*"), ("rows", 5), ("fl", "_id,name"), ("facet", "on"), ("facet.field", "country_code_exact")]
+            )
+            with urlopen("{0}/caravaggio.company/select?{1}".format(server.url, params)) as response:
+                content = json.loads(response.read().decode("utf-8"))
+
+            self.assertEqual(content["response"]["numFound"], 20)
+            self.assertEqual(len(content["response"]["docs"]), 5)
+            self.assertEqual(set(content["response"]["docs"][0].keys()), {"_id", "name", "score"})
+            counts = content["facet_counts"]["facet_fields"]["country_code_exact"]
+            self.assertEqual(sum(counts[1::2]), 20)
+
+            request = Request(
+                "{0}/caravaggio.company/select".format(server.url),
+                data=urlencode([("q", "*:*"), ("start", 18)]).encode("utf-8"),
+            )
+            with urlopen(request) as response:
+                content = json.loads(response.read().decode("utf-8"))
+            self.assertEqual(len(content["response"]["docs"]), 2)
+
+            with self.assertRaises(HTTPError) as context:
+                urlopen("{0}/unknown/select?q=*:*".format(server.url))
+            self.assertEqual(context.exception.code, 404)
+
+            # Only the requests to the cores are counted
+            self.assertEqual(server.requests, 2)
+
+    def step04_report(self):
+        phases = report.parse_server_timing('solr;dur=12.5, cassandra;dur=3;desc="Cassandra", total;dur=20')
+        self.assertEqual(phases, {"solr": 0.0125, "cassandra": 0.003, "total": 0.02})
+
+        summary = report.summarize([0.003, 0.001, 0.002], scale=1000)
+        self.assertEqual(summary["count"], 3)
+        self.assertEqual(summary["min"], 1)
+        self.assertEqual(summary["p50"], 2)
+        self.assertEqual(summary["max"], 3)
+        self.assertIsNone(report.summarize([]))
+
+        baseline = {"scenarios": {"list": {"requests_per_second": 100, "latency": {"p50": 10, "p95": 20}}}}
+        current = {"scenarios": {"list": {"requests_per_second": 200, "latency": {"p50": 5, "p95": 40}}}}
+        comparison = report.compare_reports(baseline, current)["list"]
+        self.assertEqual(comparison["requests_per_second"]["ratio"], 2)
+        self.assertTrue(comparison["requests_per_second"]["improved"])
+        self.assertTrue(comparison["latency_p50"]["improved"])
+        self.assertFalse(comparison["latency_p95"]["improved"])
+
+    def step05_run(self):
+        scenarios = [scenario for scenario in runner.SCENARIOS if scenario.name in ("search_text", "list", "retrieve")]
+        benchmark = runner.BenchmarkRunner(
+            self.user, scale=20, requests=3, warmup=1, allocation_requests=1, page_size=5, scenarios=scenarios
+        )
+        results = benchmark.run()
+        _logger.info(json.dumps(results, indent=2))
+
+        self.assertEqual(list(results["scenarios"].keys()), ["search_text", "list", "retrieve"])
+        for name, scenario in results["scenarios"].items():
+            self.assertNotIn("error", scenario, name)
+            self.assertEqual(scenario["status_codes"], {"200": 3}, name)
+            self.assertGreater(scenario["requests_per_second"], 0)
+            self.assertEqual(scenario["latency"]["count"], 3)
+            self.assertEqual(scenario["allocations"]["peak_bytes"]["count"], 1)
+
+        self.assertGreater(results["scenarios"]["search_text"]["solr_requests"], 0)
+        self.assertGreater(results["scenarios"]["list"]["cql_statements"], 0)
+
+        comparison = report.compare_reports(results, json.loads(json.dumps(results)))
+        self.assertEqual(comparison["list"]["requests_per_second"]["ratio"], 1)
+
+
+class MicroBenchmarksTest(CaravaggioBaseTest):
+    """ Test module for the micro-benchmarks """
+
+    def step01_run(self):
+        results = cases.run_benchmarks(cases.get_cases(docs=[2], fields=[3]), repeats=2, min_time=0.001)
+
+        self.assertEqual(
+            set(case["benchmark"] for case in results["results"].values()),
+            set(benchmark.name for benchmark in cases.BENCHMARKS),
+        )
+        for name, case in results["results"].items():
+            self.assertEqual(case["fields"], 3, name)
+            self.assertEqual(case["time_us"]["count"], 2, name)
+            self.assertGreater(case["relative_time"]["min"], 0, name)
+        json.dumps(results)
+
+    def step02_budgets(self):
+        baseline = {
+            "results": {
+                "fast": {"relative_time": {"p50": 1.0}},
+                "slow": {"relative_time": {"p50": 1.0}},
+                "noisy": {"relative_time": {"p50": 1.0}},
+            }
+        }
+        current = {
+            "results": {
+                # The median is compared, not the best repetition
+                "fast": {"relative_time": {"min": 0.5, "p50": 0.8}, "threshold": None},
+                "slow": {"relative_time": {"min": 1.0, "p50": 1.5}, "threshold": None},
+                "noisy": {"relative_time": {"p50": 1.5}, "threshold": 2.0},
+                "new": {"relative_time": {"p50": 1.0}, "threshold": None},
+            }
+        }
+        budgets = report.check_budgets(baseline, current, 1.3)
+
+        self.assertEqual(set(budgets.keys()), {"fast", "slow", "noisy"})
+        self.assertFalse(budgets["fast"]["regressed"])
+        self.assertTrue(budgets["slow"]["regressed"])
+        self.assertEqual(budgets["slow"]["ratio"], 1.5)
+        self.assertFalse(budgets["noisy"]["regressed"])
+
+    def step03_baseline(self):
+        # The stored baseline has all the default cases
+        baseline = report.load_report(BASELINE_PATH)
+        for case in cases.get_cases():
+            self.assertIn(case.case_name, baseline["results"])
@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+Two-tier cache backend: a bounded in-process LRU with a short timeout in
+front of Redis (`django_redis`).
+
+The reads of the hot keys (ex. the serialized companies of the DRF cache)
+are served from the memory of the process, without the round trip to
+Redis. The writes go to Redis and to the local tier of the process, and the
+keys written or deleted (ex. `clear_for_instance`) are broadcast over a
+Redis pub/sub channel, every instance evicts its local copies.
+
+The local tier is only used while the process is subscribed to the channel,
+if the subscription is lost (ex. Redis is restarted) the local tier is
+cleared and all the reads go to Redis until the process subscribes again.
+
+    CACHES = {
+        "default": {
+            "BACKEND": "caravaggio_rest_api.cache.TwoTierRedisCache",
+            "LOCATION": "redis://127.0.0.1:6379/1",
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+                "LOCAL_MAX_ENTRIES": 1000,
+                "LOCAL_TIMEOUT": 5,
+            },
+        },
+    }
+
+The hit ratio of every tier is returned by `get_stats()`. The connection to
+Redis is the one of `django_redis`, a stand-in of Redis can be used with its
+`REDIS_CLIENT_CLASS` option.
+"""
+import fnmatch
+import json
+import logging
+import os
+import pickle
+import re
+import threading
+import uuid
+
+from collections import OrderedDict
+from time import monotonic
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from django_redis.cache import RedisCache
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_MAX_ENTRIES = 1000
+DEFAULT_LOCAL_TIMEOUT = 5
+DEFAULT_INVALIDATION_CHANNEL = "caravaggio_rest_api:cache:invalidations"
+# The keys (before the prefix and version) never kept in the local tier:
+# the throttling histories are written in every request
+DEFAULT_LOCAL_EXCLUDE = ("throttle_*", "*_accesses")
+DEFAULT_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 30
+
+# Seconds waiting for a message before checking if we have to stop
+LISTEN_TIMEOUT = 1.0
+
+_MISSING = object()
+
+
+class LocalCache(object):
+    """
+    Bounded LRU of pickled values (the callers can change the returned
+    values) that expire after `timeout` seconds.
+
+    Every eviction increases the `generation`, a value read from Redis is
+    only stored if no key was evicted during the read (`fill`), otherwise
+    we could store a value that was just invalidated.
+    """
+
+    def __init__(self, max_entries=DEFAULT_LOCAL_MAX_ENTRIES, timeout=DEFAULT_LOCAL_TIMEOUT):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.generation = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            entry = self._data.get(key, None)
+            if entry is None:
+                return default
+
+            expires, pickled = entry
+            if expires <= monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+
+        return pickle.loads(pickled)
+
+    def _get_expires(self, timeout):
+        # The local copy never outlives the value in Redis
+        if timeout is None or timeout > self.timeout:
+            timeout = self.timeout
+        return monotonic() + timeout if timeout > 0 else None
+
+    def _store(self, key, expires, pickled):
+        self._data[key] = (expires, pickled)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def set(self, key, value, timeout=None):
+        expires = self._get_expires(timeout)
+        if expires is None:
+            self.delete_many([key])
+            return
+
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._store(key, expires, pickled)
+
+    def fill(self, key, value, generation):
+        """
+        Stores a value read from Redis, if nothing was evicted since the
+        `generation` was taken.
+        """
+        expires = self._get_expires(None)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if self.generation == generation:
+                self._store(key, expires, pickled)
+
+    def delete_many(self, keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def delete_pattern(self, pattern):
+        with self._lock:
+            self.generation += 1
+            for key in [key for key in self._data.keys() if fnmatch.fnmatchcase(key, pattern)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+
+class CacheStats(object):
+    """
+    Counters of the lookups of every tier and of the invalidations.
+    """
+
+    COUNTERS = (
+        "local_hits",
+        "local_misses",
+        "redis_hits",
+        "redis_misses",
+        "invalidations_sent",
+        "invalidations_received",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def add(self, name, count=1):
+        if count:
+            with self._lock:
+                self.counters[name] += count
+
+    @staticmethod
+    def _get_ratio(hits, misses):
+        return round(hits / (hits + misses), 4) if hits + misses else None
+
+    def to_dict(self):
+        with self._lock:
+            counters = dict(self.counters)
+
+        return {
+            "local": {
+                "hits": counters["local_hits"],
+                "misses": counters["local_misses"],
+                "hit_ratio": self._get_ratio(counters["local_hits"], counters["local_misses"]),
+            },
+            "redis": {
+                "hits": counters["redis_hits"],
+                "misses": counters["redis_misses"],
+                "hit_ratio": self._get_ratio(counters["redis_hits"], counters["redis_misses"]),
+            },
+            "hit_ratio": self._get_ratio(counters["local_hits"] + counters["redis_hits"], counters["redis_misses"]),
+            "invalidations": {
+                "sent": counters["invalidations_sent"],
+                "received": counters["invalidations_received"],
+            },
+        }
+
+
+class TwoTierRedisCache(RedisCache):
+    """
+    The `django_redis` cache with a per-process LRU in front (see the module
+    documentation). Options, besides the ones of `django_redis`:
+
+    - `LOCAL_MAX_ENTRIES`: the max number of keys in the local tier.
+    - `LOCAL_TIMEOUT`: the max seconds a key is kept in the local tier.
+    - `LOCAL_EXCLUDE`: patterns (fnmatch) of the keys never kept in the
+      local tier, ex. the counters of the throttling.
+    - `INVALIDATION_CHANNEL`: the Redis pub/sub channel of the
+      invalidations.
+    """
+
+    def __init__(self, server, params):
+        super().__init__(server, params)
+
+        options = params.get("OPTIONS", {})
+        self.local = LocalCache(
+            max_entries=int(options.get("LOCAL_MAX_ENTRIES", DEFAULT_LOCAL_MAX_ENTRIES)),
+            timeout=float(options.get("LOCAL_TIMEOUT", DEFAULT_LOCAL_TIMEOUT)),
+        )
+        local_exclude = options.get("LOCAL_EXCLUDE", DEFAULT_LOCAL_EXCLUDE)
+        self._local_exclude_regex = (
+            re.compile("|".join(fnmatch.translate(pattern) for pattern in local_exclude)) if local_exclude else None
+        )
+        self.channel = options.get("INVALIDATION_CHANNEL", DEFAULT_INVALIDATION_CHANNEL)
+        self.stats = CacheStats()
+
+        # The id of the process in the invalidation messages, we ignore our
+        # own messages
+        self._origin = None
+        self._listener = None
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+        self._subscribed = threading.Event()
+        self._stop = threading.Event()
+
+    # Invalidations
+
+    def _ensure_listener(self):
+        # The thread does not survive a fork (ex. gunicorn --preload), every
+        # process starts its own listener
+        if self._listener_pid == os.getpid():
+            return
+
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+
+            self.local.clear()
+            self._subscribed = threading.Event()
+            self._stop = threading.Event()
+            self._origin = uuid.uuid4().hex
+            self._listener = threading.Thread(
+                target=self._listen, args=(self._subscribed, self._stop), name="cache-invalidations", daemon=True
+            )
+            self._listener_pid = os.getpid()
+            self._listener.start()
+
+    def _listen(self, subscribed, stop):
+        delay = DEFAULT_RECONNECT_DELAY
+        while not stop.is_set():
+            pubsub = None
+            try:
+                pubsub = self.client.get_client(write=True).pubsub()
+                pubsub.subscribe(self.channel)
+                while not stop.is_set():
+                    message = pubsub.get_message(timeout=LISTEN_TIMEOUT)
+                    if message is None:
+                        continue
+
+                    if message["type"] == "subscribe":
+                        # Anything received while we were not subscribed is
+                        # lost
+                        self.local.clear()
+                        subscribed.set()
+                        delay = DEFAULT_RECONNECT_DELAY
+                    elif message["type"] == "message":
+                        self._handle_invalidation(message["data"])
+            except Exception as ex:
+                LOGGER.warning(
+                    "Lost the subscription to the cache invalidations, retrying in {0}s: {1}".format(delay, ex)
+                )
+            finally:
+                subscribed.clear()
+                self.local.clear()
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+            stop.wait(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def _handle_invalidation(self, data):
+        try:
+            message = json.loads(data.decode("utf-8") if isinstance(data, bytes) else data)
+        except ValueError:
+            LOGGER.warning("Invalid cache invalidation: {0!r}".format(data))
+            return
+
+        if message.get("origin", None) == self._origin:
+            return
+
+        self.stats.add("invalidations_received")
+        if message.get("clear", False):
+            self.local.clear()
+        if message.get("keys", None):
+            self.local.delete_many(message["keys"])
+        if message.get("pattern", None):
+            self.local.delete_pattern(message["pattern"])
+
+    def _publish(self, **message):
+        """
+        Broadcasts an invalidation to the other processes: `keys`, `pattern`
+        or `clear`.
+        """
+        self._ensure_listener()
+        message["origin"] = self._origin
+        try:
+            self.client.get_client(write=True).publish(self.channel, json.dumps(message))
+            self.stats.add("invalidations_sent")
+        except Exception as ex:
+            # The other processes will keep their copies until they expire
+            LOGGER.warning("Unable to publish the cache invalidation: {0}".format(ex))
+
+    def _evict(self, keys, version=None, prefix=None):
+        """
+        Evicts the keys from the local tier of every process. The keys never
+        kept in the local tier (`LOCAL_EXCLUDE`) are not broadcast, they are
+        written in every request.
+        """
+        keys = [
+            str(self.client.make_key(key, version=version, prefix=prefix)) for key in keys if self.is_local_key(key)
+        ]
+        if keys:
+            self.local.delete_many(keys)
+            self._publish(keys=keys)
+
+    def stop_listener(self):
+        """
+        Stops the subscription to the invalidations (ex. in the tests), the
+        next operation subscribes again.
+        """
+        self._stop.set()
+        self._subscribed.clear()
+        self._listener_pid = None
+        self.local.clear()
+
+    # Local tier
+
+    def is_local_active(self):
+        self._ensure_listener()
+        return self._subscribed.is_set()
+
+    def is_local_key(self, key):
+        return self._local_exclude_regex is None or self._local_exclude_regex.match(str(key)) is None
+
+    def get_stats(self):
+        """
+        The hit ratio of every tier since the process started (or the last
+        `reset_stats`), the size of the local tier and if it is active.
+        """
+        stats = self.stats.to_dict()
+        stats["local"]["entries"] = len(self.local)
+        stats["local"]["max_entries"] = self.local.max_entries
+        stats["local"]["active"] = self._subscribed.is_set()
+        return stats
+
+    def reset_stats(self):
+        self.stats.reset()
+
+    # Reads
+
+    def get(self, key, default=None, version=None, client=None):
+        if client is not None or not self.is_local_key(key) or not self.is_local_active():
+            value = super().get(key, default=_MISSING, version=version, client=client)
+            self.stats.add("redis_hits" if value is not _MISSING else "redis_misses")
+            return default if value is _MISSING else value
+
+        local_key = str(self.make_key(key, version=version))
+        value = self.local.get(local_key)
+        if value is not _MISSING:
+            self.stats.add("local_hits")
+            return value
+        self.stats.add("local_misses")
+
+        generation = self.local.generation
+        value = super().get(key, default=_MISSING, version=version)
+        if value is _MISSING:
+            self.stats.add("redis_misses")
+            return default
+
+        self.stats.add("redis_hits")
+        self.local.fill(local_key, value, generation)
+        return value
+
+    def get_many(self, keys, version=None, client=None):
+        keys = list(keys)
+        if client is not None or not self.is_local_active():
+            values = super().get_many(keys, version=version, client=client)
+            self.stats.add("redis_hits", len(values))
+            self.stats.add("redis_misses", len(keys) - len(values))
+            return values
+
+        values = {}
+        missing = []
+        for key in keys:
+            value = _MISSING
+            if self.is_local_key(key):
+                value = self.local.get(str(self.make_key(key, version=version)))
+                self.stats.add("local_hits" if value is not _MISSING else "local_misses")
+
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                values[key] = value
+
+        if missing:
+            generation = self.local.generation
+            found = super().get_many(missing, version=version)
+            self.stats.add("redis_hits", len(found))
+            self.stats.add("redis_misses", len(missing) - len(found))
+            for key, value in found.items():
+                values[key] = value
+                if self.is_local_key(key):
+                    self.local.fill(str(self.make_key(key, version=version)), value, generation)
+        return values
+
+    def has_key(self, key, version=None, client=None):
+        if client is None and self.is_local_key(key) and self.is_local_active():
+            if self.local.get(str(self.make_key(key, version=version))) is not _MISSING:
+                return True
+        return super().has_key(key, version=version, client=client)
+
+    # Writes
+
+    def _set_local(self, key, value, timeout, version):
+        if not self.is_local_key(key) or not self.is_local_active():
+            return
+        self.local.set(str(self.make_key(key, version=version)), value, self.get_backend_timeout(timeout))
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None, nx=False, xx=False):
+        result = super().set(key, value, timeout=timeout, version=version, client=client, nx=nx, xx=xx)
+        if result or not (nx or xx):
+            self._evict([key], version=version)
+            if result:
+                self._set_local(key, value, timeout, version)
+        return result
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        result = super().add(key, value, timeout=timeout, version=version, client=client)
+        if result:
+            self._evict([key], version=version)
+            self._set_local(key, value, timeout, version)
+        return result
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        result = super().set_many(data, timeout=timeout, version=version, client=client)
+        self._evict(data.keys(), version=version)
+        for key, value in data.items():
+            self._set_local(key, value, timeout, version)
+        return result
+
+    def delete(self, key, version=None, prefix=None, client=None):
+        try:
+            return super().delete(key, version=version, prefix=prefix, client=client)
+        finally:
+            self._evict([key], version=version, prefix=prefix)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        try:
+            return super().delete_many(keys, version=version)
+        finally:
+            self._evict(keys, version=version)
+
+    def delete_pattern(self, pattern, version=None, prefix=None, client=None, itersize=None):
+        kwargs = {"itersize": itersize} if itersize is not None else {}
+        try:
+            return super().delete_pattern(pattern, version=version, prefix=prefix, client=client, **kwargs)
+        finally:
+            pattern = str(self.client.make_pattern(pattern, version=version, prefix=prefix))
+            self.local.delete_pattern(pattern)
+            self._publish(pattern=pattern)
+
+    def clear(self):
+        try:
+            return super().clear()
+        finally:
+            self.local.clear()
+            self._publish(clear=True)
+
+    def incr(self, key, delta=1, version=None, client=None):
+        try:
+            return super().incr(key, delta=delta, version=version, client=client)
+        finally:
+            self._evict([key], version=version)
+
+    def decr(self, key, delta=1, version=None, client=None):
+        try:
+            return super().decr(key, delta=delta, version=version, client=client)
+        finally:
+            self._evict([key], version=version)
+
+    def expire(self, key, timeout, version=None, client=None):
+        try:
+            return super().expire(key, timeout, version=version, client=client)
+        finally:
+            self._evict([key], version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        try:
+            return super().touch(key, timeout=timeout, version=version, client=client)
+        finally:
+            self._evict([key], version=version)
+
+    def incr_version(self, key, delta=1, version=None, client=None):
+        try:
+            return super().incr_version(key, delta=delta, version=version, client=client)
+        finally:
+            self._evict([key], version=version)
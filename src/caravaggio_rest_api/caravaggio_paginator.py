@@ -90,3 +90,6 @@ class CaravaggioSearchPaginator(object):
 
     def next(self):
         return self.implementation.next()
+
+    async def anext(self):
+        return await self.implementation.anext()
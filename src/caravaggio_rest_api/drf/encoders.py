@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+JSON encoding of the API responses and of the access log with `orjson` (a
+JSON library written in Rust), producing the same bytes as the standard
+`json` module with the DRF settings:
+
+- The types `orjson` does not know, or formats in a different way (dates,
+  Decimals...), are converted by the `default` of `CaravaggioJSONEncoder`,
+  the DRF encoder plus the Cassandra types.
+- The floats in exponential notation are rewritten as `repr` does
+  (`1e16` -> `1e+16`, `0.00001` -> `1e-05`).
+- If `orjson` cannot encode the data (ex. integers bigger than 64 bits or
+  dictionaries with non-string keys) we use the `json` module. The same
+  for the documents with integers that could be bigger than 64 bits, that
+  `orjson` decodes as floats.
+
+Only the NaN and Infinity floats are different: `orjson` encodes them as
+null while the DRF settings (`STRICT_JSON`) raise an error.
+
+Without `orjson` installed the `json` module is always used.
+"""
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from dse.cqlengine.usertype import UserType
+    from dse.util import Date, LineString, Point, Polygon
+except ImportError:
+    from cassandra.cqlengine.usertype import UserType
+    from cassandra.util import Date, LineString, Point, Polygon
+
+from rest_framework.utils.encoders import JSONEncoder
+
+# The end of a float in exponential notation (`orjson` writes `1e16` where
+# `repr` writes `1e+16`), it can also match inside a string. The small
+# floats that `repr` writes in exponential notation start with `0.0000`
+FLOAT_EXPONENT_REGEX = re.compile(rb"e-?\d+(?:[,\]}\n]|$)")
+SMALL_FLOAT = b"0.0000"
+
+# The strings (skipped) and the floats of a JSON document
+FLOAT_TOKEN_REGEX = re.compile(rb'"(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?:e-?\d+)?')
+
+# A number with more digits than the biggest 64 bits integer (it could also
+# be in a string)
+BIG_INTEGER_REGEX = re.compile(r"\d{20}")
+BIG_INTEGER_BYTES_REGEX = re.compile(rb"\d{20}")
+
+# The characters escaped by `json.dumps` with `ensure_ascii`
+NON_ASCII_REGEX = re.compile(r"[^\x00-\x7e]")
+
+LINE_SEPARATORS = ((b"\xe2\x80\xa8", b"\\u2028"), (b"\xe2\x80\xa9", b"\\u2029"))
+
+ENCODE_ERRORS = (TypeError, ValueError, OverflowError)
+
+
+class CaravaggioJSONEncoder(JSONEncoder):
+    """
+    The DRF encoder plus the Cassandra types: the dates (`Date`), the
+    geometries (`Point`, `LineString` and `Polygon`, in WKT as the text
+    columns of `caravaggio_rest_api.dse.columns`) and the user types.
+    """
+
+    def default(self, obj):
+        if isinstance(obj, Date):
+            return str(obj)
+        elif isinstance(obj, (Point, LineString, Polygon)):
+            return str(obj)
+        elif isinstance(obj, UserType):
+            return dict(obj.items())
+        return super().default(obj)
+
+
+_encoder = CaravaggioJSONEncoder()
+
+if orjson is not None:
+    # The `default` converts the dates and the dataclasses as DRF does
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def _repr_float(match):
+    token = match.group(0)
+    if token.startswith(b'"') or not (b"." in token or b"e" in token):
+        return token
+    return repr(float(token)).encode("ascii")
+
+
+def fix_floats(content):
+    """
+    Rewrites the floats of a JSON document encoded by `orjson` as `repr`
+    does.
+    """
+    if SMALL_FLOAT not in content and FLOAT_EXPONENT_REGEX.search(content) is None:
+        return content
+    return FLOAT_TOKEN_REGEX.sub(_repr_float, content)
+
+
+def _escape_non_ascii(match):
+    code = ord(match.group(0))
+    if code > 0xFFFF:
+        code -= 0x10000
+        return "\\u{0:04x}\\u{1:04x}".format(0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+    return "\\u{0:04x}".format(code)
+
+
+def dumps(data):
+    """
+    The compact JSON (bytes) of the data, as the DRF `JSONRenderer` renders
+    it with the default settings (`COMPACT_JSON`, `UNICODE_JSON`).
+    """
+    if orjson is not None:
+        try:
+            content = fix_floats(orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS))
+        except ENCODE_ERRORS:
+            pass
+        else:
+            for separator, escaped in LINE_SEPARATORS:
+                if separator in content:
+                    content = content.replace(separator, escaped)
+            return content
+
+    content = json.dumps(data, cls=CaravaggioJSONEncoder, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+    return content.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029").encode("utf-8")
+
+
+def loads(content, parse_constant=None):
+    """
+    The data of a JSON document (str or bytes). Raises `ValueError` if it
+    is not valid JSON. The `parse_constant` of `json.loads` is called for
+    NaN and Infinity (`orjson` does not accept them).
+    """
+    regex = BIG_INTEGER_BYTES_REGEX if isinstance(content, bytes) else BIG_INTEGER_REGEX
+    if orjson is not None and regex.search(content) is None:
+        try:
+            return orjson.loads(content)
+        except ValueError:
+            # Invalid JSON, or NaN and Infinity: the json module decides
+            pass
+    return json.loads(content, parse_constant=parse_constant)
+
+
+def _indent_4(content):
+    # The indentation of `orjson` is 2 spaces by level. The raw new lines of
+    # a JSON document are always followed by the indentation, we add 2
+    # spaces by level to every line of the level or deeper
+    level = 1
+    while b"\n" + b" " * (4 * level - 2) in content:
+        content = content.replace(b"\n" + b" " * (4 * level - 2), b"\n" + b" " * (4 * level))
+        level += 1
+    return content
+
+
+def dumps_log(content):
+    """
+    The JSON document (bytes) formatted for the access log, the same string
+    returned by `json.dumps(json.loads(content), sort_keys=True, indent=4)`.
+    """
+    if orjson is not None and BIG_INTEGER_BYTES_REGEX.search(content) is None:
+        try:
+            formatted = orjson.dumps(orjson.loads(content), option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+        except ENCODE_ERRORS:
+            pass
+        else:
+            formatted = _indent_4(fix_floats(formatted)).decode("utf-8")
+            if not formatted.isascii() or "\x7f" in formatted:
+                formatted = NON_ASCII_REGEX.sub(_escape_non_ascii, formatted)
+            return formatted
+
+    return json.dumps(json.loads(content), sort_keys=True, indent=4)
@@ -4,11 +4,15 @@
 import socket
 import time
 import logging
-import json
+
+from time import perf_counter
 
 from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.module_loading import import_string
 
+from caravaggio_rest_api import timing
+from caravaggio_rest_api.drf import encoders
 from caravaggio_rest_api.drf.authentication import TokenAuthSupportQueryString
 from caravaggio_rest_api.logging.models import ApiAccess
 
@@ -30,8 +34,7 @@ class RequestLogMiddleware(object):
                 if getattr(response, "streaming", False):
                     response_body = "<<<Streaming>>>"
                 else:
-                    content = json.loads(response.content)
-                    response_body = json.dumps(content, sort_keys=True, indent=4)
+                    response_body = encoders.dumps_log(response.content)
             else:
                 response_body = "<<<Not JSON>>>"
 
@@ -53,10 +56,11 @@ class RequestLogMiddleware(object):
                 "request_query_params": request_query_params,
                 "response_status": response.status_code,
                 "response_body": response_body,
-                "run_time": time.time() - request.start_time,
+                "run_time": int((time.time() - request.start_time) * 1000),
             }
 
-            ApiAccess.objects.create(**log_data)
+            with timing.phase("access_log"):
+                ApiAccess.objects.create(**log_data)
 
             # save log_data in some way
             _logger.info(log_data)
@@ -71,3 +75,46 @@ class OrganizationMiddleware(MiddlewareMixin):
 
     def process_request(self, request):
         TokenAuthSupportQueryString().authenticate(request)
+
+
+class ServerTimingMiddleware(MiddlewareMixin):
+    """ Measures the phases of every request (see `caravaggio_rest_api.timing`)
+    and sends their durations in the `Server-Timing` header of the response,
+    and to the metrics sink (`SERVER_TIMING_SINK`), a callable that receives
+    the request, the response and the `RequestTimings`.
+
+    It should be the first middleware, to include all the request in the
+    `total` phase.
+    """
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.enabled = getattr(settings, "SERVER_TIMING_ENABLED", True)
+
+        sink = getattr(settings, "SERVER_TIMING_SINK", None)
+        self.sink = import_string(sink) if isinstance(sink, str) else sink
+
+    def process_request(self, request):
+        if self.enabled:
+            request._timings_start = perf_counter()
+            request._timings_token = timing.start_request_timings()
+
+    def process_response(self, request, response):
+        token = getattr(request, "_timings_token", None)
+        if token is None:
+            return response
+
+        timings = timing.get_request_timings()
+        timings.add("total", perf_counter() - request._timings_start)
+        timing.finish_request_timings(token)
+        request._timings_token = None
+
+        response["Server-Timing"] = timings.to_header()
+
+        if self.sink is not None:
+            try:
+                self.sink(request, response, timings)
+            except Exception as ex:
+                _logger.warning("Unable to send the timings of the request to the sink: {0}".format(ex))
+
+        return response
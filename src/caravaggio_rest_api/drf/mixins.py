@@ -1,10 +1,21 @@
 # -*- coding: utf-8 -*
 # Copyright (c) 2019 BuildGroup Data Services Inc.
 # All rights reserved.
+import hashlib
+import logging
+import random
+
+from datetime import datetime
+
+from django.conf import settings
+from django.http import HttpResponse
 from django.utils.decorators import decorator_from_middleware
 from django.utils.decorators import classonlymethod
 
 from caravaggio_rest_api.drf.middleware import RequestLogMiddleware
+from caravaggio_rest_api.profiling import DEFAULT_INTERVAL, DEFAULT_MAX_FILES, ProfileStore, StackSampler
+
+LOGGER = logging.getLogger(__name__)
 
 
 class RequestLogViewMixin(object):
@@ -17,3 +28,86 @@ class RequestLogViewMixin(object):
         view = super(RequestLogViewMixin, cls).as_view(actions=actions, **initkwargs)
         view = decorator_from_middleware(RequestLogMiddleware)(view)
         return view
+
+
+class RequestProfileViewMixin(object):
+    """
+    Profiles the request with a stack sampler (see
+    `caravaggio_rest_api.profiling`) when a staff user asks for it with
+    `?_profile=1`, or for a random sample of 1 of every
+    `PROFILING_SAMPLE_RATE` requests.
+
+    The profile is stored in `PROFILING_DIR` (the last `PROFILING_MAX_FILES`
+    profiles) and its name is returned in the `X-Profile` header. With
+    `?_profile=inline` the profile is returned instead of the response.
+
+    The profile covers the request after the authentication: the handler,
+    the serialization and the rendering of the response.
+    """
+
+    profile_query_param = "_profile"
+
+    def get_profile_mode(self, request):
+        value = request.query_params.get(self.profile_query_param, None)
+        if value in ("1", "true", "inline") and getattr(request.user, "is_staff", False):
+            return "inline" if value == "inline" else "store"
+
+        sample_rate = getattr(settings, "PROFILING_SAMPLE_RATE", 0)
+        if sample_rate and random.randrange(sample_rate) == 0:
+            return "store"
+        return None
+
+    def get_profile_tags(self, request):
+        """
+        The view, the action and the shape of the query (the names of the
+        query parameters) of the profiled request.
+        """
+        view_name = "{0}.{1}".format(self.__class__.__name__, getattr(self, "action", None) or request.method.lower())
+        query_shape = ",".join(sorted(name for name in request.query_params.keys() if name != self.profile_query_param))
+        return view_name, query_shape
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        self._profile_mode = self.get_profile_mode(request)
+        if self._profile_mode is not None:
+            self._profile_sampler = StackSampler(
+                interval=getattr(settings, "PROFILING_INTERVAL", DEFAULT_INTERVAL)
+            ).start()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        sampler = getattr(self, "_profile_sampler", None)
+        if sampler is None:
+            return response
+        self._profile_sampler = None
+
+        try:
+            if hasattr(response, "render") and not response.is_rendered:
+                response.render()
+        finally:
+            sampler.stop()
+
+        view_name, query_shape = self.get_profile_tags(request)
+        content = sampler.to_collapsed(root="{0}?{1}".format(view_name, query_shape))
+
+        if self._profile_mode == "inline":
+            return HttpResponse(content, content_type="text/plain; charset=utf-8")
+
+        name = "{0}-{1}-{2}".format(
+            datetime.utcnow().strftime("%Y%m%dT%H%M%S%f"),
+            view_name,
+            hashlib.md5(query_shape.encode("utf-8")).hexdigest()[:8],
+        )
+        store = ProfileStore(
+            getattr(settings, "PROFILING_DIR", "/tmp/caravaggio_profiles"),
+            max_files=getattr(settings, "PROFILING_MAX_FILES", DEFAULT_MAX_FILES),
+        )
+        try:
+            store.save(name, content)
+            response["X-Profile"] = name
+        except OSError as ex:
+            LOGGER.warning("Unable to store the profile {0}: {1}".format(name, ex))
+
+        return response
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+from django.conf import settings
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.utils import json
+
+from caravaggio_rest_api.drf import encoders
+
+
+class FastJSONParser(JSONParser):
+    """
+    The DRF `JSONParser` decoding with `orjson` (see `encoders`). With
+    `STRICT_JSON` False (NaN and Infinity allowed) we use the `JSONParser`.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if not self.strict:
+            return super().parse(stream, media_type, parser_context)
+
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+
+        try:
+            return encoders.loads(stream.read().decode(encoding), parse_constant=json.strict_constant)
+        except ValueError as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON (one JSON document per line) into a list
+    of documents. Used by the bulk endpoints to receive big payloads without
+    having to wrap them into a JSON array.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+
+        data = []
+        for line_number, line in enumerate(stream, 1):
+            line = line.decode(encoding).strip()
+            if not line:
+                continue
+            try:
+                data.append(encoders.loads(line))
+            except ValueError as exc:
+                raise ParseError("NDJSON parse error in line {0} - {1}".format(line_number, str(exc)))
+
+        return data
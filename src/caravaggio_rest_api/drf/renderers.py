@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+from rest_framework.renderers import JSONRenderer
+
+from caravaggio_rest_api.drf import encoders
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    The DRF `JSONRenderer` encoding with `orjson` (see `encoders`), it
+    renders the same bytes. The indented responses (ex. the browsable API)
+    and the settings we do not support (`COMPACT_JSON`, `UNICODE_JSON` or
+    `STRICT_JSON` False) are rendered by the `JSONRenderer`.
+    """
+
+    encoder_class = encoders.CaravaggioJSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+
+        if (
+            not self.compact
+            or not self.strict
+            or self.ensure_ascii
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        return encoders.dumps(data)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+import json
+import logging
+import random
+import string
+import uuid
+
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from io import BytesIO
+
+try:
+    from dse.util import Date, LineString, Point
+except ImportError:
+    from cassandra.util import Date, LineString, Point
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+
+from caravaggio_rest_api.drf import encoders
+from caravaggio_rest_api.drf.parsers import FastJSONParser, NDJSONParser
+from caravaggio_rest_api.drf.renderers import FastJSONRenderer
+
+from caravaggio_rest_api.example.company.models import Address
+
+_logger = logging.getLogger()
+
+# Floats written in a different way by `orjson` and `repr`
+FLOATS = [0.0, -0.0, 0.1, 1.0, -2.5, 1e-4, 1e-5, 9e-5, 1.5e-7, 5e-324, 1e15, 1e16, 1e22, 1.2345678901234567e17, 1e300]
+
+STRINGS = ["", "plain", "ñandú €", "𝄞 clef", "\x00\x1f\x7f", '"quoted" \\ /', "line break ", "1e16,", "0.00001"]
+
+
+def get_documents():
+    """
+    The documents returned by the API: the types of the serializers and of
+    the Cassandra rows.
+    """
+    return [
+        {"uuid": uuid.UUID("5e125129-baea-4671-8f30-2fc9d079eb1b"), "timeuuid": uuid.uuid1()},
+        {"decimals": [Decimal("1234.56"), Decimal("0.00001"), Decimal("10"), Decimal("-0.5")]},
+        {
+            "datetime": datetime(2020, 1, 2, 3, 4, 5, 123456),
+            "utc": datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+            "offset": datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=2))),
+            "date": date(2020, 1, 2),
+            "time": time(3, 4, 5),
+            "duration": timedelta(hours=1, seconds=1),
+        },
+        {"floats": FLOATS, "strings": STRINGS},
+        {"integers": [0, -1, 2 ** 63 - 1, -(2 ** 63), 2 ** 64 - 1, 2 ** 64, 10 ** 30]},
+        {1: "non string keys", None: True},
+        OrderedDict([("count", 2), ("next", None), ("results", [{"_id": 1, "tags": ("a", "b")}, {"_id": 2}])]),
+        [],
+        "string",
+        1e16,
+        {"set": {1}, "bytes": b"text"},
+    ]
+
+
+def get_random_document(rnd, depth=0):
+    choice = rnd.random()
+    if depth > 3 or choice < 0.5:
+        return rnd.choice(
+            [
+                lambda: rnd.randint(-(2 ** 63), 2 ** 64 - 1),
+                lambda: rnd.random() * 10 ** rnd.randint(-12, 25) * rnd.choice((1, -1)),
+                lambda: rnd.choice(FLOATS),
+                lambda: "".join(rnd.choice(string.printable + "ñ€𝄞 \x00\x7f") for _ in range(rnd.randint(0, 8))),
+                lambda: rnd.choice(STRINGS),
+                lambda: rnd.choice([None, True, False]),
+                lambda: uuid.UUID(int=rnd.getrandbits(128)),
+                lambda: Decimal(str(round(rnd.random() * 1000, rnd.randint(0, 6)))),
+                lambda: datetime(2020, 1, 2, 3, 4, 5, rnd.choice([0, 123456])),
+            ]
+        )()
+    elif choice < 0.75:
+        return [get_random_document(rnd, depth + 1) for _ in range(rnd.randint(0, 4))]
+    return OrderedDict(
+        (rnd.choice(STRINGS) + str(index), get_random_document(rnd, depth + 1)) for index in range(rnd.randint(0, 4))
+    )
+
+
+class JSONEncodingTest(CaravaggioBaseTest):
+    """ Test module for the orjson renderer, parser and access log """
+
+    def assertSameRender(self, document, accepted_media_type=None, renderer_context=None):
+        expected = JSONRenderer().render(document, accepted_media_type, renderer_context)
+        rendered = FastJSONRenderer().render(document, accepted_media_type, renderer_context)
+        self.assertEqual(rendered, expected)
+
+    def step01_renderer(self):
+        for document in get_documents():
+            self.assertSameRender(document)
+
+        rnd = random.Random(1)
+        for _ in range(1000):
+            self.assertSameRender(get_random_document(rnd))
+
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+
+    def step02_renderer_indent(self):
+        for document in get_documents():
+            self.assertSameRender(document, accepted_media_type="application/json; indent=4")
+            self.assertSameRender(document, renderer_context={"indent": 2})
+
+    def step03_cassandra_types(self):
+        address = Address(street_name="Main", street_number=1, city="Boston")
+        document = {
+            "date": Date("2020-01-02"),
+            "point": Point(1.5, 2.0),
+            "linestring": LineString([(1.0, 2.0), (3.0, 4.0)]),
+            "address": address,
+        }
+        data = json.loads(FastJSONRenderer().render(document))
+
+        self.assertEqual(data["date"], "2020-01-02")
+        self.assertEqual(data["point"], "POINT (1.5 2.0)")
+        self.assertEqual(data["linestring"], "LINESTRING (1.0 2.0, 3.0 4.0)")
+        self.assertEqual(data["address"], json.loads(json.dumps(dict(address.items()))))
+
+        # The same bytes without orjson
+        expected = json.dumps(document, cls=encoders.CaravaggioJSONEncoder, ensure_ascii=False, separators=(",", ":"))
+        self.assertEqual(FastJSONRenderer().render(document), expected.encode("utf-8"))
+
+    def step04_parser(self):
+        rnd = random.Random(2)
+        documents = get_documents() + [get_random_document(rnd) for _ in range(500)]
+        for document in documents:
+            content = JSONRenderer().render(document)
+            if not content:
+                continue
+            self.assertEqual(
+                json.dumps(FastJSONParser().parse(BytesIO(content))), json.dumps(JSONParser().parse(BytesIO(content)))
+            )
+
+        # Integers bigger than 64 bits are not converted to floats
+        self.assertEqual(FastJSONParser().parse(BytesIO(b'{"big": 100000000000000000000}')), {"big": 10 ** 20})
+
+        for content in [b"", b"{", b'{"a": NaN}', b"\xef\xbb\xbf{}", b"\xff"]:
+            with self.assertRaises(ParseError) as expected:
+                JSONParser().parse(BytesIO(content))
+            with self.assertRaises(ParseError) as parsed:
+                FastJSONParser().parse(BytesIO(content))
+            self.assertEqual(str(parsed.exception), str(expected.exception))
+
+        content = b'{"a": 1}\n\n[1e16, "\xc3\xb1"]\n'
+        self.assertEqual(NDJSONParser().parse(BytesIO(content)), [{"a": 1}, [1e16, "ñ"]])
+
+    def step05_access_log(self):
+        rnd = random.Random(3)
+        documents = get_documents() + [get_random_document(rnd) for _ in range(500)]
+        for document in documents:
+            content = JSONRenderer().render(document)
+            if not content:
+                continue
+            self.assertEqual(encoders.dumps_log(content), json.dumps(json.loads(content), sort_keys=True, indent=4))
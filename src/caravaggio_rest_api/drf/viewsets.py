@@ -9,7 +9,7 @@ from rest_framework import viewsets
 from rest_framework import filters
 from rest_framework_filters.backends import ComplexFilterBackend
 
-from caravaggio_rest_api.drf.mixins import RequestLogViewMixin
+from caravaggio_rest_api.drf.mixins import RequestLogViewMixin, RequestProfileViewMixin
 
 
 LOGGER = logging.getLogger(__name__)
@@ -39,6 +39,9 @@ class CaravaggioThrottledViewSet(object):
     throttle_scope = ""
 
     def __init__(self, **kwargs):
+        # The arguments of the route (ex. the `parser_classes` of an action)
+        super().__init__(**kwargs)
+
         # Registering throttle operations
         if hasattr(settings, "THROTTLE_ENABLED") and settings.THROTTLE_ENABLED:
             view_throttle_operations = self.throttle_operations.copy() if hasattr(self, "throttle_operations") else {}
@@ -74,7 +77,9 @@ class CaravaggioThrottledViewSet(object):
         return super().get_throttles()
 
 
-class CaravaggioDjangoModelViewSet(CaravaggioThrottledViewSet, RequestLogViewMixin, viewsets.ModelViewSet):
+class CaravaggioDjangoModelViewSet(
+    CaravaggioThrottledViewSet, RequestProfileViewMixin, RequestLogViewMixin, viewsets.ModelViewSet
+):
     """ We need to use this class when we work with normal Django Model
     classes, that is, not with Cassandra or Cassandra/Solr configurations.
 
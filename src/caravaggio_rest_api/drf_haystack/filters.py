@@ -14,6 +14,7 @@ from drf_haystack.viewsets import HaystackViewSet
 
 from rest_framework.filters import ORDER_PATTERN
 
+from caravaggio_rest_api import timing
 from caravaggio_rest_api.drf_haystack.query import CaravaggioFilterQueryBuilder, CaravaggioFacetQueryBuilder
 from caravaggio_rest_api.haystack.query import CaravaggioSearchQuerySet
 
@@ -26,11 +27,19 @@ class CaravaggioHaystackFilter(DRFHaystackFilter):
     query_builder_class = CaravaggioFilterQueryBuilder
     default_operator = operator.and_
 
+    def build_filters(self, view, filters=None):
+        with timing.phase("filters"):
+            return super().build_filters(view, filters=filters)
+
 
 class CaravaggioHaystackFacetFilter(DRFHaystackFacetFilter):
 
     query_builder_class = CaravaggioFacetQueryBuilder
 
+    def build_filters(self, view, filters=None):
+        with timing.phase("facets"):
+            return super().build_filters(view, filters=filters)
+
     def apply_filters(self, queryset, applicable_filters=None, applicable_exclusions=None):
         """
         Apply faceting to the queryset
@@ -64,7 +73,8 @@ class HaystackOrderingFilter(DRFHaystackOrderingFilter):
     def get_valid_fields(self, queryset, view, context={}):
         valid_fields = super().get_valid_fields(queryset, view, context)
         if isinstance(view, HaystackViewSet):
-            model_clazz = view.get_serializer_class()(context=context).Meta.model
+            # Serializers of several indexes (federated searches) have no model
+            model_clazz = getattr(view.get_serializer_class()(context=context).Meta, "model", None)
             try:
                 processed_valid_fields = []
                 index = self.get_indexes()[model_clazz]
@@ -113,12 +113,16 @@ def set_instance_values(nested_serializers, nested_serializers_data, instance):
             set_attributes(__serializer, __serializer_name)
 
 
-def deserialize_instance(serializer, model):
+def deserialize_instance(serializer, model, validated_data=None):
+    # We can receive the validated data of one of the items of a list
+    # serializer (bulk operations)
+    validated_data = serializer.validated_data if validated_data is None else validated_data
+
     # Collect information on nested serializers
-    __nested_serializers, __nested_serializers_data = extract_nested_serializers(serializer, serializer.validated_data,)
+    __nested_serializers, __nested_serializers_data = extract_nested_serializers(serializer, validated_data,)
 
     # Create instance, but don't save it yet
-    instance = model(**serializer.validated_data)
+    instance = model(**validated_data)
 
     # Assign fields to the `instance` one by one
     set_instance_values(__nested_serializers, __nested_serializers_data, instance)
@@ -246,8 +250,14 @@ class CassandraModelSerializer(QueryFieldsMixin, DynamicFieldsSerializer):
         # Collect information on nested serializers
         __nested_serializers, __nested_serializers_data = extract_nested_serializers(self, validated_data,)
 
-        # Update the instance
-        instance = super(CassandraModelSerializer, self).update(instance, validated_data)
+        # Update the instance. We do not call the ModelSerializer.update
+        # because it saves the instance before we set the nested values.
+        # Only the columns with a different value are marked as changed, and
+        # the save() of a persisted instance generates an UPDATE of these
+        # columns (with append/add/remove operations for the collections
+        # when the previous value is known)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
 
         # Assign fields to the `instance` one by one
         set_instance_values(__nested_serializers, __nested_serializers_data, instance)
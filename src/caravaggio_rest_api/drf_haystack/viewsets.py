@@ -24,32 +24,60 @@ such as `distance` in spatial queries or `score` of each result.
 
 """
 
+import asyncio
+import calendar
+import contextvars
+import hashlib
 import logging
 
 from collections import OrderedDict
 
 from django.contrib.gis.measure import Distance
+from django.core.paginator import InvalidPage, Page
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
-from caravaggio_rest_api.drf.mixins import RequestLogViewMixin
+from caravaggio_rest_api import explain, timing
+from caravaggio_rest_api.drf.mixins import RequestLogViewMixin, RequestProfileViewMixin
+from caravaggio_rest_api.drf.parsers import FastJSONParser, NDJSONParser
 from caravaggio_rest_api.drf.viewsets import CaravaggioThrottledViewSet
-from caravaggio_rest_api.utils import get_primary_keys_values
+from caravaggio_rest_api.utils import get_primary_keys_values, get_query_projection
 
 try:
+    from dse.cqlengine import columns
     from dse.cqlengine.columns import UUID, TimeUUID
+    from dse.cqlengine.query import AbstractQuerySet
 except ImportError:
+    from cassandra.cqlengine import columns
     from cassandra.cqlengine.columns import UUID, TimeUUID
+    from cassandra.cqlengine.query import AbstractQuerySet
 
 
 from drf_haystack import filters, mixins
 from drf_haystack.viewsets import HaystackViewSet
-from haystack.exceptions import SpatialError
-
-from rest_framework import viewsets
+from haystack import connections
+from haystack.constants import DEFAULT_ALIAS
+from haystack.exceptions import NotHandled, SpatialError
+
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.fields import SkipField
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import BasePermission
 from rest_framework.response import Response
+from rest_framework.serializers import as_serializer_error
+from rest_framework_cache.cache import cache
+from rest_framework_cache.serializers import CachedSerializerMixin
 
+from caravaggio_rest_api.haystack.indexes import BaseSearchIndex
+from caravaggio_rest_api.haystack.models import CompactSearchResult
 from caravaggio_rest_api.haystack.query import CaravaggioSearchQuerySet
-from caravaggio_rest_api.pagination import CustomPageNumberPagination
+from caravaggio_rest_api.pagination import (
+    CustomPageNumberPagination,
+    CaravaggioFederatedSearchPagination,
+)
+from caravaggio_rest_api.drf_haystack.serializers import deserialize_instance
 
 from caravaggio_rest_api.drf_haystack.filters import (
     HaystackOrderingFilter,
@@ -61,47 +89,88 @@ LOGGER = logging.getLogger("caravaggio_rest_api")
 
 
 class CaravaggioHaystackPageNumberPagination(CustomPageNumberPagination):
+    @staticmethod
+    def get_stored_columns(model):
+        try:
+            index = connections[DEFAULT_ALIAS].get_unified_index().get_index(model)
+        except NotHandled:
+            return {}
+
+        return index.get_stored_columns() if isinstance(index, BaseSearchIndex) else {}
+
+    def is_covered_by_index(self, model, selected_fields, serializer_fields):
+        """
+        The objects can be built from the search results, without reading
+        them from Cassandra, if the index stores the primary keys and all the
+        selected fields the serializer is going to render.
+        """
+        required_fields = set(model._primary_keys.keys()) | (set(selected_fields) & serializer_fields)
+        return required_fields.issubset(self.get_stored_columns(model).keys())
+
+    def build_from_index(self, model, result, selected_fields):
+        stored_columns = self.get_stored_columns(model)
+
+        values = {}
+        for name in selected_fields:
+            if name not in stored_columns:
+                continue
+            column = model._columns[name]
+            value = getattr(result, stored_columns[name], None)
+            if isinstance(column, columns.BaseContainerColumn) and value is not None and not isinstance(value, list):
+                value = [value]
+            values[name] = column.to_python(value) if value is not None else None
+
+        instance = model(**values)
+
+        # Used by the caching process
+        instance._caravaggio_fields = selected_fields
+        return instance
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Coroutine version of `paginate_queryset`. The results of the page are
+        requested first, the Solr response has the total of hits and we do not
+        need another request to count them.
+        """
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+
+        page_number = request.query_params.get(self.page_query_param, 1)
+        if page_number in self.last_page_strings:
+            paginator.count = await queryset.acount()
+            page_number = paginator.num_pages
+
+        try:
+            number = max(int(page_number), 1)
+        except (TypeError, ValueError):
+            number = 1
+
+        clone = queryset._clone()
+        clone.query.set_limits((number - 1) * page_size, number * page_size)
+        results = clone.post_process_results(await clone.query.aget_results())
+        paginator.count = await clone.query.aget_count()
+
+        try:
+            paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(page_number=page_number, message=str(exc))
+            raise NotFound(msg)
+
+        self.page = Page(results, number, paginator)
+
+        if paginator.num_pages > 1 and self.template is not None:
+            # The browsable API should display pagination controls.
+            self.display_page_controls = True
+
+        self.request = request
+        return list(self.page)
+
     def get_paginated_response(self, data):
 
         if data and len(data):
-            has_distance = False
-            loaded_objects = []
-            for instance in data.serializer.instance:
-                model = instance.model
-
-                try:
-                    distance = getattr(instance, "distance", None)
-                    if not has_distance and isinstance(distance, Distance):
-                        has_distance = True
-                except SpatialError as ex:
-                    pass
-
-                if hasattr(instance, "already_loaded") and instance.already_loaded:
-                    loaded_objects.append(instance.model(**instance.__dict__))
-                elif "request" in data.serializer.context and ("fields" in data.serializer.context["request"].GET):
-                    filter_fields = list(model._primary_keys.keys())
-                    selected_fields = data.serializer.context["request"].GET["fields"].split(",")
-                    filter_fields.extend(list(selected_fields))
-                    instance = model(
-                        **dict(
-                            zip(
-                                filter_fields,
-                                model.objects.all()
-                                .filter(**get_primary_keys_values(instance, instance.model))
-                                .values_list(*filter_fields, flat=False)
-                                .first(),
-                            )
-                        )
-                    )
-
-                    # Used by the caching process
-                    instance._caravaggio_fields = selected_fields
-                    loaded_objects.append(instance)
-                else:
-                    loaded_objects.append(
-                        model.objects.all().filter(**get_primary_keys_values(instance, instance.model)).first()
-                    )
-
             # Get the results serializer from the original View that originated
             # the current response
             results_serializer = data.serializer.context["view"].results_serializer_class
@@ -111,8 +180,60 @@ class CaravaggioHaystackPageNumberPagination(CustomPageNumberPagination):
             if "request" in data.serializer.context and ("fields" in data.serializer.context["request"].GET):
                 extra_args["fields"] = data.serializer.context["request"].GET["fields"].split(",")
 
+            serializer_fields = set(results_serializer(**extra_args).fields.keys())
+
+            has_distance = False
+            loaded_objects = []
+            # Loading the objects of the page from Cassandra (or the index)
+            with timing.phase("hydration"):
+                for instance in data.serializer.instance:
+                    model = instance.model
+
+                    # The columns requested in the `fields` query parameter
+                    selected_fields = (
+                        get_query_projection(model, data.serializer.context["request"].GET)
+                        if "request" in data.serializer.context
+                        else None
+                    )
+
+                    try:
+                        distance = getattr(instance, "distance", None)
+                        if not has_distance and isinstance(distance, Distance):
+                            has_distance = True
+                    except SpatialError as ex:
+                        pass
+
+                    if hasattr(instance, "already_loaded") and instance.already_loaded:
+                        explain.count("already_loaded")
+                        loaded_objects.append(
+                            instance.to_model()
+                            if isinstance(instance, CompactSearchResult)
+                            else instance.model(**instance.__dict__)
+                        )
+                    elif selected_fields and self.is_covered_by_index(model, selected_fields, serializer_fields):
+                        explain.count("from_index")
+                        loaded_objects.append(self.build_from_index(model, instance, selected_fields))
+                    elif selected_fields:
+                        explain.count("cassandra_reads")
+                        instance = (
+                            model.objects.all()
+                            .filter(**get_primary_keys_values(instance, instance.model))
+                            .only(selected_fields)
+                            .first()
+                        )
+
+                        # Used by the caching process
+                        instance._caravaggio_fields = selected_fields
+                        loaded_objects.append(instance)
+                    else:
+                        explain.count("cassandra_reads")
+                        loaded_objects.append(
+                            model.objects.all().filter(**get_primary_keys_values(instance, instance.model)).first()
+                        )
+
             serializer = results_serializer(loaded_objects, many=True, **extra_args)
-            detail_data = serializer.data
+            with timing.phase("serialization"):
+                detail_data = serializer.data
 
             # Copy the relevance score into the model object
             for i_obj, obj in enumerate(detail_data):
@@ -138,7 +259,9 @@ class CaravaggioHaystackPageNumberPagination(CustomPageNumberPagination):
         )
 
 
-class CaravaggioCassandraModelViewSet(CaravaggioThrottledViewSet, viewsets.ModelViewSet, RequestLogViewMixin):
+class CaravaggioCassandraModelViewSet(
+    CaravaggioThrottledViewSet, RequestProfileViewMixin, viewsets.ModelViewSet, RequestLogViewMixin
+):
     """ We use this ViewSet as a base class when we are working with and
     endpoint that is directly connected with a Cassandra model class (DSE)
 
@@ -146,12 +269,552 @@ class CaravaggioCassandraModelViewSet(CaravaggioThrottledViewSet, viewsets.Model
     to define a search index for the model in `search_indexes.py` and define
     the ViewSet as a specific class of CaravaggioHaystackViewSet.
 
+    The `bulk` action (POST <endpoint>/bulk/) accepts a JSON array or a
+    NDJSON (application/x-ndjson) body with the objects to create or update,
+    and writes them using concurrent requests to Cassandra. The writes are
+    upserts, the response reports the result of each item in the same order
+    they were received, 200 for the written (created or updated) objects:
+
+        {"index": 0, "status": 200, "data": {"_id": "...", "user": "..."}}
+        {"index": 1, "status": 400, "errors": {"name": ["..."]}}
+
+    The response status is 200 if all the objects were written, and 207
+    (Multi-Status) if some of them failed. If the permissions of the view
+    check the objects (`has_object_permission`), the objects that already
+    exist are read and checked before the write, the denied ones report the
+    status of the permission. The objects are not saved one by one with
+    `perform_create` and `serializer.create` (the hooks are not called),
+    override `get_bulk_instance` to customize the instances before they are
+    written.
+
+    The `batch_retrieve` action (GET <endpoint>/batch_retrieve/?ids=a,b or
+    POST with {"ids": [...]}) reads up to `batch_retrieve_max_items` objects
+    with concurrent requests to Cassandra. An id is the value of the lookup
+    field or a dict with the values of the primary key columns. The results
+    are returned in the same order, with the same format as `bulk` (status
+    200, 400, 404, or the status of the object permissions the object does
+    not satisfy). The objects are read with the filters of the queryset of
+    the view (`get_queryset` and `filter_queryset`), the objects outside of
+    it are not found. The representations in the serializer cache are
+    served without reading Cassandra, unless the queryset is filtered or
+    the permissions of the view check the objects (`has_object_permission`).
+
+    The list is paginated with the default pagination class of the project.
+    Set `pagination_class = CassandraPagingStatePagination` in the viewset to
+    paginate it with the paging state of Cassandra instead of counting and
+    skipping rows. This changes the format of the response (an opaque
+    `cursor` instead of the page number, and no total count).
+
+    If the model has the `conditional_get_field` column (`updated_at` in
+    all the `BaseEntity` models), retrieve and list responses include a
+    weak ETag and the Last-Modified headers, and the requests with
+    If-None-Match/If-Modified-Since headers get a 304 (Not Modified) if the
+    object (or the page) has not changed. In retrieve we only read the
+    primary key and the `conditional_get_field` columns to check it (with
+    `get_object`), unless the permissions of the view check the objects.
+
+    Attributes
+    ----------
+    bulk_max_items : the max number of objects accepted in a single request.
+
+    bulk_concurrency : the max number of concurrent requests to Cassandra
+        of the `bulk` and `batch_retrieve` actions.
+
+    bulk_batch_by_partition : if True, the objects that belong to the same
+        partition are written together in an UNLOGGED BATCH.
+
+    batch_retrieve_max_items : the max number of ids of a `batch_retrieve`.
+
+    partial_update_without_read : if True, a PATCH request that has the
+        full primary key of the model in the URL does not read the object
+        before updating it. Only the columns received are written with a
+        plain UPDATE, and the response only has these columns (and the
+        primary key). Disabled by default: the filters of `get_queryset` are
+        not applied to the update, and the UPDATE is an upsert (a missing
+        object is created with the written columns). It is ignored if the
+        permissions of the view check the objects (`has_object_permission`).
+        Do not enable it if the queryset is scoped (ex. by the user).
+
     """
 
     filter_backends = []
 
+    bulk_max_items = 1000
+    bulk_concurrency = 50
+    bulk_batch_by_partition = False
+
+    batch_retrieve_max_items = 100
+
+    partial_update_without_read = False
+
+    conditional_get_field = "updated_at"
+
+    _read_version_only = False
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
 
-class CaravaggioHaystackModelViewSet(CaravaggioThrottledViewSet, HaystackViewSet, RequestLogViewMixin):
+        # DRF only clones the Django querysets, the cqlengine queryset of the
+        # class would keep the results of the previous requests
+        if isinstance(queryset, AbstractQuerySet):
+            queryset = queryset.all()
+
+        # The conditional retrieve only reads the version of the object
+        if self.action == "retrieve" and self._read_version_only:
+            return queryset.only(list(queryset.model._primary_keys.keys()) + [self.conditional_get_field])
+
+        # We only read from Cassandra the columns requested in the `fields`
+        # query parameter (plus the primary keys)
+        if self.action in ("list", "retrieve"):
+            projection = get_query_projection(queryset.model, self.request.query_params)
+            if projection is not None:
+                if self.has_conditional_get(queryset.model) and self.conditional_get_field not in projection:
+                    projection.append(self.conditional_get_field)
+                queryset = queryset.only(projection)
+
+        return queryset
+
+    def has_conditional_get(self, model):
+        return bool(self.conditional_get_field) and self.conditional_get_field in model._columns
+
+    def get_etag(self, instances, extra=None):
+        """
+        Returns the weak ETag and the last modification date of a list of
+        instances, based on their primary keys and `conditional_get_field`.
+        """
+        digest = hashlib.sha1()
+        last_modified = None
+        for instance in instances:
+            updated_at = getattr(instance, self.conditional_get_field, None)
+            key = "|".join(
+                "{0}:{1}".format(name, value)
+                for name, value in get_primary_keys_values(instance, instance.__class__).items()
+            )
+            digest.update("{0}@{1};".format(key, updated_at.isoformat() if updated_at else "").encode("utf-8"))
+            if updated_at and (last_modified is None or updated_at > last_modified):
+                last_modified = updated_at
+
+        if extra:
+            digest.update(extra.encode("utf-8"))
+
+        return 'W/"{0}"'.format(digest.hexdigest()), last_modified
+
+    def get_conditional_response(self, request, etag, last_modified, response=None):
+        """
+        Returns a 304 response if the conditions of the request are
+        satisfied (the client has the current version), or the `response`
+        with the ETag and Last-Modified headers otherwise.
+        """
+        last_modified = calendar.timegm(last_modified.utctimetuple()) if last_modified else None
+
+        not_modified = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            response = not_modified
+
+        if response is not None:
+            response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        model = self.get_queryset().model
+        if not self.has_conditional_get(model):
+            return super().retrieve(request, *args, **kwargs)
+
+        # We only read the version of the object to check if the client has
+        # the current one, unless the object permissions need the object
+        if (
+            "HTTP_IF_NONE_MATCH" in request.META or "HTTP_IF_MODIFIED_SINCE" in request.META
+        ) and not self.has_object_permissions():
+            self._read_version_only = True
+            try:
+                instance = self.get_object()
+            finally:
+                self._read_version_only = False
+
+            etag, last_modified = self.get_etag([instance])
+            response = self.get_conditional_response(request, etag, last_modified)
+            if response is not None:
+                return response
+
+        instance = self.get_object()
+        etag, last_modified = self.get_etag([instance])
+        serializer = self.get_serializer(instance)
+        return self.get_conditional_response(request, etag, last_modified, Response(serializer.data))
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if not self.has_conditional_get(queryset.model):
+            return super().list(request, *args, **kwargs)
+
+        page = self.paginate_queryset(queryset)
+        instances = page if page is not None else list(queryset)
+
+        # The ETag of the page also depends on the link to the next page
+        etag, last_modified = self.get_etag(
+            instances, extra=self.paginator.get_next_link() if page is not None else None
+        )
+        response = self.get_conditional_response(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        serializer = self.get_serializer(instances, many=True)
+        with timing.phase("serialization"):
+            data = serializer.data
+        response = self.get_paginated_response(data) if page is not None else Response(data)
+        return self.get_conditional_response(request, etag, last_modified, response)
+
+    def get_url_primary_keys(self):
+        """
+        Returns the values of the primary key of the model that we have in
+        the URL, or None if the URL does not contain the full primary key.
+        """
+        model = self.get_queryset().model
+
+        url_kwargs = dict(self.kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if lookup_url_kwarg in url_kwargs:
+            lookup_field = model._meta.pk.name if self.lookup_field == "pk" else self.lookup_field
+            url_kwargs[lookup_field] = url_kwargs.pop(lookup_url_kwarg)
+
+        if not all(name in url_kwargs for name in model._primary_keys.keys()):
+            return None
+
+        return OrderedDict(
+            (name, column.validate(url_kwargs[name])) for name, column in model._primary_keys.items()
+        )
+
+    def partial_update(self, request, *args, **kwargs):
+        # The object permissions need the object as it is in the database
+        primary_keys = (
+            self.get_url_primary_keys()
+            if self.partial_update_without_read and not self.has_object_permissions()
+            else None
+        )
+        if primary_keys is None:
+            return super().partial_update(request, *args, **kwargs)
+
+        # We build the instance from the URL as if it was read from the
+        # database, only the columns set by the serializer will be written
+        model = self.get_queryset().model
+        instance = model.from_primary_keys(**primary_keys)
+
+        serializer = self.get_serializer(instance, data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+
+        # We only have the values of the columns we have written, the
+        # representation is not cached
+        written = set(serializer.validated_data.keys()) | set(model._primary_keys.keys())
+        if self.has_conditional_get(model):
+            written.add(self.conditional_get_field)
+
+        data = OrderedDict()
+        for field in serializer._readable_fields:
+            if field.source not in written:
+                continue
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            data[field.field_name] = field.to_representation(attribute) if attribute is not None else None
+        return Response(data)
+
+    @action(detail=False, methods=["post"], parser_classes=[FastJSONParser, NDJSONParser])
+    def bulk(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({"detail": "Expected a list of objects."})
+
+        if len(items) > self.bulk_max_items:
+            raise ValidationError(
+                {"detail": "Too many objects. The max number of objects is {0}.".format(self.bulk_max_items)}
+            )
+
+        serializer = self.get_serializer()
+        model = serializer.Meta.model
+
+        # Each object is validated with the serializer of the view, we keep
+        # the validated data of the valid ones when others have errors
+        results = [None] * len(items)
+        indexes = []
+        instances = []
+        for index, item in enumerate(items):
+            try:
+                validated_data = serializer.run_validation(item)
+            except ValidationError as ex:
+                results[index] = {
+                    "index": index,
+                    "status": status.HTTP_400_BAD_REQUEST,
+                    "errors": as_serializer_error(ex),
+                }
+                continue
+            indexes.append(index)
+            instances.append(self.get_bulk_instance(serializer, validated_data))
+
+        # Cassandra writes are upserts, we only read the objects that already
+        # exist when the permissions of the view check them
+        if instances and self.has_object_permissions():
+            existing = model.batch_get(
+                [get_primary_keys_values(instance, model) for instance in instances],
+                concurrency=self.bulk_concurrency,
+            )
+
+            allowed = []
+            for index, instance, previous in zip(indexes, instances, existing):
+                if isinstance(previous, Exception):
+                    LOGGER.warning("Unable to read the bulk item {0}: {1}".format(index, previous))
+                    results[index] = {
+                        "index": index,
+                        "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        "errors": {"detail": "Unable to check the permissions of the object."},
+                    }
+                    continue
+
+                if previous is not None:
+                    try:
+                        self.check_object_permissions(request, previous)
+                    except APIException as ex:
+                        results[index] = {"index": index, "status": ex.status_code, "errors": {"detail": ex.detail}}
+                        continue
+                allowed.append((index, instance))
+
+            indexes = [index for index, _ in allowed]
+            instances = [instance for _, instance in allowed]
+
+        errors = model.bulk_save(
+            instances, concurrency=self.bulk_concurrency, batch_by_partition=self.bulk_batch_by_partition
+        )
+
+        for index, instance, error in zip(indexes, instances, errors):
+            if error is None:
+                results[index] = {
+                    "index": index,
+                    "status": status.HTTP_200_OK,
+                    "data": get_primary_keys_values(instance, model),
+                }
+            else:
+                LOGGER.warning("Unable to save the bulk item {0}: {1}".format(index, error))
+                results[index] = {
+                    "index": index,
+                    "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    "errors": {"detail": "Unable to save the object."},
+                }
+
+        if any(result["status"] != status.HTTP_200_OK for result in results):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_200_OK
+        return Response(results, status=response_status)
+
+    def get_bulk_instance(self, serializer, validated_data):
+        """
+        Builds the instance of one of the objects of a `bulk` request from
+        its validated data. The `bulk` action does not call `perform_create`
+        or the `create` of the serializer, this is the place to set the
+        values they would set.
+        """
+        return deserialize_instance(serializer, serializer.Meta.model, validated_data)
+
+    def get_batch_retrieve_key(self, model, value):
+        """
+        Converts one of the ids received in a `batch_retrieve` into a dict
+        with the values of the primary key columns.
+        """
+        if not isinstance(value, dict):
+            lookup_field = model._meta.pk.name if self.lookup_field == "pk" else self.lookup_field
+            value = {lookup_field: value}
+
+        unknown_fields = set(value.keys()) - set(model._primary_keys.keys())
+        if unknown_fields:
+            raise ValueError("Not primary key fields: {0}".format(", ".join(sorted(unknown_fields))))
+
+        if not all(name in value for name in model._partition_keys.keys()):
+            raise ValueError("The partition key is required")
+
+        return {name: model._primary_keys[name].validate(field_value) for name, field_value in value.items()}
+
+    def has_object_permissions(self):
+        """
+        Returns True if some of the permissions of the view checks the
+        objects (implements `has_object_permission`).
+        """
+        return any(
+            type(permission).has_object_permission is not BasePermission.has_object_permission
+            for permission in self.get_permissions()
+        )
+
+    @action(detail=False, methods=["get", "post"])
+    def batch_retrieve(self, request, *args, **kwargs):
+        if request.method == "GET":
+            ids = [value for values in request.query_params.getlist("ids") for value in values.split(",") if value]
+        else:
+            ids = request.data.get("ids") if isinstance(request.data, dict) else None
+
+        if not isinstance(ids, list) or not ids:
+            raise ValidationError({"detail": "Expected a list of ids."})
+
+        if len(ids) > self.batch_retrieve_max_items:
+            raise ValidationError(
+                {"detail": "Too many ids. The max number of ids is {0}.".format(self.batch_retrieve_max_items)}
+            )
+
+        # The objects are read with the filters of the queryset of the view
+        queryset = self.filter_queryset(self.get_queryset())
+        model = queryset.model
+        serializer = self.get_serializer()
+        projection = get_query_projection(model, request.query_params)
+
+        # We can only use the cached representations if the client wants
+        # the full objects, the queryset is not filtered (ex. by the user),
+        # and if we do not need the objects to check the permissions
+        use_cache = (
+            isinstance(serializer, CachedSerializerMixin)
+            and projection is None
+            and not queryset._where
+            and not self.has_object_permissions()
+        )
+
+        results = [None] * len(ids)
+        keys = [None] * len(ids)
+        cache_keys = {}
+        for index, value in enumerate(ids):
+            try:
+                keys[index] = self.get_batch_retrieve_key(model, value)
+            except Exception as ex:
+                results[index] = {"index": index, "status": status.HTTP_400_BAD_REQUEST, "errors": {"detail": str(ex)}}
+                continue
+
+            if use_cache:
+                cache_key = serializer._get_cache_key(model(**keys[index]))
+                if cache_key:
+                    cache_keys[index] = cache_key
+
+        cached = cache.get_many(list(set(cache_keys.values()))) if cache_keys else {}
+        for index, cache_key in cache_keys.items():
+            if cache_key in cached:
+                results[index] = {"index": index, "status": status.HTTP_200_OK, "data": cached[cache_key]}
+
+        pending = [index for index, result in enumerate(results) if result is None]
+        instances = model.batch_get(
+            [keys[index] for index in pending], concurrency=self.bulk_concurrency, fields=projection, queryset=queryset
+        )
+
+        found = []
+        for index, instance in zip(pending, instances):
+            if instance is None:
+                results[index] = {
+                    "index": index,
+                    "status": status.HTTP_404_NOT_FOUND,
+                    "errors": {"detail": "Not found."},
+                }
+            elif isinstance(instance, Exception):
+                LOGGER.warning("Unable to read the batch item {0}: {1}".format(index, instance))
+                results[index] = {
+                    "index": index,
+                    "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    "errors": {"detail": "Unable to read the object."},
+                }
+            else:
+                try:
+                    self.check_object_permissions(request, instance)
+                except APIException as ex:
+                    results[index] = {"index": index, "status": ex.status_code, "errors": {"detail": ex.detail}}
+                    continue
+                found.append((index, instance))
+
+        data = self.get_serializer([instance for _, instance in found], many=True).data
+        for (index, _), item in zip(found, data):
+            results[index] = {"index": index, "status": status.HTTP_200_OK, "data": item}
+
+        return Response(results)
+
+
+class AsyncHaystackViewSetMixin(object):
+    """
+    Coroutine version of the `list` of the haystack viewsets. The searches
+    are sent with the async backends (`asearch`), a worker can have many
+    searches in flight while it waits for Solr/DSE.
+
+    Django 2.2 and DRF dispatch the views synchronously, `alist` is meant to
+    be awaited by ASGI consumers on an initialized view (authentication,
+    permissions and throttles already checked by `initial`).
+    """
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None or not hasattr(self.paginator, "apaginate_queryset"):
+            return None
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+
+            # Loading the objects of the page from Cassandra is blocking
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                None, contextvars.copy_context().run, self.get_paginated_response, serializer.data
+            )
+
+        # Without `end` Solr only returns its default number of rows, `list`
+        # returns all the results
+        serializer = self.get_serializer(await queryset.afetch(0, await queryset.acount()), many=True)
+        return Response(serializer.data)
+
+
+class SearchExplainViewSetMixin(object):
+    """
+    Explain mode of the search endpoints for staff users (`?explain=1`). The
+    response has an additional `explain` entry with the plan of the searches
+    sent to Solr/DSE (`q`, `fq`, the CQL statement, the path of the DSE
+    backend, the `debug=timing` output of Solr), the number of objects read
+    from Cassandra to build the page and the timings of the request.
+    """
+
+    explain_query_param = "explain"
+
+    def is_explain(self, request):
+        value = request.query_params.get(self.explain_query_param, None)
+        return value in ("1", "true") and getattr(request.user, "is_staff", False)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        if self.is_explain(request):
+            self._explain_token = explain.start()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "_explain_token", None)
+        if token is not None:
+            self._explain_token = None
+            plan = explain.finish(token).to_dict()
+
+            timings = timing.get_request_timings()
+            if timings is not None:
+                plan["timings"] = {name: round(duration * 1000, 2) for name, duration in timings.durations.items()}
+
+            if isinstance(response, Response):
+                if isinstance(response.data, dict):
+                    response.data["explain"] = plan
+                else:
+                    response.data = OrderedDict([("results", response.data), ("explain", plan)])
+
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class CaravaggioHaystackModelViewSet(
+    CaravaggioThrottledViewSet,
+    RequestProfileViewMixin,
+    SearchExplainViewSetMixin,
+    AsyncHaystackViewSetMixin,
+    HaystackViewSet,
+    RequestLogViewMixin,
+):
     """ We use this ViewSet as a base class when we are working with and
     endpoint that is directly connected with a Cassandra model class and
     has an index defined in the `search_indexes.py` file for it, activating
@@ -206,10 +869,33 @@ class CaravaggioHaystackModelViewSet(CaravaggioThrottledViewSet, HaystackViewSet
             raise AttributeError('You need to define the attribute "index_models"')
 
 
-class CaravaggioHaystackSearchViewSet(CaravaggioThrottledViewSet, RequestLogViewMixin, HaystackViewSet):
+class CaravaggioHaystackSearchViewSet(
+    CaravaggioThrottledViewSet,
+    RequestProfileViewMixin,
+    SearchExplainViewSetMixin,
+    AsyncHaystackViewSetMixin,
+    RequestLogViewMixin,
+    HaystackViewSet,
+):
+    """ Search ViewSet over one or several indexed models.
+
+    With several `index_models` the searches are federated: the query is sent
+    to the core of each model concurrently and the results are merged by
+    score (or by the `order_by` fields). The total and the facets are
+    combined, and the pages are navigated with a composite cursor
+    (`federated_pagination_class`).
+
+        Example:
+
+        class GlobalSearchViewSet(CaravaggioHaystackSearchViewSet):
+            index_models = [Company, Person]
+            serializer_class = GlobalSearchSerializerV1
+    """
 
     pagination_class = CaravaggioHaystackPageNumberPagination
 
+    federated_pagination_class = CaravaggioFederatedSearchPagination
+
     object_class = CaravaggioSearchQuerySet
 
     filter_backends = [
@@ -230,9 +916,18 @@ class CaravaggioHaystackSearchViewSet(CaravaggioThrottledViewSet, RequestLogView
         if not hasattr(self, "index_models"):
             raise AttributeError('You need to define the attribute "index_models"')
 
+        if len(self.index_models) > 1 and self.federated_pagination_class:
+            self.pagination_class = self.federated_pagination_class
+
 
 class CaravaggioHaystackFacetSearchViewSet(
-    CaravaggioThrottledViewSet, mixins.FacetMixin, RequestLogViewMixin, HaystackViewSet
+    CaravaggioThrottledViewSet,
+    RequestProfileViewMixin,
+    SearchExplainViewSetMixin,
+    AsyncHaystackViewSetMixin,
+    mixins.FacetMixin,
+    RequestLogViewMixin,
+    HaystackViewSet,
 ):
     """ This viewset extends the normal Haystack Search adding support for
     Facet queries through a new filter added to the list of `filter_backends`
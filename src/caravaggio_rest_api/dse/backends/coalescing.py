@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+Single-flight coalescing of identical concurrent searches: when the same
+search (the same CQL statement and paging state) is requested by several
+callers at the same time, only one of them (the leader) sends it to DSE and
+the others wait for its results.
+
+Inside a process the callers are coalesced across threads. With a `CACHE`
+(the alias of a `django_redis` cache) the callers of other processes are
+also coalesced: the leader holds a short Redis lock and stores the results
+in Redis under the token of the lock, the callers that find the lock taken
+wait for the results of that token. Only the callers that arrived while the
+search was running share its results, a later caller sends a new search.
+
+If the results are not available after `TIMEOUT` seconds, or the leader of
+another process fails, the caller sends the search itself.
+"""
+import hashlib
+import json
+import logging
+import pickle
+import threading
+import uuid
+
+from time import monotonic, sleep
+
+from django_redis import get_redis_connection
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10
+# Seconds the results of the leader are kept in Redis for the callers of
+# other processes
+DEFAULT_RESULTS_TIMEOUT = 5
+DEFAULT_KEY_PREFIX = "caravaggio_rest_api:single_flight"
+
+MIN_POLL_INTERVAL = 0.005
+MAX_POLL_INTERVAL = 0.05
+
+_MISSING = object()
+
+_single_flights = {}
+_single_flights_lock = threading.Lock()
+
+
+def get_search_key(*parts):
+    """
+    The key of a search from the parts that identify it (ex. the CQL
+    statement and the paging state).
+    """
+    normalized = [part.hex() if isinstance(part, bytes) else part for part in parts]
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def get_single_flight(connection_alias, options):
+    """
+    The `SingleFlight` shared by all the threads for the search connection,
+    None if the coalescing is not enabled in the `COALESCING` options of the
+    connection.
+    """
+    if not options or not options.get("ENABLED", False):
+        return None
+
+    with _single_flights_lock:
+        if connection_alias not in _single_flights:
+            _single_flights[connection_alias] = SingleFlight(
+                timeout=options.get("TIMEOUT", DEFAULT_TIMEOUT),
+                cache_alias=options.get("CACHE", None),
+                key_prefix="{0}:{1}".format(DEFAULT_KEY_PREFIX, connection_alias),
+            )
+        return _single_flights[connection_alias]
+
+
+class Flight(object):
+    """
+    A search in progress in this process.
+    """
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    def __init__(self, timeout=DEFAULT_TIMEOUT, cache_alias=None, key_prefix=DEFAULT_KEY_PREFIX):
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+        self.key_prefix = key_prefix
+
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, func):
+        """
+        Runs `func` once for all the concurrent callers with the same `key`.
+        Returns the result and if it was shared with (computed by) another
+        caller. The errors of the leader are raised to all the callers that
+        were waiting for it.
+        """
+        with self._lock:
+            flight = self._flights.get(key, None)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = Flight()
+
+        if not is_leader:
+            if flight.done.wait(self.timeout):
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result, True
+
+            LOGGER.warning("Timeout waiting for an identical search, sending the search {0}".format(key))
+            return func(), False
+
+        try:
+            flight.result, shared = self._run_leader(key, func)
+            return flight.result, shared
+        except Exception as ex:
+            flight.error = ex
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _run_leader(self, key, func):
+        if self.cache_alias is None:
+            return func(), False
+
+        lock_key = "{0}:lock:{1}".format(self.key_prefix, key)
+        token = uuid.uuid4().hex
+        try:
+            client = get_redis_connection(self.cache_alias)
+            lock = client.lock(lock_key, timeout=self.timeout)
+            holder = None
+            if not lock.acquire(blocking=False, token=token):
+                holder = client.get(lock_key)
+        except Exception as ex:
+            LOGGER.warning("Unable to coalesce the search {0} with other processes: {1}".format(key, ex))
+            return func(), False
+
+        if holder is not None:
+            result = self._wait_results(client, lock_key, holder)
+            if result is not _MISSING:
+                return result, True
+            return func(), False
+
+        if lock.local.token is None:
+            # The lock was released between our attempts, there is nothing
+            # to wait for
+            return func(), False
+
+        try:
+            result = func()
+            try:
+                client.set(
+                    self._get_results_key(token),
+                    pickle.dumps(result, pickle.HIGHEST_PROTOCOL),
+                    px=int(DEFAULT_RESULTS_TIMEOUT * 1000),
+                )
+            except Exception as ex:
+                LOGGER.warning("Unable to share the results of the search {0}: {1}".format(key, ex))
+            return result, False
+        finally:
+            try:
+                lock.release()
+            except Exception:
+                # The lock expired, nothing to release
+                pass
+
+    def _get_results_key(self, token):
+        if isinstance(token, bytes):
+            token = token.decode("utf-8")
+        return "{0}:results:{1}".format(self.key_prefix, token)
+
+    def _wait_results(self, client, lock_key, holder):
+        """
+        Waits for the results of the search of the leader of another process
+        (the `holder` of the lock).
+        """
+        results_key = self._get_results_key(holder)
+        deadline = monotonic() + self.timeout
+        interval = MIN_POLL_INTERVAL
+        try:
+            while monotonic() < deadline:
+                results = client.get(results_key)
+                if results is not None:
+                    return pickle.loads(results)
+
+                if client.get(lock_key) != holder:
+                    # The leader finished, the results could have been
+                    # stored right before the release
+                    results = client.get(results_key)
+                    return pickle.loads(results) if results is not None else _MISSING
+
+                sleep(interval)
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+        except Exception as ex:
+            LOGGER.warning("Unable to get the results of an identical search: {0}".format(ex))
+            return _MISSING
+
+        LOGGER.warning("Timeout waiting for an identical search in another process")
+        return _MISSING
@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*
 # Copyright (c) 2019 BuildGroup Data Services Inc.
+import copy
 import re
 import json
 
-from caravaggio_rest_api.dse.backends.utils import DSEPaginator
+from collections import OrderedDict
+from time import perf_counter
+
+from caravaggio_rest_api import explain, timing
+from caravaggio_rest_api.dse.backends.coalescing import get_search_key, get_single_flight
+from caravaggio_rest_api.dse.backends.utils import AsyncResponse, DSEPaginator
 
 from caravaggio_rest_api.haystack.backends.utils import SolrSearchPaginator
+from caravaggio_rest_api.haystack.models import get_result_class
+from caravaggio_rest_api.haystack.indexes import TextField
 from django.db import connections
 from haystack.utils.app_loading import haystack_get_model
 
-from haystack.backends import BaseEngine
+from haystack.backends import BaseEngine, SearchNode
 from caravaggio_rest_api.haystack.backends.solr_backend import CassandraSolrSearchBackend, CassandraSolrSearchQuery
 from haystack.constants import DJANGO_CT, DJANGO_ID, DEFAULT_ALIAS, ID
 from haystack.exceptions import MissingDependency
@@ -18,10 +26,14 @@ from haystack.models import SearchResult
 from caravaggio_rest_api.haystack.backends import SolrSearchNode
 
 try:
+    from dse.cqlengine import connection, ValidationError
+    from dse.encoder import Encoder
     from dse.util import Date
     from dse.query import SimpleStatement
     from dse import ConsistencyLevel
 except ImportError:
+    from cassandra.cqlengine import connection, ValidationError
+    from cassandra.encoder import Encoder
     from cassandra.util import Date
     from cassandra.query import SimpleStatement
     from cassandra import ConsistencyLevel
@@ -37,6 +49,20 @@ VALID_JSON_FACET_TYPES = ["terms", "query"]
 
 DEFAULT_FETCH_SIZE = 500
 
+CQL_ENCODER = Encoder()
+
+
+def _date_to_str(convert):
+    def decode(value):
+        return convert(str(value) if isinstance(value, Date) else value)
+
+    return decode
+
+
+def _default_score(value):
+    # The CQL queries do not return the score
+    return 1.0 if value is None else value
+
 
 class DSEBackend(CassandraSolrSearchBackend):
     def __init__(self, connection_alias, **connection_options):
@@ -44,6 +70,9 @@ class DSEBackend(CassandraSolrSearchBackend):
         self.connection = connections["cassandra"]
         self.backup_implementation = CassandraSolrSearchBackend(connection_alias, **connection_options)
 
+        # Identical concurrent searches are sent only once (see `coalescing`)
+        self.single_flight = get_single_flight(connection_alias, connection_options.get("COALESCING", None))
+
     def _process_results(
         self,
         raw_results,
@@ -76,6 +105,7 @@ class DSEBackend(CassandraSolrSearchBackend):
 
         if result_class is None:
             result_class = SearchResult
+        result_class = get_result_class(result_class, self.connection_alias)
 
         if hasattr(raw_results, "stats"):
             stats = raw_results.stats.get("stats_fields", {})
@@ -173,6 +203,28 @@ class DSEBackend(CassandraSolrSearchBackend):
 
         return results
 
+    def get_values_decoders(self, model, fields):
+        """
+        The rows of the CQL queries already have python values, we only apply
+        the conversions `_process_results` does.
+        """
+        from haystack import connections
+
+        index = connections[self.connection_alias].get_unified_index().get_index(model)
+
+        decoders = []
+        for field_name in fields:
+            field = index.fields.get(field_name, None)
+            if field is not None and hasattr(field, "convert"):
+                decoders.append((field_name, _date_to_str(field.convert)))
+            elif field_name in model._columns:
+                decoders.append((field_name, model._columns[field_name].to_python))
+            elif field_name == "score":
+                decoders.append((field_name, _default_score))
+            else:
+                decoders.append((field_name, self.backup_implementation.conn._to_python))
+        return decoders
+
     def build_search_kwargs(
         self,
         query_string,
@@ -245,7 +297,7 @@ class DSEBackend(CassandraSolrSearchBackend):
 
         return kwargs
 
-    def mount_query(self, table_name, query_string, select_fields, rows, is_count, **search_kwargs):
+    def mount_query(self, table_name, query_string, select_fields, rows, is_count, partition_key=None, **search_kwargs):
         solr_query = dict(search_kwargs)
         if is_count:
             select_fields = "COUNT(*) as rows_count"
@@ -253,25 +305,62 @@ class DSEBackend(CassandraSolrSearchBackend):
             solr_query.pop("start", None)
 
         solr_query["q"] = query_string
-        query = "SELECT %s FROM %s WHERE solr_query='%s'" % (select_fields, table_name, json.dumps(solr_query))
+        restrictions = ["solr_query='%s'" % json.dumps(solr_query)]
+
+        # When the filters pin a single partition we restrict the query to
+        # it, DSE only sends the query to the replicas of the partition
+        # instead of covering all the token ranges of the cluster
+        if partition_key:
+            restrictions = [
+                '"%s" = %s' % (name, CQL_ENCODER.cql_encode_all_types(value)) for name, value in partition_key.items()
+            ] + restrictions
+
+        query = "SELECT %s FROM %s WHERE %s" % (select_fields, table_name, " AND ".join(restrictions))
 
         if rows:
             query += " LIMIT %d" % rows
 
         return query
 
-    def search(self, query_string, **kwargs):
-        if self.has_group(**kwargs) or self.has_percent_score(**kwargs) or self.has_json_facets(**kwargs):
-            return self.backup_implementation.search(query_string, **kwargs)
+    def _search_backend(self):
+        backend = super()._search_backend()
+        backend.backup_implementation = backend.backup_implementation._search_backend()
+        return backend
+
+    def get_backup_reasons(self, **kwargs):
+        """
+        Groups, percent scores and json facets are not available through CQL,
+        these searches are sent to the Solr HTTP API.
+        """
+        checks = (
+            ("group", self.has_group),
+            ("percent_score", self.has_percent_score),
+            ("json_facets", self.has_json_facets),
+        )
+        return [reason for reason, check in checks if check(**kwargs)]
+
+    def use_backup_implementation(self, **kwargs):
+        return len(self.get_backup_reasons(**kwargs)) > 0
+
+    def _prepare_search(self, query_string, kwargs):
+        """
+        Prepares the CQL statement of the search. The search is None if there
+        is nothing to search.
+        """
         # In cassandra we can only query one table at a time, then only one
         # model should be present in the list of models
         model = list(kwargs["models"])[0]
 
         if len(query_string) == 0:
-            return {
-                "results": [],
-                "hits": 0,
-            }
+            return model, None, None
+
+        # values()/values_list() queries: the CQL projection is the list of
+        # requested fields and the rows are returned as tuples
+        values_fields = kwargs.pop("values_fields", None)
+        if values_fields is not None:
+            kwargs["fields"] = list(values_fields)
+
+        partition_key = kwargs.pop("partition_key", None)
 
         search_kwargs = self.build_search_kwargs(query_string, **kwargs)
         select_fields, rows = self.kwargs_to_dse_format(search_kwargs)
@@ -294,64 +383,118 @@ class DSEBackend(CassandraSolrSearchBackend):
             fetch_size = rows
             rows = None
             search_kwargs["paging"] = "driver"
-        try:
-            query = self.mount_query(model.__table_name__, query_string, select_fields, rows, is_count, **search_kwargs)
-            self.log.debug(f"CQL Query: {query}")
-
-            select_statement = SimpleStatement(query, fetch_size=fetch_size)
-            with self.connection.cursor() as cursor:
-                # we need the cursor from the django cassandra engine, not the wrappers
-                normal_consumer_wrapper_available = True
-                try:
-                    from debug_toolbar.panels.sql.tracking import NormalCursorWrapper
-                except:
-                    normal_consumer_wrapper_available = False
-
-                if normal_consumer_wrapper_available and isinstance(cursor, NormalCursorWrapper):
-                    cursor = cursor.cursor.cursor
-                else:
-                    cursor = cursor.cursor
-
-                raw_results = cursor.execute(select_statement, paging_state=paging_state, timeout=self.timeout)
-        except Exception as e:
-            if not self.silently_fail:
-                raise
 
-            self.log.error("Failed to query Solr using '%s': %s", query_string, e, exc_info=True)
-            raw_results = []
+        query = self.mount_query(
+            model.__table_name__,
+            query_string,
+            select_fields,
+            rows,
+            is_count,
+            partition_key=partition_key,
+            **search_kwargs,
+        )
+        self.log.debug(f"CQL Query: {query}")
+
+        search = {
+            "statement": SimpleStatement(query, fetch_size=fetch_size),
+            "paging_state": paging_state,
+            "has_paging": has_paging,
+            "is_count": is_count,
+            "is_faceted": search_kwargs.get("facet", None) is not None,
+            "explain": explain.add_search(
+                backend="dse", path="cql", cql=query, q=query_string, params=dict(search_kwargs)
+            ),
+        }
+        return model, search, values_fields
+
+    def _execute_search(self, search):
+        with self.connection.cursor() as cursor:
+            # we need the cursor from the django cassandra engine, not the wrappers
+            normal_consumer_wrapper_available = True
+            try:
+                from debug_toolbar.panels.sql.tracking import NormalCursorWrapper
+            except:
+                normal_consumer_wrapper_available = False
+
+            if normal_consumer_wrapper_available and isinstance(cursor, NormalCursorWrapper):
+                cursor = cursor.cursor.cursor
+            else:
+                cursor = cursor.cursor
 
-        if has_paging and raw_results:
-            has_more_pages = raw_results.has_more_pages
-            paging_state = raw_results.paging_state
-            raw_results = raw_results.current_rows
-        else:
-            has_more_pages = None
-            paging_state = None
-            raw_results = [raw_result for raw_result in raw_results]
+            raw_results = cursor.execute(search["statement"], paging_state=search["paging_state"], timeout=self.timeout)
 
-        if is_count:
+        if search["has_paging"] and raw_results:
+            return raw_results.current_rows, raw_results.has_more_pages, raw_results.paging_state
+        return [raw_result for raw_result in raw_results], None, None
+
+    def _execute_coalesced_search(self, search):
+        """
+        Executes the search, or waits for the results of an identical search
+        already running.
+        """
+        if self.single_flight is None:
+            return self._execute_search(search)
+
+        statement = search["statement"]
+        key = get_search_key(
+            self.connection_alias,
+            self.connection.alias,
+            statement.query_string,
+            statement.fetch_size,
+            search["paging_state"],
+        )
+        (raw_results, has_more_pages, paging_state), shared = self.single_flight.run(
+            key, lambda: self._execute_search(search)
+        )
+
+        if search["explain"] is not None:
+            search["explain"]["coalesced"] = shared
+
+        # The rows are shared with the other callers, and they are changed
+        # when we build the results
+        return [copy.copy(raw_result) for raw_result in raw_results], has_more_pages, paging_state
+
+    async def _aexecute_search(self, model, search):
+        session = connection.get_session(connection=model._get_connection())
+        response = AsyncResponse(
+            session.execute_async(search["statement"], paging_state=search["paging_state"], timeout=self.timeout)
+        )
+
+        if search["has_paging"]:
+            raw_results = await response.fetch_page()
+            if raw_results:
+                return raw_results, response.has_more_pages, response.paging_state
+            return raw_results, None, None
+        return await response.fetch_all(), None, None
+
+    def _finish_search(self, raw_results, has_more_pages, paging_state, model, values_fields, kwargs, search):
+        if search["is_count"]:
             if len(raw_results) == 1 and "rows_count" in raw_results[0]:
                 return {
                     "results": [],
                     "hits": raw_results[0]["rows_count"],
                 }
 
-        app_model = model._meta.label_lower
-        for index, raw_result in enumerate(raw_results):
-            raw_result[DJANGO_CT] = app_model
-            raw_result[DJANGO_ID] = index
-
-        final_results = self._process_results(
-            raw_results,
-            model=model,
-            highlight=kwargs.get("highlight"),
-            result_class=kwargs.get("result_class", SearchResult),
-            distance_point=kwargs.get("distance_point"),
-            percent_score=kwargs.get("percent_score"),
-            is_faceted=search_kwargs.get("facet", None) is not None,
-        )
-
-        if has_paging:
+        if values_fields is not None:
+            final_results = self._process_values(raw_results, model, values_fields)
+            final_results["hits"] = 0
+        else:
+            app_model = model._meta.label_lower
+            for index, raw_result in enumerate(raw_results):
+                raw_result[DJANGO_CT] = app_model
+                raw_result[DJANGO_ID] = index
+
+            final_results = self._process_results(
+                raw_results,
+                model=model,
+                highlight=kwargs.get("highlight"),
+                result_class=kwargs.get("result_class", SearchResult),
+                distance_point=kwargs.get("distance_point"),
+                percent_score=kwargs.get("percent_score"),
+                is_faceted=search["is_faceted"],
+            )
+
+        if search["has_paging"]:
             if raw_results:
                 final_results = final_results, has_more_pages, paging_state
             else:
@@ -359,6 +502,85 @@ class DSEBackend(CassandraSolrSearchBackend):
 
         return final_results
 
+    def search(self, query_string, **kwargs):
+        if self.is_federated(**kwargs):
+            return self.federated_search(query_string, **kwargs)
+
+        if self.use_backup_implementation(**kwargs):
+            explain.add_search(backend="dse", path="backup_implementation", reasons=self.get_backup_reasons(**kwargs))
+            kwargs.pop("partition_key", None)
+            return self.backup_implementation.search(query_string, **kwargs)
+
+        model, search, values_fields = self._prepare_search(query_string, kwargs)
+        if search is None:
+            return {
+                "results": [],
+                "hits": 0,
+            }
+
+        start = perf_counter()
+        try:
+            with timing.phase("cql"):
+                raw_results, has_more_pages, paging_state = self._execute_coalesced_search(search)
+        except Exception as e:
+            if not self.silently_fail:
+                raise
+
+            self.log.error("Failed to query Solr using '%s': %s", query_string, e, exc_info=True)
+            raw_results, has_more_pages, paging_state = [], None, None
+
+        if search["explain"] is not None:
+            self.explain_results(search["explain"], raw_results, has_more_pages, perf_counter() - start)
+
+        return self._finish_search(raw_results, has_more_pages, paging_state, model, values_fields, kwargs, search)
+
+    async def asearch(self, query_string, **kwargs):
+        """
+        Coroutine version of `search`, the CQL statement is executed with the
+        async execution of the driver.
+        """
+        if self.is_federated(**kwargs):
+            return await self.afederated_search(query_string, **kwargs)
+
+        if self.use_backup_implementation(**kwargs):
+            explain.add_search(backend="dse", path="backup_implementation", reasons=self.get_backup_reasons(**kwargs))
+            kwargs.pop("partition_key", None)
+            return await self.backup_implementation.asearch(query_string, **kwargs)
+
+        backend = self._search_backend()
+
+        model, search, values_fields = backend._prepare_search(query_string, kwargs)
+        if search is None:
+            return {
+                "results": [],
+                "hits": 0,
+            }
+
+        start = perf_counter()
+        try:
+            with timing.phase("cql"):
+                raw_results, has_more_pages, paging_state = await backend._aexecute_search(model, search)
+        except Exception as e:
+            if not self.silently_fail:
+                raise
+
+            self.log.error("Failed to query Solr using '%s': %s", query_string, e, exc_info=True)
+            raw_results, has_more_pages, paging_state = [], None, None
+
+        if search["explain"] is not None:
+            backend.explain_results(search["explain"], raw_results, has_more_pages, perf_counter() - start)
+
+        return backend._finish_search(raw_results, has_more_pages, paging_state, model, values_fields, kwargs, search)
+
+    async def aclose(self):
+        await self.backup_implementation.aclose()
+
+    def explain_results(self, plan, raw_results, has_more_pages, duration):
+        # The CQL searches do not return the debug information of Solr
+        plan.update(
+            {"time_ms": round(duration * 1000, 2), "rows": len(raw_results), "has_more_pages": bool(has_more_pages)}
+        )
+
     def kwargs_to_dse_format(self, kwargs):
         fields = kwargs.pop("fl", None)
         if fields:
@@ -460,6 +682,117 @@ class DSEQuery(CassandraSolrSearchQuery):
         kwargs["is_result"] = True
         return super().get_results(**kwargs)
 
+    async def aget_count(self):
+        if not self._hit_count:
+            await self.arun(is_count=True)
+
+        return self._hit_count
+
+    async def aget_results(self, **kwargs):
+        kwargs["is_result"] = True
+        return await super().aget_results(**kwargs)
+
+    def has_results(self):
+        """
+        The number of hits in DSE needs a COUNT(*) of all the matching rows,
+        we ask for the primary key of the first row instead.
+        """
+        if len(self.models) > 1:
+            return self.get_count() > 0
+
+        model = list(self.models)[0]
+
+        self.run(start_offset=0, end_offset=1, values_fields=tuple(model._primary_keys.keys()), is_result=True)
+        has_results = len(self._results) > 0
+
+        self._results = None
+        self._hit_count = None
+        return has_results
+
+    def _collect_exact_filters(self, node, filters):
+        # Only the filters that every result has to match: the children of
+        # AND nodes that are not negated
+        if node.negated or (node.connector != SearchNode.AND and len(node.children) > 1):
+            return
+
+        for child in node.children:
+            if isinstance(child, SearchNode):
+                self._collect_exact_filters(child, filters)
+                continue
+
+            expression, value = child
+            field, filter_type = node.split_expression(expression)
+            if filter_type not in ("exact", "content"):
+                continue
+
+            if hasattr(value, "input_type_name"):
+                if value.input_type_name != "exact":
+                    continue
+                filter_type = "exact"
+                value = value.query_string
+
+            # A content filter with several words is not an equality
+            if filter_type == "content" and isinstance(value, str) and len(value.split()) != 1:
+                continue
+
+            filters.setdefault(field, (filter_type, value))
+
+    @staticmethod
+    def _is_tokenized(index, field):
+        """
+        Returns True if the field is indexed with a tokenized type (the
+        `TextField` of the schema generated by `sync_indexes`), a content
+        filter of a single word is not an equality.
+        """
+        if field is None or isinstance(field, TextField):
+            return True
+        return field.model_attr in getattr(index.Meta, "text_fields", []) and not field.faceted
+
+    def get_partition_key(self):
+        """
+        Returns the values of the partition key columns of the model (by the
+        name of the column in the table) if the filters of the query pin a
+        single partition, None otherwise.
+
+        Only the `exact` filters, and the `content` filters of a single word
+        over fields that are not tokenized, are equalities.
+        """
+        from haystack import connections
+
+        if len(self.models) != 1:
+            return None
+
+        model = list(self.models)[0]
+        partition_keys = getattr(model, "_partition_keys", None)
+        if not partition_keys:
+            return None
+
+        filters = {}
+        self._collect_exact_filters(self.query_filter, filters)
+        if not filters:
+            return None
+
+        # The filters use the names of the fields of the index
+        index = connections[self._using].get_unified_index().get_index(model)
+        columns_filters = {}
+        for field_name, (filter_type, value) in filters.items():
+            field = index.fields.get(field_name, None)
+            if filter_type == "content" and self._is_tokenized(index, field):
+                continue
+            columns_filters[getattr(field, "model_attr", None) or field_name] = value
+
+        partition_key = OrderedDict()
+        for name, column in partition_keys.items():
+            if name not in columns_filters:
+                return None
+
+            try:
+                partition_key[column.db_field_name] = column.to_database(column.validate(columns_filters[name]))
+            except (ValidationError, ValueError, TypeError):
+                return None
+
+        return partition_key
+
     def add_heatmap_facet(self, field, **options):
         self.heatmap_facets[field] = options
 
@@ -474,6 +807,10 @@ class DSEQuery(CassandraSolrSearchQuery):
         if self.heatmap_facets:
             kwargs["heatmap_facets"] = self.heatmap_facets
 
+        partition_key = self.get_partition_key()
+        if partition_key is not None:
+            kwargs["partition_key"] = partition_key
+
         return kwargs
 
 
@@ -1,9 +1,61 @@
 # -*- coding: utf-8 -*
 # Copyright (c) 2019 BuildGroup Data Services Inc.
+import asyncio
+
 from caravaggio_rest_api.caravaggio_paginator import CaravaggioSearchPaginator
 from haystack.backends import EmptyResults
 
 
+class AsyncResponse(object):
+    """
+    Bridges the `ResponseFuture` of an async execution of the driver with
+    asyncio. The callbacks of the driver are called from the threads of the
+    driver, we resolve the pages in the event loop.
+    """
+
+    def __init__(self, response_future, loop=None):
+        self.response_future = response_future
+        self.loop = loop or asyncio.get_event_loop()
+        self.page = self.loop.create_future()
+        response_future.add_callbacks(self._on_rows, self._on_error)
+
+    def _on_rows(self, rows):
+        self.loop.call_soon_threadsafe(self._resolve, rows, None)
+
+    def _on_error(self, exc):
+        self.loop.call_soon_threadsafe(self._resolve, None, exc)
+
+    def _resolve(self, rows, exc):
+        if self.page.done():
+            return
+        if exc is not None:
+            self.page.set_exception(exc)
+        else:
+            self.page.set_result(rows)
+
+    @property
+    def has_more_pages(self):
+        return self.response_future.has_more_pages
+
+    @property
+    def paging_state(self):
+        return self.response_future._paging_state
+
+    async def fetch_page(self):
+        return await self.page
+
+    async def fetch_next_page(self):
+        self.page = self.loop.create_future()
+        self.response_future.start_fetching_next_page()
+        return await self.page
+
+    async def fetch_all(self):
+        rows = list(await self.fetch_page())
+        while self.has_more_pages:
+            rows.extend(await self.fetch_next_page())
+        return rows
+
+
 class DSEPaginator(CaravaggioSearchPaginator):
     def __init__(self, **kwargs):
         self.query_string = kwargs.pop("query_string", None)
@@ -39,30 +91,52 @@ class DSEPaginator(CaravaggioSearchPaginator):
             return False
         return self.results is None or self.has_more_pages
 
+    def _prepare_next(self):
+        # Signaling the cursor mark
+        if "start_offset" in self.search_kwargs:
+            del self.search_kwargs[str("start_offset")]
+
+        self.search_kwargs["end_offset"] = (
+            self.limit if self.limit is not None and self.limit < self.max_limit else self.max_limit
+        )
+
     def next(self):
         if self.has_next():
-            # Signaling the cursor mark
-            if "start_offset" in self.search_kwargs:
-                del self.search_kwargs[str("start_offset")]
-
-            self.search_kwargs["end_offset"] = (
-                self.limit if self.limit is not None and self.limit < self.max_limit else self.max_limit
-            )
+            self._prepare_next()
 
             # Do the search
             self.results, self.has_more_pages, self.paging_state = self.backend.search(
                 query_string=self.query_string, has_paging=True, paging_state=self.paging_state, **self.search_kwargs
             )
 
-            results_size = len(self.results["results"])
-            self.loaded_docs += results_size
+            return self._process_next()
+        else:
+            return EmptyResults()
 
-            if self.max_results and self.loaded_docs > self.max_results:
-                extra_values = self.loaded_docs - self.max_results
-                if extra_values < results_size:
-                    self.results["results"] = self.results["results"][: results_size - extra_values]
-                    self.loaded_docs = self.max_results
+    async def anext(self):
+        """
+        Coroutine version of `next`.
+        """
+        if self.has_next():
+            self._prepare_next()
 
-            return self.results
+            # Do the search
+            self.results, self.has_more_pages, self.paging_state = await self.backend.asearch(
+                query_string=self.query_string, has_paging=True, paging_state=self.paging_state, **self.search_kwargs
+            )
+
+            return self._process_next()
         else:
             return EmptyResults()
+
+    def _process_next(self):
+        results_size = len(self.results["results"])
+        self.loaded_docs += results_size
+
+        if self.max_results and self.loaded_docs > self.max_results:
+            extra_values = self.loaded_docs - self.max_results
+            if extra_values < results_size:
+                self.results["results"] = self.results["results"][: results_size - extra_values]
+                self.loaded_docs = self.max_results
+
+        return self.results
@@ -2,29 +2,175 @@
 # Copyright (c) 2019 BuildGroup Data Services Inc.
 # All rights reserved.
 import logging
+import threading
 import uuid
 import six
 
 try:
-    from dse.cqlengine.operators import BaseWhereOperator
-    from dse.cqlengine import columns
+    from dse.cqlengine.operators import BaseWhereOperator, EqualsOperator
+    from dse.cqlengine import columns, connection
+    from dse.cqlengine.query import BatchQuery
+    from dse.concurrent import execute_concurrent
+    from dse.query import SimpleStatement
     from dse import ConsistencyLevel
 except ImportError:
-    from cassandra.cqlengine.operators import BaseWhereOperator
-    from cassandra.cqlengine import columns
+    from cassandra.cqlengine.operators import BaseWhereOperator, EqualsOperator
+    from cassandra.cqlengine import columns, connection
+    from cassandra.cqlengine.query import BatchQuery
+    from cassandra.concurrent import execute_concurrent
+    from cassandra.query import SimpleStatement
     from cassandra import ConsistencyLevel
 
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 
 from django.dispatch import receiver
 from django.db.models.signals import pre_init, post_init, pre_delete, post_delete, pre_save, post_save
 
-from django_cassandra_engine.models import DjangoCassandraModel, DjangoCassandraModelMetaClass
+from django_cassandra_engine.models import DjangoCassandraModel, DjangoCassandraModelMetaClass, DjangoCassandraQuerySet
 
-from rest_framework_cache.utils import clear_for_instance
+from rest_framework_cache.cache import cache
+from rest_framework_cache.utils import get_all_cache_keys
+
+from caravaggio_rest_api.dse.signals import post_bulk_save, post_bulk_delete
 
 LOGGER = logging.getLogger(__name__)
 
+# The max number of in-flight requests used by the bulk operations
+DEFAULT_BULK_CONCURRENCY = 50
+
+# The max number of partitions read by a single `IN` query of `batch_get`,
+# the coordinator fans out the query to the replicas of all of them
+DEFAULT_BATCH_GET_PARTITIONS = 20
+
+
+def _unlogged_batch(queries):
+    """
+    Renders the cqlengine statements as a single UNLOGGED BATCH, the same
+    way `BatchQuery.execute` does it.
+    """
+    query_list = ["BEGIN UNLOGGED BATCH"]
+    parameters = {}
+    ctx_counter = 0
+    for query in queries:
+        query.update_context_id(ctx_counter)
+        ctx = query.get_context()
+        ctx_counter += len(ctx)
+        query_list.append("  " + str(query))
+        parameters.update(ctx)
+    query_list.append("APPLY BATCH;")
+    return "\n".join(query_list), parameters
+
+
+_deferred = threading.local()
+
+
+class DeferredSideEffects(object):
+    """
+    Accumulates the post signals and the DRF cache invalidations of the
+    instances written inside a `deferred_side_effects` block.
+    """
+
+    def __init__(self, send_instance_signals=True):
+        self.send_instance_signals = send_instance_signals
+        self.cache_keys = set()
+        self.signals = OrderedDict()
+
+    @staticmethod
+    def _instance_key(instance):
+        try:
+            key = tuple(getattr(instance, name) for name in instance._primary_keys.keys())
+            hash(key)
+            return key
+        except TypeError:
+            return id(instance)
+
+    def add_signal(self, signal, sender, instance, **kwargs):
+        key = (signal, sender, self._instance_key(instance))
+        previous = self.signals.pop(key, None)
+        if previous is not None and previous[2].get("created"):
+            # The instance was created inside the block
+            kwargs["created"] = True
+        self.signals[key] = (signal, sender, dict(kwargs, instance=instance))
+
+    def add_cache_keys(self, instance):
+        self.cache_keys.update(get_all_cache_keys(instance))
+
+    def dispatch(self):
+        if self.cache_keys:
+            cache.delete_many(list(self.cache_keys))
+
+        bulk_signals = OrderedDict()
+        for signal, sender, kwargs in self.signals.values():
+            if self.send_instance_signals:
+                signal.send(sender=sender, **kwargs)
+            bulk_signal = post_bulk_delete if signal is post_delete else post_bulk_save
+            bulk_signals.setdefault((bulk_signal, sender), []).append(kwargs["instance"])
+
+        for (bulk_signal, sender), instances in bulk_signals.items():
+            bulk_signal.send(sender=sender, instances=instances)
+
+
+@contextmanager
+def deferred_side_effects(send_instance_signals=True):
+    """
+    Defers the `post_save`/`post_delete` signals and the DRF cache
+    invalidations of the Cassandra models until the block exits, where they
+    are dispatched coalesced: the cache keys are de-duplicated and deleted
+    with a single `delete_many`, the `post_save`/`post_delete` signals are
+    sent once per instance (the last one) and a `post_bulk_save`/
+    `post_bulk_delete` signal is sent per model with all the instances.
+
+    The `pre_*` signals are still sent synchronously, the receivers can
+    change the instance before it is persisted (ex. `updated_at`). Note that
+    `rest_framework_cache` also clears the cache of each instance on
+    `pre_delete`.
+
+    Use `send_instance_signals=False` to drop the `post_save`/`post_delete`
+    signals of the instances and only send the bulk ones. The receivers of
+    the instance signals run once per instance, including the one that
+    `rest_framework_cache` connects to `post_save` to clear the cache of the
+    instance, only drop them if all the receivers of the models also listen
+    to the bulk signals.
+
+    Nested blocks are dispatched by the outermost one.
+
+        with deferred_side_effects():
+            for data in rows:
+                Company(**data).save()
+    """
+    if getattr(_deferred, "current", None) is not None:
+        yield _deferred.current
+        return
+
+    _deferred.current = DeferredSideEffects(send_instance_signals=send_instance_signals)
+    try:
+        yield _deferred.current
+    finally:
+        current, _deferred.current = _deferred.current, None
+        current.dispatch()
+
+
+def _send_post_signal(signal, sender, instance, **kwargs):
+    current = getattr(_deferred, "current", None)
+    if current is not None:
+        current.add_signal(signal, sender, instance, **kwargs)
+    else:
+        signal.send(sender=sender, instance=instance, **kwargs)
+
+
+def clear_for_instance(instance):
+    """
+    Clears the DRF cache of the instance, or defers it if we are inside
+    a `deferred_side_effects` block.
+    """
+    current = getattr(_deferred, "current", None)
+    if current is not None:
+        current.add_cache_keys(instance)
+    else:
+        cache.delete_many(get_all_cache_keys(instance))
+
 
 class ExactOperator(BaseWhereOperator):
     """
@@ -43,6 +189,22 @@ class ExactOperator(BaseWhereOperator):
     cql_symbol = "="
 
 
+class CustomDjangoCassandraQuerySet(DjangoCassandraQuerySet):
+    """
+    Fix of bug in the original DjangoCassandraQuerySet. The `only` fields
+    were ignored when the queryset also had deferred fields, and cqlengine
+    defers the partition key columns restricted with `=`, the read of an
+    object by its primary key was selecting all the columns.
+    """
+
+    def _select_fields(self):
+        if self._defer_fields and self._only_fields:
+            fields = [self.model._columns[name].db_field_name for name in self._only_fields]
+            fields = [name for name in fields if name not in self._defer_fields]
+            return fields or [column.db_field_name for column in self.model._partition_keys.values()]
+        return super()._select_fields()
+
+
 class CustomDjangoCassandraModelMetaClass(DjangoCassandraModelMetaClass):
     """
     Fix of bug in the original DjangoCassandraModelMetaClass. They commented
@@ -70,9 +232,15 @@ class CustomDjangoCassandraModel(six.with_metaclass(CustomDjangoCassandraModelMe
     and update/save/delete operation
     """
 
+    __queryset__ = CustomDjangoCassandraQuerySet
+
     _cassandra_consistency_level_read = ConsistencyLevel.LOCAL_QUORUM
     _cassandra_consistency_level_write = ConsistencyLevel.LOCAL_QUORUM
 
+    # The instance only has the values of its primary key, see
+    # `from_primary_keys`
+    _partial = False
+
     __abstract__ = True
 
     def __init__(self, *args, **kwargs):
@@ -82,12 +250,32 @@ class CustomDjangoCassandraModel(six.with_metaclass(CustomDjangoCassandraModelMe
         super().__init__(*args, **kwargs)
         post_init.send(sender=cls, instance=self)
 
+    @classmethod
+    def from_primary_keys(cls, **primary_keys):
+        """
+        Builds the instance of an existing row without reading it, only with
+        the values of its primary key. The instance can be saved to update
+        the columns we set, the rest of the columns are not validated nor
+        written (the default values are not applied).
+        """
+        instance = cls(**primary_keys)
+        instance._set_persisted(force=True)
+        instance._partial = True
+        return instance
+
+    def validate(self):
+        if not self._partial:
+            return super().validate()
+
+        for name in set(self._primary_keys.keys()) | set(self.get_changed_columns()):
+            self._set_column_value(name, self._columns[name].validate(getattr(self, name)))
+
     @classmethod
     def create(cls, **kwargs):
         result = super().create(**kwargs)
 
-        post_save.send(
-            sender=cls, instance=result, created=True, raw=False,
+        _send_post_signal(
+            post_save, sender=cls, instance=result, created=True, raw=False,
         )
 
         return result
@@ -97,8 +285,13 @@ class CustomDjangoCassandraModel(six.with_metaclass(CustomDjangoCassandraModelMe
 
         result = super().save()
 
-        post_save.send(
-            sender=self.__class__, instance=self, created=False, raw=False, update_fields=self.get_changed_columns(),
+        _send_post_signal(
+            post_save,
+            sender=self.__class__,
+            instance=self,
+            created=False,
+            raw=False,
+            update_fields=self.get_changed_columns(),
         )
 
         # We also clean the DRF cache
@@ -111,8 +304,13 @@ class CustomDjangoCassandraModel(six.with_metaclass(CustomDjangoCassandraModelMe
 
         result = super().update(**values)
 
-        post_save.send(
-            sender=self.__class__, instance=self, created=False, raw=False, update_fields=self.get_changed_columns(),
+        _send_post_signal(
+            post_save,
+            sender=self.__class__,
+            instance=self,
+            created=False,
+            raw=False,
+            update_fields=self.get_changed_columns(),
         )
 
         # We also clean the DRF cache
@@ -126,11 +324,217 @@ class CustomDjangoCassandraModel(six.with_metaclass(CustomDjangoCassandraModelMe
 
         super().delete()
 
-        post_delete.send(sender=self.__class__, instance=self)
+        _send_post_signal(post_delete, sender=self.__class__, instance=self)
 
         # We also clean the DRF cache
         clear_for_instance(self)
 
+    @classmethod
+    def bulk_save(cls, instances, concurrency=DEFAULT_BULK_CONCURRENCY, batch_by_partition=False):
+        """
+        Persists a list of instances using the concurrent execution of the
+        driver, instead of doing one synchronous request per instance.
+
+        If `batch_by_partition` is True, the instances that share the same
+        partition key are written together in an UNLOGGED BATCH (a single
+        mutation in the replica).
+
+        The `pre_save` signal is sent before rendering each statement. The
+        instances that have been persisted are notified as in
+        `deferred_side_effects`: a `post_save` per instance (unless we are
+        inside a block with `send_instance_signals=False`), a single
+        `post_bulk_save` signal, and their DRF cache is cleared with a single
+        `delete_many`. As in `save`, the signals are sent with
+        `created=False`: the writes are upserts and we do not read the rows
+        to know if they existed.
+
+        Returns a list with the result of each instance, in the same order:
+        `None` if the instance was persisted, or the exception that made
+        it fail.
+        """
+        results = [None] * len(instances)
+        groups = OrderedDict()
+
+        for position, instance in enumerate(instances):
+            collector = BatchQuery()
+            try:
+                pre_save.send(sender=cls, instance=instance, created=False)
+                # The collector only accumulates the statements, nothing is
+                # sent to Cassandra until we execute them below
+                super(CustomDjangoCassandraModel, instance.batch(collector)).save()
+            except Exception as ex:
+                results[position] = ex
+                continue
+            finally:
+                instance._batch = None
+
+            key = (
+                tuple(getattr(instance, name) for name in cls._partition_keys.keys())
+                if batch_by_partition
+                else position
+            )
+            positions, queries = groups.setdefault(key, ([], []))
+            positions.append(position)
+            queries.extend(collector.queries)
+
+        statements_and_params = []
+        for positions, queries in groups.values():
+            if len(queries) == 1:
+                query_string, parameters = str(queries[0]), queries[0].get_context()
+            else:
+                query_string, parameters = _unlogged_batch(queries)
+            statement = SimpleStatement(query_string, consistency_level=cls._cassandra_consistency_level_write)
+            statements_and_params.append((statement, parameters))
+
+        session = connection.get_session(connection=cls._get_connection())
+        executions = execute_concurrent(
+            session, statements_and_params, concurrency=concurrency, raise_on_first_error=False
+        )
+
+        with deferred_side_effects():
+            for (positions, _), (success, result) in zip(groups.values(), executions):
+                for position in positions:
+                    if not success:
+                        results[position] = result
+                        continue
+
+                    instance = instances[position]
+                    _send_post_signal(
+                        post_save,
+                        sender=cls,
+                        instance=instance,
+                        created=False,
+                        raw=False,
+                        update_fields=instance.get_changed_columns(),
+                    )
+
+                    # We also clean the DRF cache
+                    clear_for_instance(instance)
+
+        return results
+
+    @classmethod
+    def batch_get(
+        cls,
+        keys,
+        concurrency=DEFAULT_BULK_CONCURRENCY,
+        fields=None,
+        max_partitions=DEFAULT_BATCH_GET_PARTITIONS,
+        queryset=None,
+    ):
+        """
+        Reads a list of objects using the concurrent execution of the driver.
+
+        Each key is a dict with the values of the primary key columns (at
+        least the partition key). The keys are read together with an `IN`
+        query when:
+
+        - they belong to the same partition and only differ in one
+          clustering column.
+        - the primary key of the model is a single partition key column
+          (no clustering columns). The query reads up to `max_partitions`
+          partitions, the coordinator fans it out to their replicas.
+
+        The rest of the keys (ex. only the partition key of a model with
+        clustering columns) are read with one query per key. If `fields` is
+        informed, only these columns are read.
+
+        If `queryset` is informed (ex. the queryset of a view scoped by the
+        user), its filters are added to the reads and only the objects of
+        the queryset are returned. The keys with a different value in a
+        column the queryset restricts with `=` are not read.
+
+        Returns a list with the result of each key, in the same order: the
+        instance, `None` if it does not exist, or the exception that made
+        the read fail.
+        """
+        partition_names = list(cls._partition_keys.keys())
+        primary_names = list(cls._primary_keys.keys())
+
+        queryset = cls.objects.all() if queryset is None else queryset
+
+        # The columns restricted with `=` by the queryset cannot be
+        # restricted again by the keys
+        restricted = {
+            name: where.value
+            for name, column in cls._columns.items()
+            for where in queryset._where
+            if where.field == column.db_field_name and isinstance(where.operator, EqualsOperator)
+        }
+
+        results = [None] * len(keys)
+        groups = OrderedDict()
+        for position, key in enumerate(keys):
+            if any(
+                name in restricted and cls._columns[name].to_database(value) != restricted[name]
+                for name, value in key.items()
+            ):
+                continue
+
+            partition = tuple(key.get(name) for name in partition_names)
+            clustering = tuple(sorted(name for name in key.keys() if name not in cls._partition_keys))
+            if None not in partition and len(clustering) == 1:
+                group_key = (partition, clustering)
+            elif len(primary_names) == 1 and primary_names[0] in key:
+                group_key = ((), tuple(primary_names))
+            else:
+                group_key = position
+            groups.setdefault(group_key, []).append(position)
+
+        # The groups of partitions are split in queries of `max_partitions`
+        chunks = []
+        for group_key, positions in groups.items():
+            if group_key == ((), tuple(primary_names)):
+                chunks.extend(
+                    (group_key, positions[start : start + max_partitions])
+                    for start in range(0, len(positions), max_partitions)
+                )
+            else:
+                chunks.append((group_key, positions))
+
+        querysets = []
+        statements_and_params = []
+        for group_key, positions in chunks:
+            if len(positions) > 1:
+                partition, (column,) = group_key
+                filters = dict(zip(partition_names, partition))
+                filters["{0}__in".format(column)] = [keys[position][column] for position in positions]
+            else:
+                filters = keys[positions[0]]
+
+            filters = {name: value for name, value in filters.items() if name.split("__")[0] not in restricted}
+            chunk_queryset = queryset.filter(**filters).limit(len(positions))
+            if fields:
+                chunk_queryset = chunk_queryset.only(fields)
+            querysets.append(chunk_queryset)
+
+            select_query = chunk_queryset._select_query()
+            statement = SimpleStatement(str(select_query), consistency_level=cls._cassandra_consistency_level_read)
+            statements_and_params.append((statement, select_query.get_context()))
+
+        session = connection.get_session(connection=cls._get_connection())
+        executions = execute_concurrent(
+            session, statements_and_params, concurrency=concurrency, raise_on_first_error=False
+        )
+
+        for (group_key, positions), chunk_queryset, (success, result) in zip(chunks, querysets, executions):
+            if not success:
+                for position in positions:
+                    results[position] = result
+                continue
+
+            constructor = chunk_queryset._maybe_inject_deferred(chunk_queryset._get_result_constructor())
+            instances = [constructor(row) for row in result]
+            if len(positions) == 1:
+                results[positions[0]] = instances[0] if instances else None
+            else:
+                column = group_key[1][0]
+                by_value = {getattr(instance, column): instance for instance in instances}
+                for position in positions:
+                    results[position] = by_value.get(keys[position][column])
+
+        return results
+
     def force_insert(self):
         """
         This method will force an insert to be used if we're calling .save(), this is useful when we edit frozen columns
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+from django.dispatch import Signal
+
+# Sent once per model class when a `deferred_side_effects` block exits,
+# with the list of instances that were saved/deleted inside the block.
+post_bulk_save = Signal(providing_args=["instances"])
+post_bulk_delete = Signal(providing_args=["instances"])
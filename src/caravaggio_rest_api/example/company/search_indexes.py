@@ -68,9 +68,19 @@ class CompanyIndex(BaseSearchIndex, indexes.Indexable):
 
         text_fields = ["short_description", "extra_data", "round_notes"]
 
-        # Once the index has been created it cannot be changed
-        # with sync_indexes. Changes should be made by hand.
-        index_settings = {"realtime": "true", "autoCommitTime": "100", "ramBufferSize": "2048"}
+        # The config of the search index (solrconfig.xml). The
+        # `sync_indexes` command applies the options that differ from the
+        # current config of the index. They can be overridden by
+        # environment using `settings.SEARCH_INDEX_CONFIG`.
+        search_config = {
+            "realtime": "true",
+            "autoCommitTime": "100",
+            "ramBufferSize": "2048",
+            "filterCacheLowWaterMark": "1024",
+            "filterCacheHighWaterMark": "2048",
+            "query.queryResultCache@size": "512",
+            "query.documentCache@size": "512",
+        }
 
     def get_model(self):
         return Company
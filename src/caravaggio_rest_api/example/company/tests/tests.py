@@ -1,18 +1,56 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import base64
 import os
 import json
 import logging
 import time
 import math
+import pickle
+import tempfile
+import threading
+import uuid
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 from datetime import datetime, timedelta
 from dateutil import relativedelta
-
+from unittest import mock
+
+try:
+    from dse.cqlengine import columns
+except ImportError:
+    from cassandra.cqlengine import columns
+
+from caravaggio_rest_api.benchmarks import datasets, stubs
+from caravaggio_rest_api.cache import DEFAULT_INVALIDATION_CHANNEL, TwoTierRedisCache
+from caravaggio_rest_api.dse.backends.coalescing import SingleFlight, get_search_key
+from caravaggio_rest_api.dse.backends.dse_backend import DSEBackend, DSEQuery
+from caravaggio_rest_api.dse.models import CustomDjangoCassandraModel, deferred_side_effects
+from caravaggio_rest_api.dse.signals import post_bulk_save
 from caravaggio_rest_api.utils import delete_all_records
+from caravaggio_rest_api.example.company.api.views import CompanySearchViewSet, CompanyViewSet
 from caravaggio_rest_api.example.company.models import Company
+from caravaggio_rest_api.haystack.backends.routing import RoutedSolr, SolrNodeRouter
+from caravaggio_rest_api.haystack.indexes import TextField
+from caravaggio_rest_api.haystack.models import CompactSearchResult, get_result_class
+from caravaggio_rest_api.haystack.query import CaravaggioSearchQuerySet
+from caravaggio_rest_api.profiling import PROFILE_EXTENSION
+from caravaggio_rest_api.pagination import CaravaggioFederatedSearchPagination, CassandraPagingStatePagination
 
 from rest_framework import status
+from rest_framework.permissions import BasePermission
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_cache.cache import cache
+from rest_framework_cache.utils import get_all_cache_keys
+from django.conf import settings
+from django.db.models.signals import post_save
 from django.urls import reverse
+from haystack import connections
+from haystack.inputs import Exact
+from haystack.models import SearchResult
+from haystack.query import SQ
+from pysolr import SolrError
 
 from caravaggio_rest_api.utils import default
 
@@ -314,3 +352,1512 @@ class GetAllCompanyTest(CaravaggioBaseTest):
         self.assertEqual(response.data["objects"]["results"][0]["name"], "BigML")
         self.assertEqual(len(response.data["heatmaps"]), 1)
         self.assertEqual(response.data["heatmaps"]["point"]["gridLevel"], 6)
+
+    def step13_search_terminal_lookups(self):
+        # get, first, exists and count send a single request to the search
+        # backend, asking only for the rows they need
+        backend = connections["default"].get_backend()
+        queryset = CaravaggioSearchQuerySet().models(Company)
+
+        with mock.patch.object(backend, "search", wraps=backend.search) as search:
+            self.assertEqual(queryset.get(name="BigML").name, "BigML")
+            self.assertEqual(search.call_count, 1)
+            self.assertEqual(search.call_args[1]["end_offset"], 2)
+
+        with mock.patch.object(backend, "search", wraps=backend.search) as search:
+            with self.assertRaises(Company.MultipleObjectsReturned):
+                queryset.get()
+            self.assertEqual(search.call_count, 1)
+
+        with mock.patch.object(backend, "search", wraps=backend.search) as search:
+            with self.assertRaises(Company.DoesNotExist):
+                queryset.get(name="Unknown Company")
+            self.assertEqual(search.call_count, 1)
+
+        with mock.patch.object(backend, "search", wraps=backend.search) as search:
+            self.assertEqual(queryset.filter(name="BigML").first().name, "BigML")
+            self.assertIsNone(queryset.filter(name="Unknown Company").first())
+            self.assertEqual(search.call_count, 2)
+            self.assertEqual(search.call_args[1]["end_offset"], 1)
+
+        with mock.patch.object(backend, "search", wraps=backend.search) as search:
+            self.assertTrue(queryset.filter(name="BigML").exists())
+            self.assertFalse(queryset.filter(name="Unknown Company").exists())
+            self.assertEqual(search.call_count, 2)
+
+        with mock.patch.object(backend, "search", wraps=backend.search) as search:
+            self.assertEqual(queryset.filter(name="BigML").count(), 1)
+            self.assertEqual(search.call_count, 1)
+
+
+def get_company_data(name, country_code="USA", **kwargs):
+    return dict(kwargs, name=name, country_code=country_code, address={"city": "Boston", "country_code": "USA"})
+
+
+class StubServicesTestMixin(object):
+    """
+    Runs the requests against the local stand-ins of Solr and Cassandra
+    (`caravaggio_rest_api.benchmarks.stubs`) loaded with a synthetic dataset
+    of companies, the tests do not need a DSE cluster.
+    """
+
+    dataset_size = 20
+
+    def setUp(self):
+        super().setUp()
+
+        self.companies = datasets.generate_companies(self.dataset_size, user=self.user.username)
+
+        self.session = stubs.FakeSession()
+        self.session.add_model(Company, [datasets.to_row(company) for company in self.companies])
+
+        backend = connections["default"].get_backend()
+        core_name = "{0}.{1}".format(backend.keyspace, Company._raw_column_family_name())
+        self.solr = stubs.StubSolrServer(
+            {core_name: [datasets.to_solr_document(company) for company in self.companies]}
+        )
+        self.solr_core = self.solr.cores[core_name]
+
+        stack = ExitStack()
+        self.addCleanup(stack.close)
+        stack.enter_context(self.solr)
+        stack.enter_context(stubs.stub_search_connection(self.solr.url))
+        stack.enter_context(stubs.fake_cassandra_connection(self.session))
+
+    def get_row(self, company_id):
+        rows = self.session.tables[Company._raw_column_family_name()].get_rows([("_id", "=", company_id)])
+        return rows[0] if rows else None
+
+    @contextmanager
+    def capture_statements(self):
+        """
+        Collects the CQL statements executed by the session.
+        """
+        statements = []
+        execute = self.session.execute
+
+        def capture(query, *args, **kwargs):
+            statements.append(getattr(query, "query_string", query))
+            return execute(query, *args, **kwargs)
+
+        with mock.patch.object(self.session, "execute", side_effect=capture):
+            yield statements
+
+    def get_selected_columns(self, statements):
+        """
+        The columns read by the SELECT statements of the table of Company
+        (the counts are ignored).
+        """
+        selected = []
+        for statement in statements:
+            match = stubs.COLUMNS_REGEX.search(statement)
+            if match and stubs.TABLE_REGEX.search(statement).group(1) == Company._raw_column_family_name():
+                columns = {name.strip().strip('"') for name in match.group(1).split(",")}
+                if columns != {"COUNT(*)"}:
+                    selected.append(columns)
+        return selected
+
+
+class BulkCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the bulk endpoint of Company """
+
+    def post_bulk(self, data, content_type=CONTENTTYPE_JON):
+        return self.api_client.post(reverse("company-bulk"), data=data, content_type=content_type)
+
+    def step01_bulk_json(self):
+        companies = [get_company_data("Bulk JSON {0}".format(index)) for index in range(3)]
+        response = self.post_bulk(json.dumps(companies))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual([item["index"] for item in response.data], [0, 1, 2])
+        self.assertEqual([item["status"] for item in response.data], [status.HTTP_200_OK] * 3)
+        for company, item in zip(companies, response.data):
+            self.assertEqual(item["data"]["user"], self.user.username)
+            self.assertEqual(self.get_row(item["data"]["_id"])["name"], company["name"])
+
+    def step02_bulk_ndjson(self):
+        companies = [get_company_data("Bulk NDJSON {0}".format(index), "ESP") for index in range(3)]
+        content = "\n".join(json.dumps(company) for company in companies) + "\n"
+        response = self.post_bulk(content, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual([item["status"] for item in response.data], [status.HTTP_200_OK] * 3)
+        for company, item in zip(companies, response.data):
+            self.assertEqual(self.get_row(item["data"]["_id"])["name"], company["name"])
+
+    def step03_bulk_validation_error(self):
+        rows = len(self.session.tables[Company._raw_column_family_name()].rows)
+        companies = [
+            get_company_data("Bulk Valid 0"),
+            {"country_code": "USA", "address": {"city": "Boston"}},
+            get_company_data("Bulk Valid 2"),
+        ]
+        response = self.post_bulk(json.dumps(companies))
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+
+        self.assertEqual(
+            [item["status"] for item in response.data],
+            [status.HTTP_200_OK, status.HTTP_400_BAD_REQUEST, status.HTTP_200_OK],
+        )
+        self.assertEqual(list(response.data[1]["errors"].keys()), ["name"])
+        self.assertNotIn("data", response.data[1])
+
+        # Only the valid objects are written
+        self.assertEqual(len(self.session.tables[Company._raw_column_family_name()].rows), rows + 2)
+        self.assertEqual(self.get_row(response.data[2]["data"]["_id"])["name"], "Bulk Valid 2")
+
+    def step04_bulk_update(self):
+        # The primary key is read only in the serializer, the objects of
+        # serializers with a writable primary key can be updated
+        meta = CompanySerializerV1.Meta
+        with mock.patch.object(meta, "read_only_fields", ("user", "created_at", "updated_at")), mock.patch.object(
+            meta, "extra_kwargs", {"_id": {"validators": []}}, create=True
+        ):
+            companies = [
+                get_company_data("Bulk Updated {0}".format(index), _id=str(company._id))
+                for index, company in enumerate(self.companies[:2])
+            ]
+            response = self.post_bulk(json.dumps(companies))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([item["status"] for item in response.data], [status.HTTP_200_OK] * 2)
+            for company, item in zip(self.companies, response.data):
+                self.assertEqual(item["data"]["_id"], company._id)
+                self.assertEqual(self.get_row(company._id)["name"], "Bulk Updated {0}".format(item["index"]))
+
+            companies.append(get_company_data("Bulk Created"))
+            response = self.post_bulk(json.dumps(companies))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([item["status"] for item in response.data], [status.HTTP_200_OK] * 3)
+
+    def step05_bulk_validated_once(self):
+        companies = [get_company_data("Bulk Once 0"), {"country_code": "USA"}, get_company_data("Bulk Once 2")]
+        with mock.patch.object(
+            CompanySerializerV1, "run_validation", autospec=True, side_effect=CompanySerializerV1.run_validation
+        ) as run_validation:
+            response = self.post_bulk(json.dumps(companies))
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(run_validation.call_count, 3)
+
+    def step06_bulk_object_permissions(self):
+        # The objects not updated by the previous steps
+        existing = self.companies[2]
+        allowed = self.companies[3]
+        companies = [
+            get_company_data("Bulk Denied", _id=str(existing._id)),
+            get_company_data("Bulk Allowed", _id=str(allowed._id)),
+            get_company_data("Bulk New"),
+        ]
+
+        view = CompanyViewSet.as_view(
+            {"post": "bulk"}, permission_classes=[get_permission(lambda company: company._id == allowed._id)]
+        )
+        request = APIRequestFactory().post("/", data=json.dumps(companies), content_type=CONTENTTYPE_JON)
+        force_authenticate(request, user=self.user)
+
+        meta = CompanySerializerV1.Meta
+        with mock.patch.object(meta, "read_only_fields", ("user", "created_at", "updated_at")), mock.patch.object(
+            meta, "extra_kwargs", {"_id": {"validators": []}}, create=True
+        ):
+            response = view(request)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+
+        # The new objects are not checked, the existing ones are read and
+        # checked before the write
+        self.assertEqual(
+            [item["status"] for item in response.data],
+            [status.HTTP_403_FORBIDDEN, status.HTTP_200_OK, status.HTTP_200_OK],
+        )
+        self.assertEqual(self.get_row(existing._id)["name"], existing.name)
+        self.assertEqual(self.get_row(allowed._id)["name"], "Bulk Allowed")
+        self.assertEqual(self.get_row(response.data[2]["data"]["_id"])["name"], "Bulk New")
+
+    def step07_bulk_without_reads(self):
+        # Without object permissions the objects are not read
+        companies = [get_company_data("Bulk No Read {0}".format(index)) for index in range(3)]
+        with self.capture_statements() as statements:
+            response = self.post_bulk(json.dumps(companies))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([statement for statement in statements if statement.startswith("SELECT")])
+
+
+class DeferredSideEffectsCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the side effects of the bulk writes of Company """
+
+    def connect_receiver(self, signal):
+        receiver = mock.Mock()
+        signal.connect(receiver, sender=Company, weak=False)
+        self.addCleanup(signal.disconnect, receiver, sender=Company)
+        return receiver
+
+    def step01_bulk_save_clears_cache_once(self):
+        post_save_receiver = self.connect_receiver(post_save)
+        post_bulk_save_receiver = self.connect_receiver(post_bulk_save)
+
+        for company in self.companies:
+            company.name = "{0} Updated".format(company.name)
+
+        with mock.patch.object(cache, "delete_many") as delete_many, mock.patch.object(cache, "delete") as delete:
+            with deferred_side_effects(send_instance_signals=False):
+                errors = Company.bulk_save(self.companies)
+
+        self.assertEqual(errors, [None] * len(self.companies))
+        self.assertEqual(delete.call_count, 0)
+        self.assertEqual(delete_many.call_count, 1)
+        cache_keys = {key for company in self.companies for key in get_all_cache_keys(company)}
+        self.assertTrue(cache_keys)
+        self.assertEqual(set(delete_many.call_args[0][0]), cache_keys)
+
+        self.assertEqual(post_save_receiver.call_count, 0)
+        self.assertEqual(post_bulk_save_receiver.call_count, 1)
+        self.assertEqual(post_bulk_save_receiver.call_args[1]["instances"], self.companies)
+
+    def step02_instance_signals(self):
+        post_save_receiver = self.connect_receiver(post_save)
+
+        # The instance signals are sent by default
+        with mock.patch.object(cache, "delete_many") as delete_many:
+            with deferred_side_effects():
+                Company.bulk_save(self.companies[:3])
+                Company.bulk_save(self.companies[:3])
+
+        self.assertEqual(post_save_receiver.call_count, 3)
+        self.assertEqual({call[1]["created"] for call in post_save_receiver.call_args_list}, {False})
+        # The receiver of `rest_framework_cache` also clears the cache of each
+        # instance
+        self.assertEqual(delete_many.call_count, 4)
+
+        post_save_receiver.reset_mock()
+        Company.bulk_save(self.companies[:3])
+        self.assertEqual(post_save_receiver.call_count, 3)
+
+
+class DenyObjectPermission(BasePermission):
+    def has_object_permission(self, request, view, obj):
+        return False
+
+
+class PartialUpdateWithoutReadCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the PATCH of Company without reading the object """
+
+    def patch(self, company_id, data, **initkwargs):
+        view = CompanyViewSet.as_view({"patch": "partial_update"}, partial_update_without_read=True, **initkwargs)
+        request = APIRequestFactory().patch("/", data=json.dumps(data), content_type=CONTENTTYPE_JON)
+        force_authenticate(request, user=self.user)
+        return view(request, pk=str(company_id), user=self.user.username)
+
+    def step01_partial_update(self):
+        company = self.companies[0]
+        with self.capture_statements() as statements:
+            response = self.patch(company._id, {"name": "Patched Company"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # A single plain UPDATE of the received columns, the object is not
+        # read
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith("UPDATE"))
+        self.assertNotIn("IF EXISTS", statements[0])
+        self.assertNotIn("created_at", statements[0])
+        self.assertEqual(self.get_row(company._id)["name"], "Patched Company")
+        self.assertEqual(self.get_row(company._id)["short_description"], company.short_description)
+
+        # The response only has the written columns (`user` is hidden)
+        self.assertEqual(set(response.data.keys()), {"_id", "name", "updated_at"})
+        self.assertEqual(response.data["_id"], str(company._id))
+        self.assertEqual(response.data["name"], "Patched Company")
+
+    def step02_missing_object(self):
+        # The UPDATE is an upsert
+        company_id = uuid.uuid4()
+        response = self.patch(company_id, {"name": "Missing Company"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_row(company_id)["name"], "Missing Company")
+
+    def step03_object_permissions(self):
+        # The object is read to check the object permissions
+        company = self.companies[1]
+        with self.capture_statements() as statements:
+            response = self.patch(company._id, {"name": "Denied Company"}, permission_classes=[DenyObjectPermission])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertTrue(statements[0].startswith("SELECT"))
+        self.assertEqual(self.get_row(company._id)["name"], company.name)
+
+        response = self.patch(company._id, {"name": "Allowed Company"}, permission_classes=[get_permission(bool)])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The full representation of a normal PATCH
+        self.assertEqual(set(response.data.keys()), set(CompanySerializerV1().get_fields().keys()) - {"user"})
+        self.assertEqual(response.data["name"], "Allowed Company")
+        self.assertEqual(response.data["short_description"], company.short_description)
+
+
+class ProjectionCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the projection of the Cassandra reads of Company """
+
+    def step01_retrieve_fields(self):
+        company = self.companies[0]
+        path = "{0}{1}/?fields=name,country_code".format(reverse("company-list"), company._id)
+        with self.capture_statements() as statements:
+            response = self.api_client.get(path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data.keys()), {"name", "country_code"})
+        self.assertEqual(response.data["name"], company.name)
+
+        # The primary keys and the column of the ETag are always read (the
+        # `_id` restricted in the query is not selected)
+        self.assertEqual(self.get_selected_columns(statements), [{"user", "updated_at", "name", "country_code"}])
+
+    def step02_list_excluded_fields(self):
+        path = "{0}?fields!=short_description,round_notes".format(reverse("company-list"))
+        with self.capture_statements() as statements:
+            response = self.api_client.get(path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["results"])
+        self.assertTrue(self.get_selected_columns(statements))
+        for result in response.data["results"]:
+            self.assertNotIn("short_description", result)
+            self.assertIn("name", result)
+
+        for selected in self.get_selected_columns(statements):
+            self.assertNotIn("short_description", selected)
+            self.assertNotIn("round_notes", selected)
+            self.assertIn("name", selected)
+
+    def step03_unknown_fields(self):
+        # A field that is not a column of the model needs the full row
+        path = "{0}{1}/?fields=name,unknown".format(reverse("company-list"), self.companies[0]._id)
+        with self.capture_statements() as statements:
+            response = self.api_client.get(path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_selected_columns(statements), [set(Company._columns.keys()) - {"_id"}])
+
+
+class PagingStateCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the pagination of the list of Company """
+
+    def setUp(self):
+        super().setUp()
+
+        # The pagination with the paging state is opt-in
+        patcher = mock.patch.object(CompanyViewSet, "pagination_class", CassandraPagingStatePagination)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def step01_pages(self):
+        path = "{0}?limit=7".format(reverse("company-list"))
+        ids = []
+        while path:
+            response = self.api_client.get(path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("approximate_count", response.data)
+            ids.extend(result["_id"] for result in response.data["results"])
+            path = response.data["next"]
+
+        self.assertEqual(len(ids), len(self.companies))
+        self.assertEqual(set(ids), {str(company._id) for company in self.companies})
+
+    def step02_invalid_cursor(self):
+        for cursor in ("not base64!", base64.urlsafe_b64encode(b"tampered").decode("ascii")):
+            path = "{0}?limit=7&cursor={1}".format(reverse("company-list"), cursor)
+            response = self.api_client.get(path)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(response.data["detail"], CassandraPagingStatePagination.invalid_cursor_message)
+
+    def step03_approximate_count(self):
+        # The local token ranges cover half of the ring (the second one wraps
+        # around the ring)
+        table = {"keyspace_name": Company._get_keyspace(), "table_name": Company._raw_column_family_name()}
+        self.session.add_table(
+            "size_estimates",
+            [
+                dict(table, range_start=str(-(2 ** 62)), range_end="0", partitions_count=10),
+                dict(table, range_start=str(2 ** 62), range_end=str(-(2 ** 63)), partitions_count=15),
+            ],
+            ["keyspace_name", "table_name"],
+        )
+
+        with mock.patch.object(CassandraPagingStatePagination, "approximate_count", True):
+            response = self.api_client.get("{0}?limit=7".format(reverse("company-list")))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data["approximate_count"], 50)
+
+            del self.session.tables["size_estimates"]
+            response = self.api_client.get("{0}?limit=7".format(reverse("company-list")))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIsNone(response.data["approximate_count"])
+
+
+class ConditionalGetCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the ETag and Last-Modified headers of Company """
+
+    def step01_retrieve(self):
+        company = self.companies[0]
+        path = "{0}{1}/".format(reverse("company-list"), company._id)
+        response = self.api_client.get(path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertIn("Last-Modified", response)
+
+        # The client has the current version, we only read the version
+        with self.capture_statements() as statements:
+            response = self.api_client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.get_selected_columns(statements), [{"user", "updated_at"}])
+
+        response = self.api_client.get(path, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # The object changes
+        self.get_row(company._id)["updated_at"] = company.updated_at + timedelta(days=1)
+        response = self.api_client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["name"], company.name)
+
+    def step02_retrieve_get_object(self):
+        company = self.companies[1]
+        path = "{0}{1}/".format(reverse("company-list"), company._id)
+        etag = self.api_client.get(path)["ETag"]
+
+        # The version is read with `get_object`
+        with mock.patch.object(
+            CompanyViewSet, "get_object", autospec=True, side_effect=CompanyViewSet.get_object
+        ) as get_object:
+            response = self.api_client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(get_object.call_count, 1)
+
+        # The object permissions need the full object
+        view = CompanyViewSet.as_view({"get": "retrieve"}, permission_classes=[get_permission(bool)])
+        request = APIRequestFactory().get("/", HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=self.user)
+        with self.capture_statements() as statements:
+            response = view(request, pk=str(company._id))
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.get_selected_columns(statements), [set(Company._columns.keys()) - {"_id"}])
+
+    def step03_list(self):
+        path = "{0}?limit=5".format(reverse("company-list"))
+        response = self.api_client.get(path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+
+        # The default pagination of the project (page number)
+        self.assertEqual(response.data["count"], len(self.companies))
+        self.assertEqual(len(response.data["results"]), 5)
+
+        response = self.api_client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Other pages have other versions
+        response = self.api_client.get("{0}?limit=6".format(reverse("company-list")), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def step04_list_not_reused(self):
+        # Every request reads the rows, the queryset of the viewset does not
+        # keep the results of the previous requests
+        path = "{0}?limit=5".format(reverse("company-list"))
+        for _ in range(2):
+            with self.capture_statements() as statements:
+                response = self.api_client.get(path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(self.get_selected_columns(statements))
+
+
+class CompanyRanking(CustomDjangoCassandraModel):
+    """
+    A table without clustering columns, only used by the tests
+    """
+
+    __table_name__ = "company_ranking"
+
+    _id = columns.UUID(partition_key=True)
+
+    rank = columns.Integer()
+
+
+def get_permission(allowed):
+    class ObjectPermission(BasePermission):
+        def has_object_permission(self, request, view, obj):
+            return allowed(obj)
+
+    return ObjectPermission
+
+
+class BatchRetrieveCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the batch reads of Company """
+
+    def batch_retrieve(self, ids, **initkwargs):
+        view = CompanyViewSet.as_view({"get": "batch_retrieve"}, **initkwargs)
+        request = APIRequestFactory().get("/", data={"ids": ",".join(str(value) for value in ids)})
+        force_authenticate(request, user=self.user)
+        return view(request)
+
+    def step01_batch_retrieve(self):
+        ids = [company._id for company in self.companies[:3]] + [uuid.uuid4(), "not-an-uuid"]
+        response = self.batch_retrieve(ids)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["index"] for item in response.data], list(range(5)))
+        self.assertEqual(
+            [item["status"] for item in response.data],
+            [status.HTTP_200_OK] * 3 + [status.HTTP_404_NOT_FOUND, status.HTTP_400_BAD_REQUEST],
+        )
+        for company, item in zip(self.companies, response.data[:3]):
+            self.assertEqual(item["data"]["name"], company.name)
+
+    def step02_object_permissions(self):
+        denied = self.companies[1]
+        permission = get_permission(lambda obj: obj._id != denied._id)
+        ids = [company._id for company in self.companies[:3]] + [uuid.uuid4()]
+
+        # The objects are read from Cassandra to check their permissions
+        with mock.patch.object(cache, "get_many") as get_many:
+            response = self.batch_retrieve(ids, permission_classes=[permission])
+        self.assertEqual(get_many.call_count, 0)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item["status"] for item in response.data],
+            [status.HTTP_200_OK, status.HTTP_403_FORBIDDEN, status.HTTP_200_OK, status.HTTP_404_NOT_FOUND],
+        )
+        self.assertNotIn("data", response.data[1])
+        self.assertEqual(response.data[2]["data"]["name"], self.companies[2].name)
+
+    def step03_batch_get_partitions(self):
+        rankings = [CompanyRanking(_id=company._id, rank=rank) for rank, company in enumerate(self.companies)]
+        self.session.add_model(CompanyRanking, [datasets.to_row(ranking) for ranking in rankings])
+
+        keys = [{"_id": ranking._id} for ranking in reversed(rankings)] + [{"_id": uuid.uuid4()}]
+        with self.capture_statements() as statements:
+            results = CompanyRanking.batch_get(keys, max_partitions=8)
+
+        # The partitions are read with IN queries of up to 8 partitions
+        self.assertEqual(len(statements), 3)
+        self.assertTrue(all('"_id" IN' in statement for statement in statements))
+        self.assertEqual([result.rank for result in results[:-1]], list(reversed(range(len(rankings)))))
+        self.assertIsNone(results[-1])
+
+        # The keys with only the partition key of a model with clustering
+        # columns are read one by one
+        with self.capture_statements() as statements:
+            results = Company.batch_get([{"_id": company._id} for company in self.companies[:3]])
+        self.assertEqual(len(statements), 3)
+        self.assertEqual([result.name for result in results], [company.name for company in self.companies[:3]])
+
+    def step04_scoped_queryset(self):
+        ids = [company._id for company in self.companies[:3]]
+
+        # The objects of other users are not found, the cache is not used
+        with mock.patch.object(cache, "get_many") as get_many:
+            response = self.batch_retrieve(ids, queryset=Company.objects.filter(user="other"))
+        self.assertEqual(get_many.call_count, 0)
+        self.assertEqual([item["status"] for item in response.data], [status.HTTP_404_NOT_FOUND] * 3)
+
+        with self.capture_statements() as statements:
+            response = self.batch_retrieve(ids, queryset=Company.objects.filter(user=self.user.username))
+        self.assertEqual([item["status"] for item in response.data], [status.HTTP_200_OK] * 3)
+        self.assertEqual(len(statements), 3)
+        self.assertTrue(all('"user" = ' in statement for statement in statements))
+
+        # The keys out of the queryset are not read
+        keys = [
+            {"_id": self.companies[0]._id, "user": "other"},
+            {"_id": self.companies[1]._id, "user": self.user.username},
+        ]
+        with self.capture_statements() as statements:
+            results = Company.batch_get(keys, queryset=Company.objects.filter(user=self.user.username))
+        self.assertEqual(len(statements), 1)
+        self.assertIsNone(results[0])
+        self.assertEqual(results[1].name, self.companies[1].name)
+
+    def step05_read_error(self):
+        # The errors of the driver are not returned to the client
+        with mock.patch.object(Company, "batch_get", return_value=[Exception("Cassandra timeout at 10.0.0.1")]):
+            response = self.batch_retrieve([self.companies[0]._id])
+        self.assertEqual(response.data[0]["status"], status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(response.data[0]["errors"]["detail"], "Unable to read the object.")
+
+
+class SearchHydrationCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the objects of the search results of Company """
+
+    def search(self, query):
+        with self.capture_statements() as statements:
+            response = self.api_client.get("{0}?limit=5&{1}".format(reverse("company-search-list"), query))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 5)
+        return response, self.get_selected_columns(statements)
+
+    def step01_from_index(self):
+        # The index stores all the requested fields, Cassandra is not read
+        response, selected = self.search("fields=_id,name,country_code,foundation_date,specialties")
+        self.assertEqual(selected, [])
+
+        companies = {str(company._id): company for company in self.companies}
+        for result in response.data["results"]:
+            company = companies[result["_id"]]
+            self.assertEqual(result["name"], company.name)
+            self.assertEqual(result["country_code"], company.country_code)
+            self.assertEqual(result["foundation_date"], str(company.foundation_date))
+            self.assertEqual(result["specialties"], company.specialties)
+
+    def step02_from_cassandra(self):
+        # The index only keeps a transformed version of the UDTs. The objects
+        # are read by their primary key (restricted, not selected)
+        response, selected = self.search("fields=_id,name,address")
+        self.assertEqual(selected, [{"name", "address"}] * 5)
+
+        companies = {str(company._id): company for company in self.companies}
+        for result in response.data["results"]:
+            self.assertEqual(result["address"]["city"], companies[result["_id"]].address.city)
+
+        # The full objects
+        response, selected = self.search("")
+        self.assertEqual(selected, [set(Company._columns.keys()) - {"_id", "user"}] * 5)
+
+
+class CompactSearchResultTest(CaravaggioBaseTest):
+    """ Test module for the search results of Company """
+
+    def get_result(self, document):
+        document = dict(document)
+        return CompactSearchResult(
+            Company._meta.app_label, Company._meta.model_name, document.pop("_id"), score=1.0, **document
+        )
+
+    def step01_one_class_per_model(self):
+        companies = datasets.generate_companies(200)
+        documents = [datasets.to_solr_document(company) for company in companies]
+        # The documents do not have the fields without value
+        documents[0].pop("round_notes", None)
+        documents[1] = {name: documents[1][name] for name in ("_id", "name")}
+        documents[2]["websites_twitter"] = "https://twitter.com/company"
+
+        results = [self.get_result(document) for document in documents]
+        self.assertEqual(len({type(result) for result in results}), 1)
+        self.assertEqual(len(type(results[0])._fields), len(type(results[0])._positions))
+
+        self.assertEqual(results[0].name, companies[0].name)
+        self.assertIsNone(results[0].round_notes)
+        self.assertNotIn("round_notes", results[0].get_additional_fields())
+        self.assertIsNone(results[1].country_code)
+        self.assertEqual(results[1].get_additional_fields(), {"name": companies[1].name})
+
+        # The fields that are not stored fields of the index
+        self.assertEqual(results[2].websites_twitter, "https://twitter.com/company")
+        self.assertEqual(results[2].get_additional_fields()["websites_twitter"], "https://twitter.com/company")
+
+    def step02_other_attributes(self):
+        result = self.get_result(datasets.to_solr_document(datasets.generate_companies(1)[0]))
+        self.assertIsNone(result.already_loaded)
+        result.already_loaded = True
+        result.name = "Renamed"
+        self.assertTrue(result.already_loaded)
+        self.assertEqual(result.name, "Renamed")
+        self.assertNotIn("name", result.__dict__)
+
+        copy = pickle.loads(pickle.dumps(result))
+        self.assertIs(type(copy), type(result))
+        self.assertEqual(copy.get_additional_fields(), result.get_additional_fields())
+
+    def step03_other_connection(self):
+        # A connection whose index of Company only stores the name
+        index = mock.Mock(fields={"name": mock.Mock(stored=True, index_fieldname="name")})
+        other = mock.Mock()
+        other.get_unified_index.return_value.get_index.return_value = index
+
+        with mock.patch.dict(connections.connections_info, {"other": connections.connections_info["default"]}):
+            # The connections of the thread are created with the first one
+            connections["default"]
+            connections.thread_local.connections["other"] = other
+            self.addCleanup(connections.thread_local.connections.pop, "other", None)
+
+            result_class = get_result_class(CompactSearchResult, "other")
+            self.assertIs(result_class, CompactSearchResult.for_using("other"))
+            self.assertIs(get_result_class(CompactSearchResult, "default"), CompactSearchResult)
+            self.assertIs(get_result_class(SearchResult, "other"), SearchResult)
+
+            document = datasets.to_solr_document(datasets.generate_companies(1)[0])
+            result = result_class(
+                Company._meta.app_label, Company._meta.model_name, document["_id"], name="Other", country_code="ESP"
+            )
+            self.assertIsInstance(result, CompactSearchResult)
+            self.assertEqual(result._using, "other")
+            self.assertEqual(type(result)._fields, ("name",))
+            self.assertEqual(result.country_code, "ESP")
+            self.assertEqual(result.get_stored_fields(), {"name": "Other"})
+            self.assertIs(result.searchindex, index)
+            self.assertIsNot(type(result), type(self.get_result(document)))
+
+            copy = pickle.loads(pickle.dumps(result))
+            self.assertIs(type(copy), type(result))
+            self.assertEqual(copy.get_additional_fields(), result.get_additional_fields())
+
+
+class ValuesCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the values of the searches of Company """
+
+    fields = ("_id", "name", "created_at", "foundation_date", "headcount", "company_score", "specialties")
+
+    def step01_values(self):
+        queryset = CaravaggioSearchQuerySet().models(Company)
+        with mock.patch.object(self.solr_core, "select", wraps=self.solr_core.select) as select:
+            values = list(queryset.values(*self.fields)[:5])
+
+        # Only the requested fields are sent back
+        self.assertTrue(self.solr_core.get_fields(select.call_args[0][0]).issubset(set(self.fields) | {"score"}))
+
+        # The same values of the search results
+        results = list(queryset[:5])
+        self.assertEqual(values, [{name: getattr(result, name) for name in self.fields} for result in results])
+        self.assertEqual([value["name"] for value in values], [company.name for company in self.companies[:5]])
+        self.assertEqual(values[0]["headcount"], self.companies[0].headcount)
+        self.assertEqual(values[0]["specialties"], self.companies[0].specialties)
+
+    def step02_values_list(self):
+        queryset = CaravaggioSearchQuerySet().models(Company)
+        values = list(queryset.values_list(*self.fields)[:5])
+        results = list(queryset[:5])
+        self.assertEqual(values, [tuple(getattr(result, name) for name in self.fields) for result in results])
+
+        names = list(queryset.values_list("name", flat=True)[:5])
+        self.assertEqual(names, [company.name for company in self.companies[:5]])
+
+    def step03_iterator(self):
+        queryset = CaravaggioSearchQuerySet().models(Company)
+        requests = self.solr.requests
+        ids = list(queryset.values_list("_id", flat=True).iterator(batch_size=7))
+        self.assertEqual(ids, [str(company._id) for company in self.companies])
+        # As in Solr, the end of the results is the page that returns the
+        # same cursor mark it received
+        self.assertEqual(self.solr.requests - requests, 4)
+
+
+class FederatedSearchTest(CaravaggioBaseTest):
+    """ Test module for the searches over the cores of several models """
+
+    def get_result(self, model, document_id, score, **fields):
+        return CompactSearchResult(model._meta.app_label, model._meta.model_name, document_id, score=score, **fields)
+
+    def get_responses(self):
+        return {
+            Company: {
+                "results": [
+                    self.get_result(Company, "c1", 0.9, headcount=10),
+                    self.get_result(Company, "c2", 0.5, headcount=30),
+                    self.get_result(Company, "c3", 0.2, headcount=None),
+                ],
+                "hits": 3,
+                "facets": {
+                    "fields": {"country_code": [("ES", 2), ("US", 1)]},
+                    "queries": {"headcount:[0 TO 20]": 1},
+                },
+            },
+            CompanyRanking: {
+                "results": [
+                    self.get_result(CompanyRanking, "r1", 0.7, headcount=20),
+                    self.get_result(CompanyRanking, "r2", 0.1, headcount=5),
+                ],
+                "hits": 2,
+                "facets": {
+                    "fields": {"country_code": [("US", 2)], "rank": [(1, 2)]},
+                    "queries": {"headcount:[0 TO 20]": 2},
+                },
+            },
+        }
+
+    @contextmanager
+    def stub_searches(self, responses):
+        backend = connections["default"].get_backend()
+
+        def search(query_string, **kwargs):
+            response = dict(responses[kwargs["models"][0]])
+            start, end = kwargs["start_offset"], kwargs["end_offset"]
+            response["results"] = response["results"][start:end]
+            return response
+
+        with mock.patch.object(
+            type(backend), "search", autospec=True, side_effect=lambda _, *args, **kwargs: search(*args, **kwargs)
+        ) as stub:
+            yield backend, stub
+
+    def step01_merge_by_score(self):
+        with self.stub_searches(self.get_responses()) as (backend, stub):
+            results = backend.federated_search("*:*", models=[Company, CompanyRanking], start_offset=0, end_offset=4)
+
+        self.assertEqual(stub.call_count, 2)
+        self.assertEqual([result.pk for result in results["results"]], ["c1", "r1", "c2", "c3"])
+        self.assertEqual(results["hits"], 5)
+        self.assertIsNone(results["federated_offsets"])
+
+        # The counts of the facets of both cores are added up
+        self.assertEqual(results["facets"]["fields"]["country_code"], [("US", 3), ("ES", 2)])
+        self.assertEqual(results["facets"]["fields"]["rank"], [(1, 2)])
+        self.assertEqual(results["facets"]["queries"], {"headcount:[0 TO 20]": 3})
+
+    def step02_merge_by_sort_fields(self):
+        responses = self.get_responses()
+        for response in responses.values():
+            response["results"].sort(key=lambda result: (result.headcount is None, -(result.headcount or 0)))
+
+        with self.stub_searches(responses) as (backend, _):
+            results = backend.federated_search(
+                "*:*", models=[Company, CompanyRanking], sort_by="headcount desc", start_offset=1, end_offset=5
+            )
+
+        # The results without value of the sort field go last
+        self.assertEqual([result.pk for result in results["results"]], ["r1", "c1", "r2", "c3"])
+
+    def step03_composite_cursor(self):
+        models = [Company, CompanyRanking]
+        with self.stub_searches(self.get_responses()) as (backend, stub):
+            first = backend.federated_search("*:*", models=models, start_offset=0, end_offset=2, federated_offsets={})
+            second = backend.federated_search(
+                "*:*", models=models, start_offset=0, end_offset=2, federated_offsets=first["federated_offsets"]
+            )
+            third = backend.federated_search(
+                "*:*", models=models, start_offset=0, end_offset=2, federated_offsets=second["federated_offsets"]
+            )
+
+        self.assertEqual([result.pk for result in first["results"]], ["c1", "r1"])
+        company, ranking = Company._meta.label_lower, CompanyRanking._meta.label_lower
+        self.assertEqual(first["federated_offsets"], {company: 1, ranking: 1})
+
+        # Every core returns the page from the results already consumed
+        self.assertEqual([result.pk for result in second["results"]], ["c2", "c3"])
+        self.assertEqual(second["federated_offsets"], {company: 3, ranking: 1})
+        self.assertEqual([result.pk for result in third["results"]], ["r2"])
+        self.assertEqual(third["federated_offsets"], {company: 3, ranking: 2})
+
+
+class AsyncSearchCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the coroutine version of the search of Company """
+
+    def get_view(self, params, **initkwargs):
+        """
+        A search view already initialized (authentication, permissions and
+        throttles), as the ASGI consumers get it.
+        """
+        request = APIRequestFactory().get(reverse("company-search-list"), params)
+        force_authenticate(request, user=self.user)
+
+        view = CompanySearchViewSet(action_map={"get": "list"}, format_kwarg=None, **initkwargs)
+        view.args, view.kwargs = (), {}
+        view.request = view.initialize_request(request)
+        view.headers = view.default_response_headers
+        view.initial(view.request)
+        return view
+
+    def run_alist(self, view):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(view.alist(view.request))
+        finally:
+            loop.close()
+
+    def step01_without_pagination(self):
+        params = {"country_code": self.companies[0].country_code}
+        response = self.run_alist(self.get_view(params, pagination_class=None))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        expected = self.get_view(params, pagination_class=None).list(None)
+        self.assertTrue(response.data)
+        self.assertEqual([item["_id"] for item in response.data], [item["_id"] for item in expected.data])
+
+    def step02_paginated(self):
+        view = self.get_view({"limit": 5}, pagination_class=CaravaggioFederatedSearchPagination)
+        response = self.run_alist(view)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 5)
+
+        expected = self.get_view({"limit": 5}, pagination_class=CaravaggioFederatedSearchPagination).list(None)
+        self.assertEqual(
+            [item["_id"] for item in response.data["results"]], [item["_id"] for item in expected.data["results"]],
+        )
+
+
+class SolrNodeRouterTest(CaravaggioBaseTest):
+    """ Test module for the routing of the searches between Solr nodes """
+
+    def setUp(self):
+        super().setUp()
+
+        backend = connections["default"].get_backend()
+        self.core_name = "{0}.{1}".format(backend.keyspace, Company._raw_column_family_name())
+        self.documents = [datasets.to_solr_document(company) for company in datasets.generate_companies(5)]
+
+        self.stack = ExitStack()
+        self.addCleanup(self.stack.close)
+
+    def start_servers(self):
+        """
+        A slow and a fast node, every step starts its own nodes.
+        """
+        self.slow = self.stack.enter_context(stubs.StubSolrServer({self.core_name: self.documents}, latency=0.3))
+        self.fast = self.stack.enter_context(stubs.StubSolrServer({self.core_name: self.documents}))
+
+    def get_solr(self, servers, **options):
+        router = SolrNodeRouter([server.url for server in servers], **options)
+        return RoutedSolr(router, path=self.core_name, timeout=5)
+
+    def step01_ewma(self):
+        self.start_servers()
+        solr = self.get_solr([self.slow, self.fast])
+        for _ in range(6):
+            self.assertEqual(len(solr.search("*:*", rows=2)), 2)
+
+        # Every node gets a request until we know its latency, then the
+        # fastest node gets the rest
+        slow_node, fast_node = solr.router.nodes
+        self.assertEqual(self.slow.requests, 1)
+        self.assertEqual(self.fast.requests, 5)
+        self.assertLess(fast_node.latency, slow_node.latency)
+        self.assertEqual(slow_node.in_flight + fast_node.in_flight, 0)
+
+    def step02_circuit_breaker(self):
+        self.start_servers()
+        solr = self.get_solr([self.slow, self.fast], failure_threshold=2, cooldown=0.5)
+        failing_node, fast_node = solr.router.nodes
+        failing_core = self.slow.cores[self.core_name]
+        self.slow.latency = 0
+
+        with mock.patch.object(failing_core, "select", side_effect=ValueError("Unavailable")):
+            # The request that fails is retried in the other node
+            for _ in range(4):
+                self.assertEqual(len(solr.search("*:*", rows=2)), 2)
+
+            self.assertEqual(self.slow.requests, 2)
+            self.assertEqual(self.fast.requests, 4)
+            self.assertIsNotNone(failing_node.open_until)
+            self.assertGreater(failing_node.error_rate, 0)
+
+            # After the cooldown a single request probes the node
+            time.sleep(0.5)
+            solr.search("*:*", rows=2)
+            self.assertEqual(self.slow.requests, 3)
+            self.assertIsNotNone(failing_node.open_until)
+
+        time.sleep(0.5)
+        solr.search("*:*", rows=2)
+        self.assertEqual(self.slow.requests, 4)
+        self.assertIsNone(failing_node.open_until)
+        self.assertEqual(failing_node.failures, 0)
+
+        # A bad request (unknown core) fails without retrying it in the
+        # other nodes and does not open the circuit
+        unknown = RoutedSolr(solr.router, path="unknown", timeout=5)
+        with mock.patch.object(solr.router, "choose", wraps=solr.router.choose) as choose:
+            with self.assertRaises(SolrError):
+                unknown.search("*:*", rows=2)
+        self.assertEqual(choose.call_count, 1)
+        self.assertEqual(failing_node.failures + fast_node.failures, 0)
+
+    def step03_hedge(self):
+        self.start_servers()
+        solr = self.get_solr([self.slow, self.fast], hedge=True, hedge_min_delay=0.05)
+        slow_node, fast_node = solr.router.nodes
+
+        # The slow node looks like the best one
+        slow_node.latency, fast_node.latency = 0.01, 1.0
+        slow_node.latencies.append(0.01)
+
+        start = time.monotonic()
+        self.assertEqual(len(solr.search("*:*", rows=2)), 2)
+        self.assertLess(time.monotonic() - start, self.slow.latency)
+
+        # The request is sent to the fast node after the p95 of the slow one
+        self.assertEqual(self.fast.requests, 1)
+        self.assertEqual(self.slow.requests, 1)
+
+        # Without latencies of the node we do not hedge the request
+        solr = self.get_solr([self.fast, self.slow], hedge=True)
+        solr.search("*:*", rows=2)
+        self.assertEqual(self.fast.requests, 2)
+        self.assertEqual(self.slow.requests, 1)
+
+
+class PartitionKeySearchTest(CaravaggioBaseTest):
+    """ Test module for the DSE searches restricted to a partition """
+
+    def get_statement(self, queryset):
+        backend = DSEBackend("default", **settings.HAYSTACK_CONNECTIONS["default"])
+        _, search, _ = backend._prepare_search(queryset.query.build_query(), queryset.query.build_params())
+        return search["statement"].query_string
+
+    def get_queryset(self):
+        return CaravaggioSearchQuerySet(query=DSEQuery()).models(Company)
+
+    def step01_pinned_partition(self):
+        company_id = uuid.uuid4()
+
+        for queryset in (
+            self.get_queryset().filter(_id=str(company_id), name="Acme"),
+            self.get_queryset().filter(_id=Exact(str(company_id))),
+            self.get_queryset().filter(SQ(_id=str(company_id)) & (SQ(name="Acme") | SQ(name="Other"))),
+        ):
+            self.assertEqual(queryset.query.get_partition_key(), {"_id": company_id})
+
+            statement = self.get_statement(queryset)
+            self.assertTrue(
+                statement.startswith('SELECT * FROM company WHERE "_id" = {0} AND solr_query='.format(company_id)),
+                statement,
+            )
+
+    def step02_not_pinned(self):
+        company_id = str(uuid.uuid4())
+
+        for queryset in (
+            self.get_queryset().filter(name="Acme"),
+            self.get_queryset().filter(SQ(_id=company_id) | SQ(name="Acme")),
+            self.get_queryset().exclude(_id=company_id),
+            self.get_queryset().filter(_id__in=[company_id, str(uuid.uuid4())]),
+            # Not a valid value of the partition key
+            self.get_queryset().filter(_id="unknown"),
+        ):
+            self.assertIsNone(queryset.query.get_partition_key())
+            self.assertTrue(self.get_statement(queryset).startswith("SELECT * FROM company WHERE solr_query="))
+
+    def step03_tokenized_field(self):
+        # A content filter of a single word over a tokenized field matches
+        # the documents that contain the word, it is not an equality
+        company_id = str(uuid.uuid4())
+        index = connections["default"].get_unified_index().get_index(Company)
+        with mock.patch.object(index.Meta, "text_fields", ["_id"]):
+            self.assertIsNone(self.get_queryset().filter(_id=company_id).query.get_partition_key())
+            self.assertIsNone(self.get_queryset().filter(_id__content=company_id).query.get_partition_key())
+
+            # The exact filters are equalities
+            for queryset in (
+                self.get_queryset().filter(_id__exact=company_id),
+                self.get_queryset().filter(_id=Exact(company_id)),
+            ):
+                self.assertEqual(queryset.query.get_partition_key(), {"_id": uuid.UUID(company_id)})
+
+        with mock.patch.dict(index.fields, {"_id": TextField(model_attr="_id")}):
+            self.assertIsNone(self.get_queryset().filter(_id=company_id).query.get_partition_key())
+
+
+class ServerTimingCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the Server-Timing header of the Company endpoints """
+
+    def get_timings(self, response):
+        timings = {}
+        for item in response["Server-Timing"].split(","):
+            name, duration = item.strip().split(";dur=")
+            timings[name] = float(duration)
+        return timings
+
+    def get_client(self):
+        # The middlewares are loaded by the handler of the client, the
+        # settings only apply to a new client
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client
+
+    def step01_search_phases(self):
+        response = self.api_client.get(reverse("company-search-list"), {"limit": 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        timings = self.get_timings(response)
+        self.assertTrue({"total", "filters", "solr", "qtime", "serialization"}.issubset(timings), timings)
+        self.assertTrue(all(duration >= 0 for duration in timings.values()))
+        self.assertGreaterEqual(timings["total"], timings["solr"])
+
+    def step02_sink(self):
+        sink = mock.Mock()
+        with self.settings(SERVER_TIMING_SINK=sink):
+            response = self.get_client().get("{0}{1}/".format(reverse("company-list"), self.companies[0]._id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        sink.assert_called_once()
+        request, sink_response, timings = sink.call_args[0]
+        self.assertIs(sink_response, response)
+        self.assertEqual(timings.to_header(), response["Server-Timing"])
+
+        # A failing sink does not break the request
+        sink.side_effect = ValueError("Unavailable")
+        with self.settings(SERVER_TIMING_SINK=sink):
+            response = self.get_client().get(reverse("company-search-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("Server-Timing", response)
+
+    def step03_disabled(self):
+        with self.settings(SERVER_TIMING_ENABLED=False):
+            response = self.get_client().get(reverse("company-search-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Server-Timing", response)
+
+
+class RequestProfileCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the profiles of the requests of Company """
+
+    def setUp(self):
+        super().setUp()
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.profiles_dir = directory.name
+
+        # The searches take long enough to get some samples
+        self.solr.latency = 0.05
+
+        profiling_settings = self.settings(
+            PROFILING_DIR=self.profiles_dir, PROFILING_SAMPLE_RATE=0, PROFILING_INTERVAL=0.005
+        )
+        profiling_settings.enable()
+        self.addCleanup(profiling_settings.disable)
+
+        # The authentication by token of the user of the class
+        self.addCleanup(self.api_client.force_authenticate)
+
+    def get_profiles(self):
+        return sorted(os.listdir(self.profiles_dir))
+
+    def step01_not_staff(self):
+        for value in ("1", "inline"):
+            response = self.api_client.get(reverse("company-search-list"), {"_profile": value})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("X-Profile", response)
+            self.assertIn("results", response.json())
+        self.assertEqual(self.get_profiles(), [])
+
+    def step02_staff(self):
+        self.api_client.force_authenticate(self.super_user)
+
+        response = self.api_client.get(reverse("company-search-list"), {"_profile": "1", "limit": 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("results", response.json())
+        self.assertEqual(self.get_profiles(), [response["X-Profile"] + PROFILE_EXTENSION])
+        self.assertIn("CompanySearchViewSet.list", response["X-Profile"])
+
+        response = self.api_client.get(reverse("company-search-list"), {"_profile": "inline", "limit": 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertTrue(response.content.decode("utf-8").startswith("CompanySearchViewSet.list?limit"))
+        self.assertEqual(len(self.get_profiles()), 1)
+
+        # Without the parameter the request is not profiled
+        response = self.api_client.get(reverse("company-search-list"))
+        self.assertNotIn("X-Profile", response)
+        self.assertEqual(len(self.get_profiles()), 1)
+
+
+class SearchExplainCompanyTest(StubServicesTestMixin, CaravaggioBaseTest):
+    """ Test module for the explain mode of the search of Company """
+
+    def setUp(self):
+        super().setUp()
+
+        # The authentication by token of the user of the class
+        self.addCleanup(self.api_client.force_authenticate)
+
+    def search(self, **params):
+        response = self.api_client.get(reverse("company-search-list"), dict(params, limit=5))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # The links of the pages keep the query parameters
+        data = response.json()
+        data.pop("next")
+        data.pop("previous")
+        return data
+
+    def step01_not_staff(self):
+        expected = self.search()
+        self.assertNotIn("explain", expected)
+
+        # The response does not change for the users that are not staff
+        for value in ("1", "true"):
+            self.assertEqual(self.search(explain=value), expected)
+
+    def step02_staff(self):
+        self.api_client.force_authenticate(self.super_user)
+        expected = self.search()
+        self.assertNotIn("explain", expected)
+
+        for value in ("1", "true"):
+            data = self.search(explain=value)
+
+            plan = data.pop("explain")
+            self.assertEqual(data, expected)
+            self.assertTrue(plan["searches"])
+            self.assertTrue(all(search["backend"] for search in plan["searches"]))
+            self.assertIn("timings", plan)
+
+        # Other values do not enable the explain mode
+        for value in ("0", "false", "yes"):
+            self.assertEqual(self.search(explain=value), expected)
+
+
+class TwoTierRedisCacheTest(CaravaggioBaseTest):
+    """ Test module for the two-tier cache over a fake Redis """
+
+    location = "redis://127.0.0.1:6379/15"
+
+    def setUp(self):
+        super().setUp()
+
+        # The listeners reconnect and stop right away
+        stack = ExitStack()
+        self.addCleanup(stack.close)
+        stack.enter_context(mock.patch("caravaggio_rest_api.cache.DEFAULT_RECONNECT_DELAY", 0.05))
+        stack.enter_context(mock.patch("caravaggio_rest_api.cache.LISTEN_TIMEOUT", 0.05))
+
+        # Two processes of the same instance
+        self.caches = [self.get_cache(), self.get_cache()]
+        for two_tier_cache in self.caches:
+            self.addCleanup(two_tier_cache.stop_listener)
+
+        self.redis = self.caches[0].client.get_client(write=True)
+        self.redis.flushdb()
+        self.addCleanup(self.redis.flushdb)
+        for two_tier_cache in self.caches:
+            self.wait_for(two_tier_cache.is_local_active)
+
+    def start_step(self, name):
+        """
+        The keys of the step, the invalidations of the previous steps can
+        still be on their way.
+        """
+        for two_tier_cache in self.caches:
+            two_tier_cache.reset_stats()
+        return "company_{0}".format(name), "other_{0}".format(name)
+
+    def get_cache(self):
+        return TwoTierRedisCache(
+            self.location,
+            {"OPTIONS": {"REDIS_CLIENT_CLASS": "caravaggio_rest_api.benchmarks.stubs.FakeRedis", "LOCAL_TIMEOUT": 60}},
+        )
+
+    def wait_for(self, condition, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Timeout waiting for {0}".format(condition))
+            time.sleep(0.01)
+
+    def get_local(self, two_tier_cache, key):
+        return two_tier_cache.local.get(str(two_tier_cache.make_key(key)), None)
+
+    def get_published(self):
+        return self.redis.server.published[DEFAULT_INVALIDATION_CHANNEL.encode("utf-8")]
+
+    def step01_local_hit_and_miss(self):
+        writer, reader = self.caches
+        key, other = self.start_step("1")
+        writer.set(key, {"name": "Acme"})
+
+        # The writer keeps its copy
+        self.assertEqual(writer.get(key), {"name": "Acme"})
+        self.assertEqual(writer.get_stats()["local"]["hits"], 1)
+
+        # The first read of the other process goes to Redis
+        self.assertEqual(reader.get(key), {"name": "Acme"})
+        stats = reader.get_stats()
+        self.assertEqual((stats["local"]["misses"], stats["redis"]["hits"]), (1, 1))
+
+        value = reader.get(key)
+        value["name"] = "Changed"
+        self.assertEqual(reader.get(key), {"name": "Acme"})
+        self.assertEqual(reader.get_stats()["local"]["hits"], 2)
+
+        self.assertIsNone(reader.get("unknown"))
+        self.assertEqual(reader.get_stats()["redis"]["misses"], 1)
+        self.assertEqual(reader.get_many([key, "unknown"]), {key: {"name": "Acme"}})
+
+    def step02_generation_guard(self):
+        writer, reader = self.caches
+        key, other = self.start_step("2")
+        writer.set(key, {"name": "Acme"})
+
+        # A key is evicted while we read the value from Redis
+        redis = reader.client.get_client(write=False)
+        get = redis.get
+
+        def evicting_get(name):
+            value = get(name)
+            reader.local.delete_many([other])
+            return value
+
+        with mock.patch.object(redis, "get", side_effect=evicting_get):
+            self.assertEqual(reader.get(key), {"name": "Acme"})
+        self.assertIsNone(self.get_local(reader, key))
+
+        self.assertEqual(reader.get(key), {"name": "Acme"})
+        self.assertEqual(self.get_local(reader, key), {"name": "Acme"})
+
+    def step03_cross_instance_eviction(self):
+        writer, reader = self.caches
+        key, other = self.start_step("3")
+        writer.set(key, {"name": "Acme"})
+        reader.get(key)
+
+        writer.set(key, {"name": "Acme Inc."})
+        self.wait_for(lambda: self.get_local(reader, key) is None)
+        self.assertEqual(reader.get(key), {"name": "Acme Inc."})
+
+        writer.delete(key)
+        self.wait_for(lambda: self.get_local(reader, key) is None)
+        self.assertIsNone(reader.get(key))
+
+        writer.set_many({key: 1, other: 2})
+        reader.get_many([key, other])
+        writer.delete_many([key, other])
+        self.wait_for(lambda: self.get_local(reader, key) is None and self.get_local(reader, other) is None)
+        self.assertEqual(reader.get_many([key, other]), {})
+        self.assertGreater(reader.get_stats()["invalidations"]["received"], 0)
+
+    def step04_excluded_keys(self):
+        writer, reader = self.caches
+        key, _ = self.start_step("4")
+        published = self.get_published()
+
+        # The throttling histories are written in every request, they are
+        # not kept in the local tier and their writes are not broadcast
+        writer.set("throttle_user_1", [1, 2])
+        writer.set_many({"throttle_user_2": [3], "company_accesses": [4]})
+        writer.delete("throttle_user_1")
+        writer.delete_many(["throttle_user_2", "company_accesses"])
+        self.assertEqual(self.get_published(), published)
+
+        for name in ("throttle_user_1", "throttle_user_2", "company_accesses"):
+            self.assertIsNone(writer.get(name))
+            self.assertIsNone(self.get_local(writer, name))
+
+        writer.set_many({"throttle_user_2": [3], key: 1})
+        self.assertEqual(self.get_published(), published + 1)
+        self.assertEqual(self.get_local(writer, key), 1)
+        self.assertIsNone(self.get_local(writer, "throttle_user_2"))
+        self.assertEqual(reader.get("throttle_user_2"), [3])
+
+    def step05_lost_subscription(self):
+        writer, reader = self.caches
+        key, _ = self.start_step("5")
+        writer.set(key, {"name": "Acme"})
+        reader.get(key)
+        self.assertEqual(self.get_local(reader, key), {"name": "Acme"})
+
+        # Redis is restarted, the invalidations sent meanwhile are lost
+        self.redis.server.drop_subscriptions()
+        self.wait_for(lambda: not reader._subscribed.is_set())
+        self.assertEqual(len(reader.local), 0)
+        self.assertIsNone(self.get_local(reader, key))
+
+        # Subscribed again
+        self.wait_for(reader.is_local_active)
+        self.wait_for(writer.is_local_active)
+        writer.set(key, {"name": "Acme Inc."})
+        self.assertEqual(reader.get(key), {"name": "Acme Inc."})
+
+
+class SingleFlightTest(CaravaggioBaseTest):
+    """ Test module for the coalescing of identical concurrent searches """
+
+    key = get_search_key("default", "cassandra", "SELECT * FROM company WHERE solr_query='{}'", 500, None)
+
+    def get_search(self, result=None, error=None):
+        """
+        A search that waits until `release` is set, `started` is set when
+        it is running.
+        """
+        search = mock.Mock()
+        search.started, search.release = threading.Event(), threading.Event()
+
+        def run():
+            search.started.set()
+            search.release.wait(5)
+            if error is not None:
+                raise error
+            return result
+
+        search.side_effect = run
+        return search
+
+    def run_concurrently(self, single_flights, search, followers=3):
+        """
+        Runs the search with the first single flight (the leader) and then
+        with the followers, returns the futures of the followers and of the
+        leader.
+        """
+        executor = ThreadPoolExecutor(max_workers=followers + 1)
+        self.addCleanup(executor.shutdown)
+
+        leader = executor.submit(single_flights[0].run, self.key, search)
+        self.assertTrue(search.started.wait(5))
+
+        futures = [
+            executor.submit(single_flights[(index + 1) % len(single_flights)].run, self.key, search)
+            for index in range(followers)
+        ]
+        # The followers are waiting for the leader
+        time.sleep(0.2)
+        search.release.set()
+        return leader, futures
+
+    def step01_shared_results(self):
+        single_flight = SingleFlight(timeout=5)
+        search = self.get_search(result=["row"])
+
+        leader, followers = self.run_concurrently([single_flight], search)
+        self.assertEqual(leader.result(), (["row"], False))
+        for follower in followers:
+            self.assertEqual(follower.result(), (["row"], True))
+        self.assertEqual(search.call_count, 1)
+
+        # A later caller sends a new search
+        self.assertEqual(single_flight.run(self.key, lambda: ["new row"]), (["new row"], False))
+
+    def step02_leader_error(self):
+        single_flight = SingleFlight(timeout=5)
+        error = ValueError("Unavailable")
+        search = self.get_search(error=error)
+
+        leader, followers = self.run_concurrently([single_flight], search)
+        for future in [leader] + followers:
+            with self.assertRaises(ValueError) as context:
+                future.result()
+            self.assertIs(context.exception, error)
+        self.assertEqual(search.call_count, 1)
+
+    def step03_timeout(self):
+        single_flight = SingleFlight(timeout=0.05)
+        search = self.get_search(result=["row"])
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            leader = executor.submit(single_flight.run, self.key, search)
+            self.assertTrue(search.started.wait(5))
+
+            # The follower stops waiting and sends the search itself
+            self.assertEqual(single_flight.run(self.key, lambda: ["own row"]), (["own row"], False))
+            search.release.set()
+            self.assertEqual(leader.result(), (["row"], False))
+
+    def step04_redis(self):
+        caches = dict(
+            settings.CACHES,
+            coalescing={
+                "BACKEND": "django_redis.cache.RedisCache",
+                "LOCATION": "redis://127.0.0.1:6379/14",
+                "OPTIONS": {"REDIS_CLIENT_CLASS": "caravaggio_rest_api.benchmarks.stubs.FakeRedis"},
+            },
+        )
+
+        with self.settings(CACHES=caches):
+            # The single flights of two processes
+            single_flights = [SingleFlight(timeout=5, cache_alias="coalescing") for _ in range(2)]
+            search = self.get_search(result=["row"])
+
+            leader, followers = self.run_concurrently(single_flights, search, followers=2)
+            self.assertEqual(leader.result(), (["row"], False))
+            # The follower of the same process waits for the leader, the
+            # one of the other process for the results stored in Redis
+            for follower in followers:
+                self.assertEqual(follower.result(), (["row"], True))
+            self.assertEqual(search.call_count, 1)
+
+            # The lock is released
+            self.assertEqual(single_flights[1].run(self.key, lambda: ["new row"]), (["new row"], False))
+
+        # Without Redis the searches are only coalesced in the process
+        single_flight = SingleFlight(timeout=5, cache_alias="unknown")
+        self.assertEqual(single_flight.run(self.key, lambda: ["row"]), (["row"], False))
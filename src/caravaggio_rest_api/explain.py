@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+The plan of the searches of a request: what the backends send to Solr/DSE
+(the final `q` and `fq`, the CQL statement, the path of the DSE backend),
+their timings (including the `debug=timing` output of Solr) and the number
+of objects read from Cassandra to build the response.
+
+The plan is only collected for the requests in explain mode, see
+`caravaggio_rest_api.drf_haystack.viewsets.SearchExplainViewSetMixin`.
+"""
+from contextvars import ContextVar
+
+_search_explain = ContextVar("search_explain", default=None)
+
+
+class SearchExplain(object):
+    def __init__(self):
+        self.searches = []
+        self.hydration = {}
+
+    def to_dict(self):
+        return {"searches": self.searches, "hydration": self.hydration}
+
+
+def is_active():
+    return _search_explain.get() is not None
+
+
+def add_search(**info):
+    """
+    Adds a search to the plan of the current request. Returns the dict of
+    the search, to add the information of the results, or None if the
+    request is not in explain mode.
+    """
+    plan = _search_explain.get()
+    if plan is None:
+        return None
+
+    plan.searches.append(info)
+    return info
+
+
+def count(name, value=1):
+    """
+    Counts the objects of the response built with the method `name` (read
+    from Cassandra, built from the index...).
+    """
+    plan = _search_explain.get()
+    if plan is not None:
+        plan.hydration[name] = plan.hydration.get(name, 0) + value
+
+
+def start():
+    """
+    Starts the plan of the current request. Returns the token to pass to
+    `finish`.
+    """
+    return _search_explain.set(SearchExplain())
+
+
+def finish(token):
+    plan = _search_explain.get()
+    _search_explain.reset(token)
+    return plan
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+import asyncio
+import logging
+import re
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+from pysolr import Solr, SolrError
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_EWMA_ALPHA = 0.3
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_COOLDOWN = 30
+# By default we try every node before giving up
+DEFAULT_RETRIES = None
+DEFAULT_HEDGE_MIN_DELAY = 0.05
+DEFAULT_HEDGE_WORKERS = 32
+DEFAULT_LATENCY_WINDOW = 100
+
+HTTP_STATUS_REGEX = re.compile(r"\(HTTP (\d+)\)")
+
+
+def is_node_error(error):
+    """
+    The errors that tell us something about the health of the node:
+    connection errors, timeouts and server errors (5xx). A bad query (4xx)
+    fails in all the nodes.
+    """
+    match = HTTP_STATUS_REGEX.search(str(error))
+    return match is None or int(match.group(1)) >= 500
+
+
+class SolrNode(object):
+    """
+    A search node and the statistics of its latest requests: the moving
+    averages (EWMA) of the latency and the error rate, the latencies of the
+    latest requests (to estimate the p95) and the state of the circuit
+    breaker.
+
+    After `failure_threshold` consecutive failures the circuit is open, the
+    node does not receive requests during `cooldown` seconds. Then a single
+    request probes the node (half-open), if it succeeds the circuit is closed
+    again.
+    """
+
+    def __init__(
+        self,
+        url,
+        alpha=DEFAULT_EWMA_ALPHA,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        cooldown=DEFAULT_COOLDOWN,
+        window=DEFAULT_LATENCY_WINDOW,
+    ):
+        self.url = url.rstrip("/")
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self.latency = None
+        self.error_rate = 0.0
+        self.latencies = deque(maxlen=window)
+        self.in_flight = 0
+
+        self.failures = 0
+        self.open_until = None
+        self.probing = False
+
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "<SolrNode: {0}>".format(self.url)
+
+    @property
+    def score(self):
+        """
+        The expected cost of sending a request to the node, lower is better.
+        The nodes without requests yet have the lowest cost.
+        """
+        latency = self.latency or 0.0
+        return latency * (self.in_flight + 1) / max(1.0 - self.error_rate, 0.01)
+
+    def is_available(self, now):
+        return self.open_until is None or (self.open_until <= now and not self.probing)
+
+    def get_p95(self):
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def start(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finish(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.probing = False
+
+    def record_success(self, latency):
+        with self.lock:
+            self.in_flight -= 1
+            self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+            self.error_rate *= 1 - self.alpha
+            self.latencies.append(latency)
+
+            if self.open_until is not None:
+                LOGGER.info("Solr node {0} is available again".format(self.url))
+            self.failures = 0
+            self.open_until = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+            self.failures += 1
+            self.probing = False
+
+            if self.failures >= self.failure_threshold:
+                if self.open_until is None:
+                    LOGGER.warning(
+                        "Solr node {0} failed {1} consecutive requests, cooling down for {2}s".format(
+                            self.url, self.failures, self.cooldown
+                        )
+                    )
+                self.open_until = time.monotonic() + self.cooldown
+
+
+class SolrNodeRouter(object):
+    """
+    Routes the requests of a search backend with several nodes. Every
+    request is sent to the healthiest node (lower latency, error rate and
+    requests in flight). If the node fails we retry in the next one.
+
+    With `hedge`, if the node does not answer before the p95 of its latency
+    we send the same request to a second node and keep the first response.
+    """
+
+    def __init__(
+        self,
+        urls,
+        alpha=DEFAULT_EWMA_ALPHA,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        cooldown=DEFAULT_COOLDOWN,
+        retries=DEFAULT_RETRIES,
+        hedge=False,
+        hedge_min_delay=DEFAULT_HEDGE_MIN_DELAY,
+        hedge_workers=DEFAULT_HEDGE_WORKERS,
+        window=DEFAULT_LATENCY_WINDOW,
+    ):
+        self.nodes = [
+            SolrNode(url, alpha=alpha, failure_threshold=failure_threshold, cooldown=cooldown, window=window)
+            for url in urls
+        ]
+        self.retries = retries if retries is not None else len(self.nodes) - 1
+        self.hedge = hedge and len(self.nodes) > 1
+        self.hedge_min_delay = hedge_min_delay
+
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=hedge_workers) if self.hedge else None
+
+    @classmethod
+    def from_options(cls, urls, options):
+        """
+        Builds the router from the `ROUTING` options of the connection.
+        """
+        return cls(
+            urls,
+            alpha=options.get("EWMA_ALPHA", DEFAULT_EWMA_ALPHA),
+            failure_threshold=options.get("FAILURE_THRESHOLD", DEFAULT_FAILURE_THRESHOLD),
+            cooldown=options.get("COOLDOWN", DEFAULT_COOLDOWN),
+            retries=options.get("RETRIES", DEFAULT_RETRIES),
+            hedge=options.get("HEDGE", False),
+            hedge_min_delay=options.get("HEDGE_MIN_DELAY", DEFAULT_HEDGE_MIN_DELAY),
+            hedge_workers=options.get("HEDGE_WORKERS", DEFAULT_HEDGE_WORKERS),
+            window=options.get("LATENCY_WINDOW", DEFAULT_LATENCY_WINDOW),
+        )
+
+    def choose(self, exclude=()):
+        """
+        The node that should receive the next request, None if all the nodes
+        are excluded. If all the nodes are cooling down we probe the one that
+        will be available first.
+        """
+        with self.lock:
+            now = time.monotonic()
+            candidates = [node for node in self.nodes if node not in exclude]
+            if not candidates:
+                return None
+
+            available = [node for node in candidates if node.is_available(now)]
+            if available:
+                node = min(available, key=lambda node: (node.score, node.in_flight))
+            else:
+                node = min(candidates, key=lambda node: node.open_until)
+
+            if node.open_until is not None:
+                node.probing = True
+            return node
+
+    def get_hedge_delay(self, node):
+        if not self.hedge:
+            return None
+        p95 = node.get_p95()
+        return max(p95, self.hedge_min_delay) if p95 is not None else None
+
+    def _record_error(self, node, error, latency):
+        if is_node_error(error):
+            node.record_failure()
+        else:
+            # The node answered, the query is wrong
+            node.record_success(latency)
+
+    def _send(self, node, request):
+        node.start()
+        start = time.monotonic()
+        try:
+            response = request(node)
+        except (IOError, SolrError) as e:
+            self._record_error(node, e, time.monotonic() - start)
+            raise
+        except BaseException:
+            node.finish()
+            raise
+
+        node.record_success(time.monotonic() - start)
+        return response
+
+    def _send_hedged(self, node, request, tried):
+        delay = self.get_hedge_delay(node)
+        if delay is None:
+            return self._send(node, request)
+
+        futures = {self.executor.submit(self._send, node, request)}
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            backup = self.choose(exclude=tried)
+            if backup is not None:
+                tried.append(backup)
+                futures.add(self.executor.submit(self._send, backup, request))
+
+        error = None
+        for future in as_completed(futures):
+            try:
+                return future.result()
+            except (IOError, SolrError) as e:
+                if not is_node_error(e):
+                    raise
+                error = e
+        raise error
+
+    def send(self, request):
+        """
+        Sends the request, a function that receives the node, to the best
+        node available.
+        """
+        error = None
+        tried = []
+        for _ in range(self.retries + 1):
+            node = self.choose(exclude=tried)
+            if node is None:
+                break
+
+            tried.append(node)
+            try:
+                return self._send_hedged(node, request, tried)
+            except (IOError, SolrError) as e:
+                if not is_node_error(e):
+                    raise
+                LOGGER.warning("Request to Solr node {0} failed: {1}".format(node.url, e))
+                error = e
+        raise error
+
+    async def _asend(self, node, arequest):
+        node.start()
+        start = time.monotonic()
+        try:
+            response = await arequest(node)
+        except (IOError, SolrError) as e:
+            self._record_error(node, e, time.monotonic() - start)
+            raise
+        except BaseException:
+            # Also the hedged requests we cancel
+            node.finish()
+            raise
+
+        node.record_success(time.monotonic() - start)
+        return response
+
+    async def _asend_hedged(self, node, arequest, tried):
+        delay = self.get_hedge_delay(node)
+        if delay is None:
+            return await self._asend(node, arequest)
+
+        pending = {asyncio.ensure_future(self._asend(node, arequest))}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                backup = self.choose(exclude=tried)
+                if backup is not None:
+                    tried.append(backup)
+                    pending.add(asyncio.ensure_future(self._asend(backup, arequest)))
+
+            error = None
+            while done or pending:
+                for task in done:
+                    try:
+                        return task.result()
+                    except (IOError, SolrError) as e:
+                        if not is_node_error(e):
+                            raise
+                        error = e
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def asend(self, arequest):
+        """
+        Coroutine version of `send`, the request is a coroutine function. The
+        hedged request that loses is cancelled.
+        """
+        error = None
+        tried = []
+        for _ in range(self.retries + 1):
+            node = self.choose(exclude=tried)
+            if node is None:
+                break
+
+            tried.append(node)
+            try:
+                return await self._asend_hedged(node, arequest, tried)
+            except (IOError, SolrError) as e:
+                if not is_node_error(e):
+                    raise
+                LOGGER.warning("Request to Solr node {0} failed: {1}".format(node.url, e))
+                error = e
+        raise error
+
+
+class RoutedSolr(Solr):
+    """
+    The pysolr client of a core served by several nodes. It has a client for
+    each node, and every request is sent to the node chosen by the router.
+    """
+
+    def __init__(self, router, path="", **kwargs):
+        self.router = router
+        self.clients = {
+            node.url: Solr("{0}/{1}".format(node.url, path) if path else node.url, **kwargs) for node in router.nodes
+        }
+        super(RoutedSolr, self).__init__(self.get_client(router.nodes[0]).url, **kwargs)
+
+    def get_client(self, node):
+        return self.clients[node.url]
+
+    def _send_request(self, method, path="", body=None, headers=None, files=None):
+        return self.router.send(
+            lambda node: self.get_client(node)._send_request(method, path, body=body, headers=headers, files=files)
+        )
@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*
 # Copyright (c) 2019 BuildGroup Data Services Inc.
 import ast
+import asyncio
+import contextvars
+import copy
 import datetime
+import functools
+import heapq
 import json
 import logging
 import re
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from weakref import WeakKeyDictionary
 from django.core.exceptions import ImproperlyConfigured
 from django.utils import six
 from haystack.backends import BaseEngine, EmptyResults
@@ -15,17 +24,33 @@ from haystack.inputs import Clean, Exact, PythonData, Raw
 from haystack.models import SearchResult
 from six import string_types
 
+from caravaggio_rest_api import explain, timing
 from caravaggio_rest_api.haystack.backends import SolrSearchNode
-from caravaggio_rest_api.haystack.backends.utils import is_valid_uuid, SolrSearchPaginator
+from caravaggio_rest_api.haystack.backends.routing import RoutedSolr, SolrNodeRouter
+from caravaggio_rest_api.haystack.backends.utils import (
+    is_valid_uuid,
+    get_federated_sort_key,
+    merge_facets,
+    SolrSearchPaginator,
+)
 from caravaggio_rest_api.haystack.inputs import RegExp
+from caravaggio_rest_api.haystack.models import get_result_class
 
 try:
-    from pysolr import Solr, SolrError, force_unicode, IS_PY3, DATETIME_REGEX
+    from pysolr import Solr, SolrError, force_bytes, force_unicode, safe_urlencode, IS_PY3, DATETIME_REGEX
 except ImportError:
     raise MissingDependency(
         "The 'solr' backend requires the installation" " of 'pysolr'. Please refer to the documentation."
     )
 
+# Non-blocking HTTP client of the async searches (`asearch`)
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+DEFAULT_ASYNC_CONNECTIONS = 100
+
 VALID_JSON_FACET_TYPES = ["terms", "query"]
 
 
@@ -54,21 +79,33 @@ class CassandraSolrSearchBackend(SolrSearchBackend):
 
         self.connections = {}
 
-        self.base_url = connection_options["URL"]
+        # The URL can be a list with the URL of every search node. The
+        # requests are routed to the healthiest node (see `SolrNodeRouter`)
+        urls = connection_options["URL"]
+        if isinstance(urls, string_types):
+            urls = [urls]
+
+        self.base_url = urls[0]
 
         self.keyspace = connection_options["KEYSPACE"]
 
         self.conn_kwargs = connection_options.get("KWARGS", {})
 
-        self.conn = Solr(
-            connection_options["URL"], timeout=self.timeout, **connection_options.get("KWARGS", {}), verify=False
-        )
+        self.router = None
+        if len(urls) > 1:
+            self.router = SolrNodeRouter.from_options(urls, connection_options.get("ROUTING", {}))
+
+        self.conn = self.get_conn()
 
         self.log = logging.getLogger("haystack")
 
         self.date_facets = {}
         self.range_facets = {}
 
+        # The sessions of the async searches, by event loop
+        self.async_sessions = WeakKeyDictionary()
+        self.async_connections = connection_options.get("ASYNC_CONNECTIONS", DEFAULT_ASYNC_CONNECTIONS)
+
     def update(self, index, iterable, commit=True):
         raise NotImplemented("Update is not allowed in DSE")
 
@@ -82,6 +119,7 @@ class CassandraSolrSearchBackend(SolrSearchBackend):
             self, raw_results, model=None, highlight=False, result_class=None, distance_point=None, percent_score=False
     ):
 
+        result_class = get_result_class(result_class, self.connection_alias)
         results = super()._process_results(raw_results, highlight, result_class, distance_point)
 
         if (
@@ -170,6 +208,38 @@ class CassandraSolrSearchBackend(SolrSearchBackend):
 
         return results
 
+    def _process_values(self, raw_results, model, fields):
+        """
+        Decodes the values of the requested fields directly from the raw
+        documents, without building the `SearchResult` objects. Used by the
+        `values()` and `values_list()` querysets.
+        """
+        decoders = self.get_values_decoders(model, fields)
+
+        return {
+            "results": [
+                tuple(decode(raw_result.get(key)) for key, decode in decoders) for raw_result in raw_results
+            ]
+        }
+
+    def get_values_decoders(self, model, fields):
+        """
+        Returns the document key and the converter to use for each of the
+        fields, in the same way that `_process_results` converts them.
+        """
+        from haystack import connections
+
+        index = connections[self.connection_alias].get_unified_index().get_index(model)
+
+        decoders = []
+        for field_name in fields:
+            field = index.fields.get(field_name, None)
+            if field is not None and hasattr(field, "convert"):
+                decoders.append((field.index_fieldname, field.convert))
+            else:
+                decoders.append((field_name, self.conn._to_python))
+        return decoders
+
     # TODO: BGDS.
     # Added because the ObjectId that only contains numbers were converted
     # into float -> Inf
@@ -359,18 +429,134 @@ class CassandraSolrSearchBackend(SolrSearchBackend):
 
         return kwargs
 
-    def search(self, query_string, **kwargs):
+    def is_federated(self, **kwargs):
+        """
+        A search over several models is sent to the core of each model. The
+        paginators (cursorMark, paging state) only work with one model.
+        """
+        return (
+            len(kwargs.get("models", None) or []) > 1
+            and not kwargs.get("has_paging", False)
+            and "cursorMark" not in kwargs
+        )
+
+    def _search_backend(self):
+        # The backend keeps the connection and the facets of the last search,
+        # concurrent searches need their own copy of the backend
+        return copy.copy(self)
+
+    def _federated_searches(self, kwargs):
+        """
+        Splits the arguments of a federated search into the arguments of the
+        search of each model.
+        """
+        kwargs = dict(kwargs)
+        models = list(kwargs.pop("models"))
+        start_offset = kwargs.pop("start_offset", None) or 0
+        end_offset = kwargs.pop("end_offset", None)
+        offsets = kwargs.pop("federated_offsets", None)
+
+        searches = []
+        for model in models:
+            if offsets is not None:
+                model_start = offsets.get(model._meta.label_lower, 0)
+                model_end = model_start + (end_offset - start_offset) if end_offset is not None else None
+            else:
+                model_start, model_end = 0, end_offset
+            searches.append(dict(kwargs, models=[model], start_offset=model_start, end_offset=model_end))
+        return searches
+
+    def _merge_federated(self, kwargs, searches, responses):
+        start_offset = kwargs.get("start_offset", None) or 0
+        end_offset = kwargs.get("end_offset", None)
+        offsets = kwargs.get("federated_offsets", None)
+
+        # Values queries return tuples, we keep the order of the models
+        if kwargs.get("values_fields", None) is not None:
+            merged = [values for response in responses for values in response.get("results", [])]
+        else:
+            merged = list(
+                heapq.merge(
+                    *[response.get("results", []) for response in responses],
+                    key=get_federated_sort_key(kwargs.get("sort_by", None)),
+                )
+            )
+
+        if offsets is not None:
+            page = merged[: end_offset - start_offset] if end_offset is not None else merged
+            next_offsets = {search["models"][0]._meta.label_lower: search["start_offset"] for search in searches}
+            for result in page:
+                label = "{0}.{1}".format(result.app_label, result.model_name)
+                next_offsets[label] = next_offsets.get(label, 0) + 1
+        else:
+            page = merged[start_offset:end_offset]
+            next_offsets = None
+
+        results = {
+            "results": page,
+            "hits": sum(response.get("hits", 0) for response in responses),
+            "facets": merge_facets([response.get("facets", None) for response in responses]),
+            "federated_offsets": next_offsets,
+        }
+
+        for response in responses:
+            for key in ("stats", "spelling_suggestion", "spelling_suggestions", "qtime", "params"):
+                if response.get(key, None) and key not in results:
+                    results[key] = response[key]
+
+        return results
+
+    def federated_search(self, query_string, **kwargs):
+        """
+        Sends the same query to the core of every model concurrently and merges
+        the results by the sort fields of the query (or score) with a k-way
+        merge. The hits and the facets of all the cores are combined.
+
+        Without `federated_offsets` every core returns its first `end_offset`
+        results and we slice the merged results (page number pagination). With
+        `federated_offsets` (the composite cursor, number of results already
+        consumed of each model) every core returns a page from its offset, and
+        we return the offsets after the page in `federated_offsets`.
+        """
+        searches = self._federated_searches(kwargs)
+
+        with ThreadPoolExecutor(max_workers=len(searches)) as executor:
+            # The searches are measured in the phases of the current request
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._search_backend().search, query_string, **search)
+                for search in searches
+            ]
+            responses = [future.result() for future in futures]
+
+        return self._merge_federated(kwargs, searches, responses)
+
+    async def afederated_search(self, query_string, **kwargs):
+        """
+        Coroutine version of `federated_search`.
+        """
+        searches = self._federated_searches(kwargs)
+        responses = await asyncio.gather(*[self.asearch(query_string, **search) for search in searches])
+        return self._merge_federated(kwargs, searches, responses)
+
+    def _prepare_search(self, query_string, kwargs):
+        """
+        Prepares the connection to the core of the model and the parameters of
+        the Solr query. The parameters are None if there is nothing to search.
+        """
         # In cassandra we can only query one table at a time, then only one
         # model should be present in the list of models
         model = list(kwargs["models"])[0]
 
         self.conn = self.prepare_conn(model)
 
+        # values()/values_list() queries: we only ask for the requested fields
+        # and return their values as tuples
+        values_fields = kwargs.pop("values_fields", None)
+        if values_fields is not None:
+            kwargs["fields"] = list(values_fields)
+
         if len(query_string) == 0:
-            return {
-                "results": [],
-                "hits": 0,
-            }
+            return model, None, values_fields
 
         search_kwargs = self.build_search_kwargs(query_string, **kwargs)
 
@@ -380,14 +566,18 @@ class CassandraSolrSearchBackend(SolrSearchBackend):
                     del search_kwargs["fq"][index]
                     break
 
-        try:
-            raw_results = self.conn.search(query_string, **search_kwargs)
-        except (IOError, SolrError) as e:
-            if not self.silently_fail:
-                raise
+        return model, search_kwargs, values_fields
 
-            self.log.error("Failed to query Solr using '%s': %s", query_string, e, exc_info=True)
-            raw_results = EmptyResults()
+    def _finish_search(self, raw_results, model, values_fields, kwargs):
+        if getattr(raw_results, "qtime", None) is not None:
+            timing.record("qtime", raw_results.qtime / 1000.0)
+
+        if values_fields is not None:
+            results = self._process_values(raw_results.docs, model, values_fields)
+            results["hits"] = raw_results.hits
+            if hasattr(raw_results, "nextCursorMark"):
+                results["nextCursorMark"] = raw_results.nextCursorMark
+            return results
 
         app_model = model._meta.label_lower
         for index, raw_result in enumerate(raw_results.docs):
@@ -403,13 +593,178 @@ class CassandraSolrSearchBackend(SolrSearchBackend):
             percent_score=kwargs.get("percent_score"),
         )
 
+    def search(self, query_string, **kwargs):
+        if self.is_federated(**kwargs):
+            return self.federated_search(query_string, **kwargs)
+
+        model, search_kwargs, values_fields = self._prepare_search(query_string, kwargs)
+        if search_kwargs is None:
+            return {
+                "results": [],
+                "hits": 0,
+            }
+
+        plan = self.explain_search(query_string, search_kwargs)
+        start = perf_counter()
+
+        try:
+            with timing.phase("solr"):
+                raw_results = self.conn.search(query_string, **search_kwargs)
+        except (IOError, SolrError) as e:
+            if not self.silently_fail:
+                raise
+
+            self.log.error("Failed to query Solr using '%s': %s", query_string, e, exc_info=True)
+            raw_results = EmptyResults()
+
+        if plan is not None:
+            self.explain_results(plan, raw_results, perf_counter() - start)
+
+        return self._finish_search(raw_results, model, values_fields, kwargs)
+
+    async def asearch(self, query_string, **kwargs):
+        """
+        Coroutine version of `search`. The request to Solr is sent with aiohttp
+        (if it is not installed the request is sent in a thread of the default
+        executor), a worker can have many searches in flight.
+        """
+        if self.is_federated(**kwargs):
+            return await self.afederated_search(query_string, **kwargs)
+
+        backend = self._search_backend()
+
+        model, search_kwargs, values_fields = backend._prepare_search(query_string, kwargs)
+        if search_kwargs is None:
+            return {
+                "results": [],
+                "hits": 0,
+            }
+
+        plan = backend.explain_search(query_string, search_kwargs)
+        start = perf_counter()
+
+        try:
+            with timing.phase("solr"):
+                raw_results = await backend.aconn_search(query_string, **search_kwargs)
+        except (IOError, SolrError) as e:
+            if not self.silently_fail:
+                raise
+
+            self.log.error("Failed to query Solr using '%s': %s", query_string, e, exc_info=True)
+            raw_results = EmptyResults()
+
+        if plan is not None:
+            backend.explain_results(plan, raw_results, perf_counter() - start)
+
+        return backend._finish_search(raw_results, model, values_fields, kwargs)
+
+    def explain_search(self, query_string, search_kwargs):
+        """
+        Adds the search to the plan of the request if it is in explain mode,
+        and asks Solr for the timings of the search components.
+        """
+        plan = explain.add_search(backend="solr", url=self.conn.url, q=query_string, params=dict(search_kwargs))
+        if plan is not None:
+            search_kwargs["debug"] = "timing"
+        return plan
+
+    def explain_results(self, plan, raw_results, duration):
+        plan.update(
+            {
+                "time_ms": round(duration * 1000, 2),
+                "qtime": getattr(raw_results, "qtime", None),
+                "hits": getattr(raw_results, "hits", 0),
+                "debug": getattr(raw_results, "debug", None) or {},
+            }
+        )
+
+    def get_async_session(self):
+        """
+        The aiohttp session of the running event loop, shared by the searches
+        of all the cores.
+        """
+        loop = asyncio.get_event_loop()
+        session = self.async_sessions.get(loop, None)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.async_connections, ssl=False),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self.async_sessions[loop] = session
+        return session
+
+    async def aclose(self):
+        """
+        Closes the aiohttp session of the running event loop.
+        """
+        session = self.async_sessions.pop(asyncio.get_event_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def aconn_search(self, query_string, **search_kwargs):
+        """
+        The `search` of pysolr over the current connection, without blocking
+        the event loop.
+        """
+        if aiohttp is None:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, functools.partial(self.conn.search, query_string, **search_kwargs))
+
+        params = {"q": query_string}
+        params.update(search_kwargs)
+        params["wt"] = "json"
+
+        conn = self.conn
+        params_encoded = safe_urlencode(params, True)
+
+        if isinstance(conn, RoutedSolr):
+            content = await conn.router.asend(lambda node: self._aconn_request(conn.get_client(node), params_encoded))
+        else:
+            content = await self._aconn_request(conn, params_encoded)
+
+        return conn.results_cls(conn.decoder.decode(content))
+
+    async def _aconn_request(self, conn, params_encoded):
+        handler = conn.search_handler or "select"
+        auth = aiohttp.BasicAuth(*conn.auth) if isinstance(conn.auth, tuple) else None
+
+        session = self.get_async_session()
+        if len(params_encoded) < 1024:
+            request = session.get(conn._create_full_url("%s/?%s" % (handler, params_encoded)), auth=auth)
+        else:
+            # Very long queries are sent as a POST
+            request = session.post(
+                conn._create_full_url("%s/" % handler),
+                data=force_bytes(params_encoded),
+                headers={"Content-type": "application/x-www-form-urlencoded; charset=utf-8"},
+                auth=auth,
+            )
+
+        try:
+            async with request as response:
+                status = response.status
+                content = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise SolrError("Failed to connect to server at {0}: {1}".format(conn.url, e))
+
+        if status != 200:
+            raise SolrError("Solr responded with an error (HTTP {0}): {1}".format(status, content))
+
+        return content
+
+    def get_conn(self, core_name=None):
+        if self.router is not None:
+            return RoutedSolr(self.router, core_name or "", timeout=self.timeout, **self.conn_kwargs, verify=False)
+
+        url = "{0}/{1}".format(self.base_url, core_name) if core_name else self.base_url
+        return Solr(url, timeout=self.timeout, **self.conn_kwargs, verify=False)
+
     def prepare_conn(self, model):
         core_name = "{0}.{1}".format(self.keyspace, model._raw_column_family_name())
 
         conn = self.connections.get(core_name, None)
         if conn is None:
-            url = "{0}/{1}".format(self.base_url, core_name)
-            conn = Solr(url, timeout=self.timeout, **self.conn_kwargs, verify=False)
+            conn = self.get_conn(core_name)
             self.connections[core_name] = conn
         return conn
 
@@ -421,6 +776,9 @@ class CassandraSolrSearchQuery(SolrSearchQuery):
         self.json_facets = {}
         self.range_facets = {}
         self.facets_options = {}
+        self.values_fields = None
+        self.federated_offsets = None
+        self._next_federated_offsets = None
 
     @staticmethod
     def is_function(query):
@@ -589,6 +947,12 @@ class CassandraSolrSearchQuery(SolrSearchQuery):
             for param, options in self.facets_options.items():
                 kwargs[param] = options
 
+        if self.values_fields is not None:
+            kwargs["values_fields"] = self.values_fields
+
+        if self.federated_offsets is not None:
+            kwargs["federated_offsets"] = self.federated_offsets
+
         return kwargs
 
     def _get_facet_fieldname(self, field):
@@ -677,6 +1041,8 @@ class CassandraSolrSearchQuery(SolrSearchQuery):
         clone.json_facets = self.json_facets.copy()
         clone.range_facets = self.range_facets.copy()
         clone.facets_options = self.facets_options.copy()
+        clone.values_fields = self.values_fields
+        clone.federated_offsets = self.federated_offsets
         return clone
 
     def run(self, spelling_query=None, **kwargs):
@@ -688,12 +1054,70 @@ class CassandraSolrSearchQuery(SolrSearchQuery):
             search_kwargs.update(kwargs)
 
         results = self.backend.search(final_query, **search_kwargs)
+        self._set_results(results)
+
+    async def arun(self, spelling_query=None, **kwargs):
+        """Coroutine version of `run`."""
+        final_query = self.build_query()
+        search_kwargs = self.build_params(spelling_query, **kwargs)
+
+        if kwargs:
+            search_kwargs.update(kwargs)
 
+        results = await self.backend.asearch(final_query, **search_kwargs)
+        self._set_results(results)
+
+    def _set_results(self, results):
         self._results = results.get("results", [])
         self._hit_count = results.get("hits", 0)
         self._facet_counts = self.post_process_facets(results)
         self._stats = results.get("stats", {})
         self._spelling_suggestion = results.get("spelling_suggestion", None)
+        self._next_federated_offsets = results.get("federated_offsets", None)
+
+    async def aget_results(self, **kwargs):
+        """
+        Coroutine version of `get_results`, only for normal queries (not
+        raw or more like this queries).
+        """
+        if self._results is None:
+            await self.arun(**kwargs)
+
+        return self._results
+
+    async def aget_count(self):
+        """
+        Coroutine version of `get_count`.
+        """
+        if self._hit_count is None:
+            await self.arun(start_offset=0, end_offset=0)
+            self._results = None
+
+        return self._hit_count
+
+    def get_next_federated_offsets(self):
+        """
+        The composite cursor after the results of a federated search: the
+        number of results consumed of each model.
+        """
+        return self._next_federated_offsets
+
+    def get_count(self):
+        """
+        Returns the number of results the backend found for the query. If the
+        query has not been run, we only ask for the number of hits (`rows=0`).
+        """
+        if self._hit_count is None and not self._more_like_this and not self._raw_query:
+            self.run(start_offset=0, end_offset=0)
+            self._results = None
+
+        return super().get_count()
+
+    def has_results(self):
+        """
+        Returns True if the query has any result.
+        """
+        return self.get_count() > 0
 
     def run_mlt(self, **kwargs):
         """Builds and executes the query. Returns a list of search results."""
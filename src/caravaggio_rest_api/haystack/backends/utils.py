@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*
 # Copyright (c) 2019 BuildGroup Data Services Inc.
+from collections import OrderedDict
 from uuid import UUID
 
 from caravaggio_rest_api.caravaggio_paginator import CaravaggioSearchPaginator
@@ -51,64 +52,179 @@ class SolrSearchPaginator(CaravaggioSearchPaginator):
         else:
             return self.results is None or self.cursorMark != self.results[SolrSearchPaginator.NEXT_CURSORMARK_FIELD]
 
-    def next(self):
-        if self.has_next():
-            # We cannot use CursorMarkets with Grouping. We will look if the
-            # number of results is less than the informed limit
-            is_group = "group" in self.search_kwargs and "true" == self.search_kwargs[str("group")]
+    def is_group(self):
+        # We cannot use CursorMarkets with Grouping. We will look if the
+        # number of results is less than the informed limit
+        return "group" in self.search_kwargs and "true" == self.search_kwargs[str("group")]
 
-            if is_group:
-                self.search_kwargs[str("start_offset")] = self.loaded_docs
+    def _prepare_next(self):
+        if self.is_group():
+            self.search_kwargs[str("start_offset")] = self.loaded_docs
 
-                self.search_kwargs["end_offset"] = self.loaded_docs + (
-                    self.limit if self.limit is not None and (self.limit < self.max_limit) else self.max_limit
-                )
-            else:
+            self.search_kwargs["end_offset"] = self.loaded_docs + (
+                self.limit if self.limit is not None and (self.limit < self.max_limit) else self.max_limit
+            )
+        else:
 
-                # Save the next cursor mark as the actual cursor mark to send
-                # to the server
-                if self.results:
-                    self.cursorMark = self.results[SolrSearchPaginator.NEXT_CURSORMARK_FIELD]
+            # Save the next cursor mark as the actual cursor mark to send
+            # to the server
+            if self.results:
+                self.cursorMark = self.results[SolrSearchPaginator.NEXT_CURSORMARK_FIELD]
 
-                # Signaling the cursor mark
-                if "start_offset" in self.search_kwargs:
-                    del self.search_kwargs[str("start_offset")]
+            # Signaling the cursor mark
+            if "start_offset" in self.search_kwargs:
+                del self.search_kwargs[str("start_offset")]
 
-                self.search_kwargs["end_offset"] = (
-                    self.limit if self.limit is not None and self.limit < self.max_limit else self.max_limit
-                )
+            self.search_kwargs["end_offset"] = (
+                self.limit if self.limit is not None and self.limit < self.max_limit else self.max_limit
+            )
+
+            self.search_kwargs[SolrSearchPaginator.CURSORMARK_FIELD] = self.cursorMark
+
+    def _process_next(self):
+        if self.is_group():
+            groups_size = len(self.results["groups"])
+            self.loaded_docs += groups_size
+            if self.max_results and self.loaded_docs > self.max_results:
+                extra_values = self.loaded_docs - self.max_results
+                if extra_values < groups_size:
+                    new_groups = {}
+                    for key in list(self.results["groups"])[: groups_size - extra_values]:
+                        new_groups[key] = self.results["groups"][key]
+                    self.results["groups"] = new_groups
+                    self.loaded_docs = self.max_results
+        else:
+            results_size = len(self.results["results"])
+            self.loaded_docs += results_size
+            if self.max_results and self.loaded_docs > self.max_results:
+                extra_values = self.loaded_docs - self.max_results
+                if extra_values < results_size:
+                    self.results["results"] = self.results["results"][: results_size - extra_values]
+                    self.loaded_docs = self.max_results
 
-                self.search_kwargs[SolrSearchPaginator.CURSORMARK_FIELD] = self.cursorMark
+        return self.results
+
+    def next(self):
+        if self.has_next():
+            self._prepare_next()
 
             # Do the search
             self.results = self.backend.search(
                 query_string=self.query_string, percent_score=self.percent_score, **self.search_kwargs
             )
 
-            if is_group:
-                groups_size = len(self.results["groups"])
-                self.loaded_docs += groups_size
-                if self.max_results and self.loaded_docs > self.max_results:
-                    extra_values = self.loaded_docs - self.max_results
-                    if extra_values < groups_size:
-                        new_groups = {}
-                        for key in list(self.results["groups"])[: groups_size - extra_values]:
-                            new_groups[key] = self.results["groups"][key]
-                        self.results["groups"] = new_groups
-                        self.loaded_docs = self.max_results
-            else:
-                results_size = len(self.results["results"])
-                self.loaded_docs += results_size
-                if self.max_results and self.loaded_docs > self.max_results:
-                    extra_values = self.loaded_docs - self.max_results
-                    if extra_values < results_size:
-                        self.results["results"] = self.results["results"][: results_size - extra_values]
-                        self.loaded_docs = self.max_results
-
-            return self.results
+            return self._process_next()
         else:
             return EmptyResults()
 
+    async def anext(self):
+        """
+        Coroutine version of `next`.
+        """
+        if self.has_next():
+            self._prepare_next()
+
+            # Do the search
+            self.results = await self.backend.asearch(
+                query_string=self.query_string, percent_score=self.percent_score, **self.search_kwargs
+            )
+
+            return self._process_next()
+        else:
+            return EmptyResults()
+
+
+class FederatedSortKey(object):
+    """
+    Sort key of the results of a federated search, compares the values of the
+    sort fields of two results in the direction of each field (`None` values
+    go last). Without sort fields the results are sorted by score.
+    """
+
+    __slots__ = ("values", "descending")
+
+    def __init__(self, values, descending):
+        self.values = values
+        self.descending = descending
+
+    def __lt__(self, other):
+        for value, other_value, descending in zip(self.values, other.values, self.descending):
+            if value == other_value:
+                continue
+            if value is None:
+                return False
+            if other_value is None:
+                return True
+            return value > other_value if descending else value < other_value
+        return False
+
+
+def get_federated_sort_key(sort_by=None):
+    """
+    Returns the key function to merge the results of the cores with the
+    `sort_by` of the query ("field asc, other desc").
+    """
+    sort_fields = []
+    for term in (sort_by or "score desc").split(","):
+        parts = term.split()
+        if parts:
+            sort_fields.append((parts[0], len(parts) > 1 and parts[1].lower() == "desc"))
+
+    names = [name for name, _ in sort_fields]
+    descending = [desc for _, desc in sort_fields]
+
+    def key(result):
+        return FederatedSortKey([getattr(result, name, None) for name in names], descending)
+
+    return key
+
+
+def _merge_counts(counts_list, sort_by_count):
+    merged = OrderedDict()
+    for counts in counts_list:
+        for value, count in counts:
+            merged[value] = merged.get(value, 0) + count
+
+    if sort_by_count:
+        return sorted(merged.items(), key=lambda item: item[1], reverse=True)
+    return list(merged.items())
+
+
+def merge_facets(facets_list):
+    """
+    Combines the facets of the cores of a federated search: the counts of the
+    field, date, range and query facets are added up, for the rest of facets
+    (heatmaps, json facets) we keep the ones of the first core.
+    """
+    facets_list = [facets for facets in facets_list if facets]
+    if not facets_list:
+        return {}
+
+    merged = {}
+    for facets in facets_list:
+        for facet_type, values in facets.items():
+            merged.setdefault(facet_type, []).append(values)
+
+    for facet_type, values_list in merged.items():
+        if facet_type in ("fields", "dates", "ranges"):
+            names = OrderedDict()
+            for values in values_list:
+                for name, counts in values.items():
+                    names.setdefault(name, []).append(list(counts))
+            merged[facet_type] = {
+                name: _merge_counts(counts_list, facet_type == "fields") for name, counts_list in names.items()
+            }
+        elif facet_type == "queries":
+            queries = {}
+            for values in values_list:
+                for name, count in values.items():
+                    queries[name] = queries.get(name, 0) + count
+            merged[facet_type] = queries
+        else:
+            merged[facet_type] = values_list[0]
+
+    return merged
+
 
 def is_valid_uuid(uuid_to_test, version=4):
     """
@@ -8,8 +8,10 @@ from django.utils import six
 
 try:
     from dse.util import Point, LineString
+    from dse.cqlengine import columns
 except ImportError:
     from cassandra.util import Point, LineString
+    from cassandra.cqlengine import columns
 
 from haystack import indexes
 from haystack.fields import LocationField, SearchField, FacetCharField
@@ -26,6 +28,34 @@ class BaseSearchIndex(indexes.SearchIndex):
 
         text_fields = []
 
+    def get_stored_columns(self):
+        """
+        Returns a dict with the columns of the model whose value is stored
+        as it is in the index, and the name of the index field that keeps
+        it. The search results can be built from the documents of the index
+        if they cover all the columns we need.
+
+        Maps, UDTs and geo fields are never covered, the index only keeps
+        a transformed version of them.
+        """
+        if getattr(self, "_stored_columns", None) is None:
+            model = self.get_model()
+            stored_columns = {}
+            for field_name, field in self.fields.items():
+                column_name = field.model_attr or field_name
+                column = model._columns.get(column_name)
+                if (
+                    field.stored
+                    and column is not None
+                    and not isinstance(column, (columns.Map, columns.UserDefinedType))
+                    and not isinstance(field, LocationField)
+                    and column_name not in stored_columns
+                ):
+                    stored_columns[column_name] = field.index_fieldname
+            self._stored_columns = stored_columns
+
+        return self._stored_columns
+
     @staticmethod
     def prepare_autocomplete(obj):
         # return " ".join((
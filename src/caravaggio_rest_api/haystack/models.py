@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+import logging
+
+from haystack.constants import DEFAULT_ALIAS
+from haystack.exceptions import NotHandled
+from haystack.models import SearchResult
+from haystack.utils.app_loading import haystack_get_model
+
+
+def _rebuild_compact_result(app_label, model_name, pk, score, fields, using=DEFAULT_ALIAS):
+    return CompactSearchResult.for_using(using)(app_label, model_name, pk, score, **fields)
+
+
+def get_result_class(result_class, using):
+    """
+    The result class a backend of the connection `using` must use to build
+    its results: the `CompactSearchResult` classes are bound to the
+    connection, their stored fields and index are the ones of the
+    connection.
+    """
+    if isinstance(result_class, type) and issubclass(result_class, CompactSearchResult):
+        return result_class.for_using(using)
+    return result_class
+
+
+def get_stored_field_names(app_label, model_name, using=DEFAULT_ALIAS):
+    """
+    The names of the stored fields of the index of the model (the fields of
+    the documents returned by the search engine of the connection `using`).
+    """
+    from haystack import connections
+
+    try:
+        model = haystack_get_model(app_label, model_name)
+        index = connections[using].get_unified_index().get_index(model)
+    except (LookupError, NotHandled):
+        return ()
+
+    return tuple(sorted(field.index_fieldname for field in index.fields.values() if field.stored))
+
+
+class CompactSearchResult(object):
+    """
+    A lightweight version of the haystack `SearchResult` without a `__dict__`
+    per instance. The values of the additional fields of the result (the
+    fields of the Solr document) are kept in a list, and the names of the
+    fields in a tuple shared by all the results of the same model: the
+    stored fields of its index. We generate a class for every model, the
+    fields a document does not have are None.
+
+    The fields that are not stored fields of the index (ex. dynamic fields)
+    and any other attribute set in the result are kept in a `__dict__`,
+    only created for the results that have them.
+
+    The classes are bound to a haystack connection (`for_using`, the
+    default connection by default), the index of the model is the one of
+    the connection that returned the results.
+
+    It has the same interface than `SearchResult`, it can be used with the
+    haystack and drf-haystack serializers.
+    """
+
+    __slots__ = (
+        "app_label",
+        "model_name",
+        "pk",
+        "score",
+        "_values",
+        "_object",
+        "_model",
+        "_point_of_origin",
+        "_distance",
+        "_stored_fields",
+        "__dict__",
+    )
+
+    # The names of the additional fields of the class and their position
+    # in the `_values` of the instances
+    _fields = ()
+    _positions = {}
+
+    # The base class of the generated classes
+    _base = None
+
+    # The alias of the haystack connection of the results
+    _using = DEFAULT_ALIAS
+
+    # The generated classes by model
+    _classes = {}
+
+    log = logging.getLogger("haystack")
+
+    def __new__(cls, app_label, model_name, pk, score=None, **kwargs):
+        return object.__new__(cls.for_model(app_label, model_name))
+
+    def __init__(self, app_label, model_name, pk, score=None, **kwargs):
+        self.app_label, self.model_name = app_label, model_name
+        self.pk = pk
+        self.score = score
+        self._object = None
+        self._model = None
+        self._point_of_origin = kwargs.pop("_point_of_origin", None)
+        self._distance = kwargs.pop("_distance", None)
+        self._stored_fields = None
+        self._values = [kwargs.pop(name, None) for name in self._fields]
+        if kwargs:
+            self.__dict__.update(kwargs)
+
+    @classmethod
+    def for_using(cls, using):
+        """
+        Returns the class for the results of the haystack connection
+        `using`.
+        """
+        base = cls._base or cls
+        if using is None or using == base._using:
+            return base
+
+        klass = base._classes.get((base, using))
+        if klass is None:
+            klass = type(
+                base.__name__, (base,), {"__slots__": (), "__module__": base.__module__, "_base": base, "_using": using}
+            )
+            base._classes[(base, using)] = klass
+        return klass
+
+    @classmethod
+    def for_model(cls, app_label, model_name):
+        """
+        Returns the class for the results of the given model, with the
+        stored fields of its index in the connection of the class.
+        """
+        parent = cls.for_using(cls._using)
+        base = parent._base or parent
+        klass = base._classes.get((base, parent._using, app_label, model_name))
+        if klass is None:
+            fields = get_stored_field_names(app_label, model_name, using=parent._using)
+            klass = type(
+                base.__name__,
+                (parent,),
+                {
+                    "__slots__": (),
+                    "__module__": base.__module__,
+                    "_base": base,
+                    "_fields": fields,
+                    "_positions": {name: position for position, name in enumerate(fields)},
+                },
+            )
+            base._classes[(base, parent._using, app_label, model_name)] = klass
+        return klass
+
+    def __getattr__(self, attr):
+        if attr == "__getnewargs__":
+            raise AttributeError
+
+        # Only called for the stored fields of the index, the rest of
+        # attributes are slots or in the `__dict__`. Unknown fields are None,
+        # as in SearchResult
+        position = self._positions.get(attr)
+        return self._values[position] if position is not None else None
+
+    def __setattr__(self, attr, value):
+        position = self._positions.get(attr)
+        if position is not None:
+            self._values[position] = value
+        else:
+            super().__setattr__(attr, value)
+
+    def __reduce__(self):
+        # The generated classes cannot be pickled by reference
+        return (
+            _rebuild_compact_result,
+            (self.app_label, self.model_name, self.pk, self.score, self.get_additional_fields(), self._using),
+        )
+
+    def __repr__(self):
+        return "<SearchResult: %s.%s (pk=%r)>" % (self.app_label, self.model_name, self.pk)
+
+    @property
+    def searchindex(self):
+        from haystack import connections
+
+        return connections[self._using].get_unified_index().get_index(self.model)
+
+    object = SearchResult.object
+    model = SearchResult.model
+    distance = SearchResult.distance
+    verbose_name = SearchResult.verbose_name
+    verbose_name_plural = SearchResult.verbose_name_plural
+    content_type = SearchResult.content_type
+
+    def get_additional_fields(self):
+        fields = {name: value for name, value in zip(self._fields, self._values) if value is not None}
+        fields.update(self.__dict__)
+        return fields
+
+    def get_stored_fields(self):
+        if self._stored_fields is None:
+            from haystack import connections
+
+            try:
+                index = connections[self._using].get_unified_index().get_index(self.model)
+            except NotHandled:
+                return {}
+
+            self._stored_fields = {
+                field_name: getattr(self, field_name, "")
+                for field_name, field in index.fields.items()
+                if field.stored is True
+            }
+
+        return self._stored_fields
+
+    def to_model(self):
+        """
+        Builds the model instance from the values of the result, only with
+        the values of the columns of the model.
+        """
+        model = self.model
+        return model(**{name: value for name, value in self.get_additional_fields().items() if name in model._columns})
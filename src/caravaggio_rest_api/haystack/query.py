@@ -1,10 +1,23 @@
 # -*- coding: utf-8 -*
 # Copyright (c) 2019 BuildGroup Data Services Inc.
 # All rights reserved.
-from haystack.query import SearchQuerySet, ValuesSearchQuerySet, ValuesListSearchQuerySet
+from haystack.query import SearchQuerySet, ValuesListSearchQuerySet
+
+from caravaggio_rest_api.caravaggio_paginator import CaravaggioSearchPaginator
+from caravaggio_rest_api.haystack.backends.utils import SolrSearchPaginator
+from caravaggio_rest_api.haystack.models import CompactSearchResult
+
+DEFAULT_ITERATOR_BATCH_SIZE = 1000
 
 
 class CaravaggioSearchQuerySet(SearchQuerySet):
+    def __init__(self, using=None, query=None):
+        super().__init__(using=using, query=query)
+
+        # By default we build the results as `CompactSearchResult` objects,
+        # use `result_class(None)` to get haystack SearchResult objects
+        if query is None:
+            self.query.set_result_class(CompactSearchResult)
 
     def get(self, *args, **kwargs):
         """
@@ -19,23 +32,101 @@ class CaravaggioSearchQuerySet(SearchQuerySet):
         If no objects are matched, a :class:`~.DoesNotExist` exception is raised.
 
         If more than one object is found, a :class:`~.MultipleObjectsReturned` exception is raised.
+
+        We send a single request asking for two results, enough to know if
+        there are multiple objects.
         """
         if args or kwargs:
             return self.filter(*args, **kwargs).get()
 
-        # Check that the resultset only contains one element, avoiding sending a COUNT query
-        try:
-            self[1]
-            raise list(self.query.models)[0].MultipleObjectsReturned('Multiple objects found')
-        except IndexError:
-            pass
+        results = self._fetch(2)
 
-        try:
-            obj = self[0]
-        except IndexError:
+        if len(results) > 1:
+            raise list(self.query.models)[0].MultipleObjectsReturned("Multiple objects found")
+
+        if not results:
             raise list(self.query.models)[0].DoesNotExist
 
-        return obj
+        return results[0]
+
+    def first(self):
+        """
+        Returns the first result of the query, or None if there are no
+        results. Only one result is requested to the backend.
+        """
+        results = self._fetch(1)
+        return results[0] if results else None
+
+    def exists(self):
+        """
+        Returns True if the query has any result, without loading them (`rows=0`
+        in Solr, `LIMIT 1` of the primary key in DSE).
+        """
+        if self._result_count is not None:
+            return self._result_count > 0
+
+        return self.query._clone().has_results()
+
+    def _fetch(self, rows):
+        """
+        Runs the query once for the first `rows` results, without counting the
+        hits or filling the result cache of the queryset.
+        """
+        clone = self._clone()
+        clone.query.set_limits(0, rows)
+        return clone.post_process_results(clone.query.get_results())
+
+    async def afetch(self, start=0, end=None):
+        """
+        Coroutine that runs the query for the results between `start` and
+        `end`, without filling the result cache of the queryset.
+        """
+        clone = self._clone()
+        clone.query.set_limits(start, end)
+        return clone.post_process_results(await clone.query.aget_results())
+
+    async def aget(self, *args, **kwargs):
+        """
+        Coroutine version of `get`.
+        """
+        if args or kwargs:
+            return await self.filter(*args, **kwargs).aget()
+
+        results = await self.afetch(0, 2)
+
+        if len(results) > 1:
+            raise list(self.query.models)[0].MultipleObjectsReturned("Multiple objects found")
+
+        if not results:
+            raise list(self.query.models)[0].DoesNotExist
+
+        return results[0]
+
+    async def afirst(self):
+        """
+        Coroutine version of `first`.
+        """
+        results = await self.afetch(0, 1)
+        return results[0] if results else None
+
+    async def acount(self):
+        """
+        Coroutine version of `count`.
+        """
+        if self._result_count is None:
+            self._result_count = await self.query._clone().aget_count()
+
+        return self._result_count
+
+    def federated_cursor(self, offsets):
+        """
+        Searches over several models (federated search) continue from the
+        given composite cursor, the number of results already consumed of
+        each model (`{"app_label.model_name": offset}`).
+        """
+        clone = self._clone()
+        clone.query.federated_offsets = offsets or {}
+        return clone
 
     def terms_json_facet(self, facet_name, field, facets, **kwargs):
         """Adds a terms json facet to a query for the provided field."""
@@ -112,6 +203,7 @@ class CaravaggioSearchQuerySet(SearchQuerySet):
         """
         qs = self._clone(klass=CaravaggioValuesSearchQuerySet)
         qs._fields.extend(fields)
+        qs.query.values_fields = tuple(qs._fields)
         return qs
 
     def values_list(self, *fields, **kwargs):
@@ -131,16 +223,81 @@ class CaravaggioSearchQuerySet(SearchQuerySet):
         qs = self._clone(klass=CaravaggioValuesListSearchQuerySet)
         qs._fields.extend(fields)
         qs._flat = flat
+        qs.query.values_fields = tuple(qs._fields)
         return qs
 
 
-class CaravaggioValuesListSearchQuerySet(ValuesListSearchQuerySet):
+class CaravaggioValuesListSearchQuerySet(CaravaggioSearchQuerySet, ValuesListSearchQuerySet):
+    """
+    The backends send only the requested fields in the `fl` (or in the CQL
+    projection with DSE) and return the values of every document as a
+    tuple, we do not build the `SearchResult` objects.
+    """
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._internal_fields = ["score"]
 
+    def post_process_results(self, results):
+        # Backends that do not know about `values_fields` return the
+        # SearchResult objects
+        if results and not isinstance(results[0], tuple):
+            return super().post_process_results(results)
 
-class CaravaggioValuesSearchQuerySet(ValuesSearchQuerySet):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._internal_fields = ["score"]
+        return self.post_process_values(results)
+
+    def post_process_values(self, results):
+        if self._flat:
+            return [values[0] for values in results]
+        return list(results)
+
+    def iterator(self, batch_size=DEFAULT_ITERATOR_BATCH_SIZE):
+        """
+        Iterates over all the results of the query without keeping them in
+        memory. The results are requested in batches of `batch_size`
+        documents using the paginator of the backend (cursorMark in Solr,
+        paging state of the driver in DSE) instead of offsets.
+
+        .. code-block:: python
+
+            for company_id in CaravaggioSearchQuerySet().models(Company).values_list("_id", flat=True).iterator():
+                ...
+        """
+        clone = self._clone()
+        query_string = clone.query.build_query()
+        search_kwargs = clone.query.build_params()
+        search_kwargs.pop("start_offset", None)
+        search_kwargs.pop("end_offset", None)
+
+        paginator = CaravaggioSearchPaginator(
+            query_string=query_string, using=clone.query._using, limit=batch_size, max_limit=batch_size, **search_kwargs
+        ).models(*clone.query.models)
+
+        # The cursors of Solr need a sort that includes the unique key
+        if isinstance(paginator.implementation, SolrSearchPaginator) and "sort_by" not in search_kwargs:
+            model = list(clone.query.models)[0]
+            paginator.implementation.search_kwargs["sort_by"] = ", ".join(
+                "{} asc".format(name) for name in model._primary_keys.keys()
+            )
+
+        while paginator.has_next():
+            paginator.next()
+            for values in self.post_process_results(paginator.get_results()):
+                yield values
+
+
+class CaravaggioValuesSearchQuerySet(CaravaggioValuesListSearchQuerySet):
+    """
+    A `CaravaggioValuesListSearchQuerySet` that returns a dictionary for
+    every result, like Django's `values()`.
+    """
+
+    def post_process_results(self, results):
+        if results and not isinstance(results[0], tuple):
+            return [dict((i, getattr(result, i, None)) for i in self._fields) for result in results]
+
+        return self.post_process_values(results)
+
+    def post_process_values(self, results):
+        fields = self._fields
+        return [dict(zip(fields, values)) for values in results]
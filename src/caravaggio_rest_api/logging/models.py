@@ -100,6 +100,7 @@ class ApiAccess(CustomDjangoCassandraModel):
     """
 
     run_time = columns.Integer(required=True)
+    """ The time (milliseconds) the server spent processing the request """
 
     latitude = columns.Float()
     longitude = columns.Float()
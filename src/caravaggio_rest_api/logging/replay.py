@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+Replay of the traffic recorded in the access log (`ApiAccess`) against a
+target instance of the API, see the `replay_api_access` command.
+
+The requests of a time window are exported as JSON lines (one request per
+line, in the order they were received) and sent again keeping their
+relative times, divided by `speed` (time compression), with at most
+`concurrency` requests in flight. The latencies are reported by path
+template (`/companies/company/{_id}/`) next to the `run_time` recorded for
+the same requests.
+
+Only the bodies of the requests of the replayed methods are exported, without
+the bodies of the credential endpoints (`REDACTED_PATHS`) and with the
+credential fields (`REDACTED_FIELDS`) redacted.
+"""
+import base64
+import json
+import logging
+import re
+import threading
+
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from time import perf_counter, sleep
+from urllib.parse import parse_qsl, urlencode
+
+import requests
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from rest_framework.authtoken.models import Token
+
+from caravaggio_rest_api.logging.models import ApiAccess
+from caravaggio_rest_api.utils import summarize
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SPEED = 1.0
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 30
+DEFAULT_METHODS = ("GET", "HEAD")
+
+# Upper bounds (milliseconds) of the buckets of the latency histograms
+HISTOGRAM_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# The requests to these paths are exported without body (obtain a token,
+# login, change the password...)
+REDACTED_PATHS = (r"^/api-token-auth/", r"^/admin-token-auth/", r"^/api-auth/", r"password")
+REDACTED_PATHS_REGEX = re.compile("|".join(REDACTED_PATHS))
+
+# The values of the fields of the bodies whose name contains any of these
+# words are redacted
+REDACTED_FIELDS = ("password", "token", "secret")
+REDACTED_FIELDS_REGEX = re.compile("|".join(REDACTED_FIELDS), re.IGNORECASE)
+REDACTED_VALUE = "[REDACTED]"
+
+# The segments of the paths that look like identifiers (numbers, UUIDs)
+ID_SEGMENT_REGEX = re.compile(r"^(\d+|[0-9a-fA-F]{8}(-?[0-9a-fA-F]{4}){3}-?[0-9a-fA-F]{12})$")
+
+
+def get_year_months(start, end):
+    """
+    The partitions (`year_month`) of the access log between two dates.
+    """
+    year_months = []
+    current = datetime(start.year, start.month, 1)
+    while current <= end:
+        year_months.append(current.strftime("%Y%m"))
+        current = (current + timedelta(days=32)).replace(day=1)
+    return year_months
+
+
+def to_timestamp(value):
+    """
+    The POSIX timestamp of a datetime, the naive datetimes are in UTC (as
+    the dates returned by the driver).
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def remove_auth_token(path):
+    """
+    The path without the authentication token of the query string
+    (`QUERY_STRING_AUTH_TOKEN`), the tokens are not exported and the
+    replayed requests are authenticated by `TokenSubstitution`.
+    """
+    name = settings.REST_FRAMEWORK.get("QUERY_STRING_AUTH_TOKEN", None)
+    base_path, _, query_string = path.partition("?")
+    params = parse_qsl(query_string, keep_blank_values=True)
+    if not name or all(key != name for key, _ in params):
+        return path
+
+    params = [(key, value) for key, value in params if key != name]
+    return "{0}?{1}".format(base_path, urlencode(params)) if params else base_path
+
+
+def redact_value(value):
+    """
+    The value (decoded JSON) with the values of the credential fields
+    (`REDACTED_FIELDS`) replaced by `REDACTED_VALUE`.
+    """
+    if isinstance(value, dict):
+        return OrderedDict(
+            (key, REDACTED_VALUE if REDACTED_FIELDS_REGEX.search(str(key)) else redact_value(item))
+            for key, item in value.items()
+        )
+    elif isinstance(value, list):
+        return [redact_value(item) for item in value]
+    return value
+
+
+def redact_body(body):
+    """
+    The body of a request without the credentials: with the credential
+    fields redacted for the JSON bodies, and empty for the other bodies with
+    credential fields (ex. forms).
+    """
+    try:
+        value = json.loads(body, object_pairs_hook=OrderedDict)
+    except ValueError:
+        return "" if REDACTED_FIELDS_REGEX.search(body) else body
+
+    redacted_value = redact_value(value)
+    return body if redacted_value == value else json.dumps(redacted_value)
+
+
+def to_record(access, methods=DEFAULT_METHODS):
+    """
+    The exported representation of an access: the request, the user and
+    the recorded status and run time (milliseconds). The body is only
+    exported for the requests of the replayed `methods` that are not sent
+    to the credential endpoints (`REDACTED_PATHS`), without the credentials
+    (see `redact_body`).
+    """
+    record = OrderedDict(
+        [
+            ("id", str(access.id)),
+            ("timestamp", access.time_ms),
+            ("user", str(access.user) if access.user else None),
+            ("method", access.request_method),
+            ("path", remove_auth_token(access.request_path)),
+            ("status", access.response_status),
+            ("run_time", access.run_time),
+        ]
+    )
+
+    # `time_ms` has a resolution of seconds, the creation date gives us the
+    # order of the requests received in the same second
+    if access.created_at is not None:
+        record["timestamp"] = to_timestamp(access.created_at) - (access.run_time or 0) / 1000.0
+
+    record["body"] = ""
+    body = access.request_body or b""
+    if (
+        not body
+        or access.request_method.upper() not in set(method.upper() for method in methods)
+        or REDACTED_PATHS_REGEX.search(record["path"].split("?", 1)[0])
+    ):
+        return record
+
+    try:
+        record["body"] = redact_body(body.decode("utf-8"))
+    except UnicodeDecodeError:
+        record["body"] = base64.b64encode(body).decode("ascii")
+        record["body_encoding"] = "base64"
+    return record
+
+
+def export_window(start, end, methods=DEFAULT_METHODS):
+    """
+    The records of the requests received between `start` (included) and
+    `end` (excluded), naive UTC datetimes, sorted by time. Only the bodies
+    of the requests of the replayed `methods` are exported.
+    """
+    start_time, end_time = int(to_timestamp(start)), int(to_timestamp(end))
+
+    records = []
+    for year_month in get_year_months(start, end):
+        accesses = ApiAccess.objects.filter(year_month=year_month, time_ms__gte=start_time, time_ms__lt=end_time)
+        records.extend(to_record(access, methods=methods) for access in accesses)
+
+    records.sort(key=lambda record: record["timestamp"])
+    return records
+
+
+def write_records(records, path):
+    with open(path, "w", encoding="utf-8") as records_file:
+        for record in records:
+            records_file.write(json.dumps(record))
+            records_file.write("\n")
+
+
+def read_records(path):
+    with open(path, "r", encoding="utf-8") as records_file:
+        return [json.loads(line) for line in records_file if line.strip()]
+
+
+def get_body(record):
+    if record.get("body_encoding", None) == "base64":
+        return base64.b64decode(record["body"])
+    return record.get("body", "").encode("utf-8")
+
+
+def get_path_template(path):
+    """
+    The path without the query string and with the identifiers replaced by
+    the name of their URL parameter, ex. `/companies/company/{_id}/`. The
+    segments of the paths we cannot resolve that look like identifiers
+    (numbers, UUIDs) are replaced by `{id}`.
+    """
+    path = path.split("?", 1)[0]
+
+    try:
+        kwargs = {str(value): name for name, value in resolve(path).kwargs.items()}
+    except Resolver404:
+        kwargs = {}
+
+    segments = []
+    for segment in path.split("/"):
+        if segment in kwargs:
+            segment = "{{{0}}}".format(kwargs[segment])
+        elif ID_SEGMENT_REGEX.match(segment):
+            segment = "{id}"
+        segments.append(segment)
+    return "/".join(segments)
+
+
+def is_allowed_target(target):
+    """
+    If the tokens of the users of our database can be sent to the target,
+    its base URL has to be in `REPLAY_ALLOWED_TARGETS`.
+    """
+    allowed_targets = getattr(settings, "REPLAY_ALLOWED_TARGETS", [])
+    return target.rstrip("/") in set(allowed_target.strip().rstrip("/") for allowed_target in allowed_targets)
+
+
+def histogram(values):
+    """
+    The number of latencies (milliseconds) in each bucket of
+    `HISTOGRAM_BUCKETS`, the key of a bucket is its upper bound.
+    """
+    counts = OrderedDict(("<={0}".format(bucket), 0) for bucket in HISTOGRAM_BUCKETS)
+    counts[">{0}".format(HISTOGRAM_BUCKETS[-1])] = 0
+    for value in values:
+        for bucket in HISTOGRAM_BUCKETS:
+            if value <= bucket:
+                counts["<={0}".format(bucket)] += 1
+                break
+        else:
+            counts[">{0}".format(HISTOGRAM_BUCKETS[-1])] += 1
+    return counts
+
+
+class TokenSubstitution(object):
+    """
+    The token sent with the replayed requests of every recorded user: the
+    token of the user in `user_tokens` (recorded user id: token), the token
+    of the user in our database if `recorded_tokens` (the target shares the
+    users with us and is in `REPLAY_ALLOWED_TARGETS`), or the
+    `default_token`. The requests without token are sent without
+    authentication.
+    """
+
+    def __init__(self, default_token=None, user_tokens=None, recorded_tokens=False):
+        self.default_token = default_token
+        self.user_tokens = dict(user_tokens or {})
+        self.recorded_tokens = recorded_tokens
+        self._lock = threading.Lock()
+
+    def get_token(self, user):
+        if self.recorded_tokens and user and user not in self.user_tokens:
+            with self._lock:
+                if user not in self.user_tokens:
+                    self.user_tokens[user] = Token.objects.filter(user_id=user).values_list("key", flat=True).first()
+
+        return self.user_tokens.get(user, None) or self.default_token
+
+
+class TrafficReplayer(object):
+    """
+    Sends the recorded requests to the `target` (the base URL of the
+    instance). The requests are scheduled at their recorded time divided by
+    `speed` (0 sends them as fast as possible) and sent by `concurrency`
+    threads. When all the threads are busy the requests wait, the delay
+    with their scheduled time is reported as the `lag`.
+
+    The tokens of the recorded users (`recorded_tokens`) are only sent to
+    the allowed targets (see `is_allowed_target`).
+    """
+
+    def __init__(
+        self,
+        target,
+        speed=DEFAULT_SPEED,
+        concurrency=DEFAULT_CONCURRENCY,
+        tokens=None,
+        timeout=DEFAULT_TIMEOUT,
+        methods=DEFAULT_METHODS,
+    ):
+        self.target = target.rstrip("/")
+        self.tokens = tokens or TokenSubstitution()
+        if self.tokens.recorded_tokens and not is_allowed_target(self.target):
+            raise ValueError(
+                "The tokens of the recorded users cannot be sent to {0}, it is not in the "
+                "REPLAY_ALLOWED_TARGETS".format(self.target)
+            )
+
+        self.speed = speed
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.methods = set(method.upper() for method in methods)
+
+        self._local = threading.local()
+
+    def get_session(self):
+        # A session (and its pool of connections) for every thread
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def send(self, record, lag):
+        headers = {}
+        token = self.tokens.get_token(record.get("user", None))
+        if token:
+            headers["Authorization"] = "Token {0}".format(token)
+
+        body = get_body(record)
+        if body:
+            headers["Content-Type"] = "application/json"
+
+        result = {
+            "template": get_path_template(record["path"]),
+            "method": record["method"],
+            "recorded_status": record.get("status", None),
+            "recorded": record.get("run_time", None),
+            "lag": lag * 1000,
+            "status": None,
+            "error": None,
+        }
+
+        start = perf_counter()
+        try:
+            response = self.get_session().request(
+                record["method"],
+                "{0}{1}".format(self.target, record["path"]),
+                data=body or None,
+                headers=headers,
+                timeout=self.timeout,
+                allow_redirects=False,
+            )
+            result["status"] = response.status_code
+        except requests.RequestException as ex:
+            result["error"] = "{0}: {1}".format(type(ex).__name__, ex)
+        result["latency"] = (perf_counter() - start) * 1000
+        return result
+
+    def replay(self, records):
+        """
+        Replays the records (sorted by time) and returns the result of every
+        request.
+        """
+        records = [record for record in records if record["method"].upper() in self.methods]
+        if not records:
+            return []
+
+        slots = threading.BoundedSemaphore(self.concurrency)
+
+        def send(record, lag):
+            try:
+                return self.send(record, lag)
+            finally:
+                slots.release()
+
+        futures = []
+        first_timestamp = records[0]["timestamp"]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            start = perf_counter()
+            for record in records:
+                scheduled = (record["timestamp"] - first_timestamp) / self.speed if self.speed else 0
+                wait = scheduled - (perf_counter() - start)
+                if wait > 0:
+                    sleep(wait)
+
+                slots.acquire()
+                futures.append(executor.submit(send, record, max(0, perf_counter() - start - scheduled)))
+
+        return [future.result() for future in futures]
+
+
+def build_report(results):
+    """
+    The latencies (milliseconds) of the replayed requests by path template,
+    next to the latencies recorded in the access log for the same requests.
+    """
+    templates = OrderedDict()
+    for result in results:
+        templates.setdefault((result["method"], result["template"]), []).append(result)
+
+    report = OrderedDict()
+    for (method, template), template_results in sorted(templates.items(), key=lambda item: -len(item[1])):
+        replayed = [result["latency"] for result in template_results if result["error"] is None]
+        recorded = [result["recorded"] for result in template_results if result["recorded"] is not None]
+        report["{0} {1}".format(method, template)] = OrderedDict(
+            [
+                ("requests", len(template_results)),
+                ("errors", len(template_results) - len(replayed)),
+                ("status_codes", dict(Counter(str(result["status"]) for result in template_results))),
+                (
+                    "status_changes",
+                    sum(
+                        1
+                        for result in template_results
+                        if result["status"] is not None and result["status"] != result["recorded_status"]
+                    ),
+                ),
+                ("recorded", OrderedDict([("latency", summarize(recorded)), ("histogram", histogram(recorded))])),
+                ("replayed", OrderedDict([("latency", summarize(replayed)), ("histogram", histogram(replayed))])),
+                ("lag", summarize([result["lag"] for result in template_results])),
+            ]
+        )
+    return report
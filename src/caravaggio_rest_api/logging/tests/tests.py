@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+import logging
+import threading
+import time
+import uuid
+
+from datetime import datetime
+
+from rest_framework.authtoken.models import Token
+
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+
+from caravaggio_rest_api.logging import replay
+from caravaggio_rest_api.logging.models import ApiAccess
+
+_logger = logging.getLogger()
+
+
+def get_record(path, timestamp, method="GET", user=None):
+    return {
+        "id": str(uuid.uuid4()),
+        "timestamp": timestamp,
+        "user": user,
+        "method": method,
+        "path": path,
+        "status": 200,
+        "run_time": 10,
+        "body": "",
+    }
+
+
+class ReplayTest(CaravaggioBaseTest):
+    """ Test module for the replay of the access log """
+
+    def step01_to_record(self):
+        company_id = uuid.uuid4()
+        access = ApiAccess(
+            year_month="202010",
+            time_ms=1603000000,
+            user=uuid.uuid4(),
+            created_at=datetime(2020, 10, 18, 5, 46, 40, 500000),
+            request_method="GET",
+            request_path="/companies/company/{0}/?auth_token=secret&fields=name&fields=_id".format(company_id),
+            request_body=b"",
+            response_status=200,
+            run_time=250,
+        )
+
+        record = replay.to_record(access)
+        self.assertEqual(record["path"], "/companies/company/{0}/?fields=name&fields=_id".format(company_id))
+        self.assertEqual(record["timestamp"], 1603000000.25)
+        self.assertEqual(record["body"], "")
+
+        # The paths without the token are not changed
+        for path in ("/companies/company/", "/companies/company/search/?text=a%20b&limit=10"):
+            self.assertEqual(replay.remove_auth_token(path), path)
+        self.assertEqual(replay.remove_auth_token("/companies/company/?auth_token=secret"), "/companies/company/")
+
+        access.request_body = b"\xff\xfe"
+        record = replay.to_record(access)
+        self.assertEqual(record["body_encoding"], "base64")
+        self.assertEqual(replay.get_body(record), b"\xff\xfe")
+
+    def step02_get_path_template(self):
+        company_id = uuid.uuid4()
+        path = "/companies/company/{0}/?fields=name".format(company_id)
+        self.assertEqual(replay.get_path_template(path), "/companies/company/{pk}/")
+        self.assertEqual(replay.get_path_template("/companies/company/search/"), "/companies/company/search/")
+
+        # The paths we cannot resolve
+        path = "/unknown/{0}/items/42".format(company_id)
+        self.assertEqual(replay.get_path_template(path), "/unknown/{id}/items/{id}")
+        self.assertEqual(replay.get_path_template("/unknown/v2/items"), "/unknown/v2/items")
+
+    def step03_histogram(self):
+        counts = replay.histogram([0.5, 5, 5.1, 99, 10000, 10001, 25000])
+        self.assertEqual(list(counts.keys())[0], "<=5")
+        self.assertEqual(list(counts.keys())[-1], ">10000")
+        self.assertEqual(counts["<=5"], 2)
+        self.assertEqual(counts["<=10"], 1)
+        self.assertEqual(counts["<=100"], 1)
+        self.assertEqual(counts["<=10000"], 1)
+        self.assertEqual(counts[">10000"], 2)
+        self.assertEqual(sum(counts.values()), 7)
+
+        self.assertEqual(sum(replay.histogram([]).values()), 0)
+
+    def step04_token_substitution(self):
+        user_token = Token.objects.get(user=self.user).key
+        other_user = str(uuid.uuid4())
+
+        tokens = replay.TokenSubstitution(default_token="default", user_tokens={other_user: "other"})
+        self.assertEqual(tokens.get_token(other_user), "other")
+        self.assertEqual(tokens.get_token(str(self.user.id)), "default")
+        self.assertEqual(tokens.get_token(None), "default")
+
+        # The tokens of the users of our database
+        tokens = replay.TokenSubstitution(recorded_tokens=True)
+        self.assertEqual(tokens.get_token(str(self.user.id)), user_token)
+        self.assertIsNone(tokens.get_token(other_user))
+        self.assertIsNone(tokens.get_token(None))
+
+        tokens = replay.TokenSubstitution(default_token="default", recorded_tokens=True)
+        self.assertEqual(tokens.get_token(other_user), "default")
+
+    def step05_scheduler(self):
+        records = [
+            get_record("/companies/company/", 100.0),
+            get_record("/companies/company/", 100.0, method="POST"),
+            get_record("/companies/company/search/", 100.2),
+            get_record("/companies/company/", 100.4),
+        ]
+
+        sent = []
+        lock = threading.Lock()
+        start = time.monotonic()
+
+        def send(record, lag):
+            with lock:
+                sent.append((record["path"], time.monotonic() - start, lag))
+            return {"path": record["path"], "lag": lag}
+
+        # The relative times are divided by the speed
+        replayer = replay.TrafficReplayer("http://localhost:8001/", speed=2)
+        replayer.send = send
+        results = replayer.replay(records)
+
+        # The POST requests are not replayed by default
+        expected = [records[0]["path"], records[2]["path"], records[3]["path"]]
+        self.assertEqual([result["path"] for result in results], expected)
+        for (_, elapsed, lag), scheduled in zip(sent, (0, 0.1, 0.2)):
+            self.assertGreaterEqual(elapsed, scheduled)
+            self.assertLess(elapsed, scheduled + 0.08)
+            self.assertLess(lag, 0.05)
+
+        # Without free threads the requests wait and the lag is reported
+        def slow_send(record, lag):
+            time.sleep(0.2)
+            return {"path": record["path"], "lag": lag}
+
+        replayer = replay.TrafficReplayer("http://localhost:8001/", speed=0, concurrency=1)
+        replayer.send = slow_send
+        results = replayer.replay(records)
+        self.assertEqual(len(results), 3)
+        self.assertLess(results[0]["lag"], 0.05)
+        self.assertGreaterEqual(results[2]["lag"], 0.35)
+
+        self.assertEqual(replayer.replay([records[1]]), [])
+
+    def step06_redacted_bodies(self):
+        access = ApiAccess(
+            year_month="202010",
+            time_ms=1603000000,
+            user=uuid.uuid4(),
+            request_method="POST",
+            request_path="/companies/company/",
+            request_body=b'{"name": "Company", "short_description": "Description"}',
+            response_status=201,
+            run_time=250,
+        )
+
+        # Only the bodies of the replayed methods are exported
+        self.assertEqual(replay.to_record(access)["body"], "")
+        record = replay.to_record(access, methods=["GET", "post"])
+        self.assertEqual(record["body"], '{"name": "Company", "short_description": "Description"}')
+
+        # The values of the credential fields are redacted
+        access.request_path = "/users/user/"
+        access.request_body = b'{"username": "user", "password": "secret", "profile": [{"api_token": "abc"}]}'
+        record = replay.to_record(access, methods=["POST"])
+        self.assertEqual(
+            record["body"], '{"username": "user", "password": "[REDACTED]", "profile": [{"api_token": "[REDACTED]"}]}'
+        )
+
+        # The forms with credentials are not exported
+        access.request_body = b"username=user&password=secret"
+        self.assertEqual(replay.to_record(access, methods=["POST"])["body"], "")
+        access.request_body = b"name=Company"
+        self.assertEqual(replay.to_record(access, methods=["POST"])["body"], "name=Company")
+
+        # The bodies of the credential endpoints are not exported
+        for path in ("/api-token-auth/", "/admin-token-auth/", "/api-auth/login/", "/users/user/1/set_password/"):
+            access.request_path = path
+            for body in (b'{"username": "user"}', b"\xff\xfe"):
+                access.request_body = body
+                record = replay.to_record(access, methods=["POST"])
+                self.assertEqual(record["body"], "", path)
+                self.assertNotIn("body_encoding", record)
+
+    def step07_allowed_targets(self):
+        tokens = replay.TokenSubstitution(default_token="default", recorded_tokens=True)
+
+        # The tokens of our users are only sent to the allowed targets
+        with self.settings(REPLAY_ALLOWED_TARGETS=["http://staging:8001/"]):
+            self.assertTrue(replay.is_allowed_target("http://staging:8001"))
+            self.assertFalse(replay.is_allowed_target("http://other:8001"))
+
+            replay.TrafficReplayer("http://staging:8001/", tokens=tokens)
+            with self.assertRaises(ValueError):
+                replay.TrafficReplayer("http://other:8001/", tokens=tokens)
+
+            replay.TrafficReplayer("http://other:8001/", tokens=replay.TokenSubstitution(default_token="default"))
+
+        with self.settings(REPLAY_ALLOWED_TARGETS=[]):
+            with self.assertRaises(ValueError):
+                replay.TrafficReplayer("http://staging:8001/", tokens=tokens)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+import json
+import logging
+
+from datetime import timezone
+
+from dateutil import parser as date_parser
+from django.core.management.base import BaseCommand, CommandError
+
+from caravaggio_rest_api.logging import replay
+
+_logger = logging.getLogger(__name__)
+
+
+def parse_date(value):
+    """
+    A naive UTC datetime from an ISO date (the dates with timezone are
+    converted to UTC).
+    """
+    try:
+        date = date_parser.parse(value)
+    except (ValueError, OverflowError):
+        raise CommandError("Invalid date: {}".format(value))
+
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports the requests of a time window of the access log (ApiAccess) and replays them against a target "
+        "instance, reporting the latencies by path template next to the recorded run times."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="Start of the time window (ISO date, UTC if no timezone).")
+        parser.add_argument("--end", help="End (excluded) of the time window (ISO date, UTC if no timezone).")
+        parser.add_argument(
+            "--input", dest="input", default=None, help="Replay the requests of a previous export instead."
+        )
+        parser.add_argument(
+            "--export", dest="export", default=None, help="Write the requests of the window to this file (JSON lines)."
+        )
+        parser.add_argument(
+            "--target", default=None, help="Base URL of the instance to replay the requests against.",
+        )
+        parser.add_argument(
+            "--speed",
+            type=float,
+            default=replay.DEFAULT_SPEED,
+            help="Time compression, ex. 10 replays one hour in six minutes. 0 sends the requests without waiting.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=replay.DEFAULT_CONCURRENCY,
+            help="Maximum number of requests in flight.",
+        )
+        parser.add_argument("--token", default=None, help="Token of the requests of the users without token.")
+        parser.add_argument(
+            "--user-tokens",
+            dest="user_tokens",
+            default=None,
+            help="JSON file with the token to use for each recorded user id.",
+        )
+        parser.add_argument(
+            "--recorded-tokens",
+            dest="recorded_tokens",
+            action="store_true",
+            default=False,
+            help="Use the tokens of the recorded users in our database (the target shares the users with us and is in "
+            "the REPLAY_ALLOWED_TARGETS).",
+        )
+        parser.add_argument(
+            "--methods",
+            default=",".join(replay.DEFAULT_METHODS),
+            help="Comma separated HTTP methods to replay, only their bodies are exported. Only the reads by default.",
+        )
+        parser.add_argument(
+            "--timeout", type=float, default=replay.DEFAULT_TIMEOUT, help="Timeout (seconds) of every request."
+        )
+        parser.add_argument("--output", default=None, help="Write the JSON report to this file.")
+
+    def handle(self, **options):
+        methods = [method.strip() for method in options["methods"].split(",") if method.strip()]
+
+        if options["input"]:
+            records = replay.read_records(options["input"])
+        elif options["start"] and options["end"]:
+            records = replay.export_window(parse_date(options["start"]), parse_date(options["end"]), methods=methods)
+        else:
+            raise CommandError("Please inform the time window (--start and --end) or a previous export (--input)")
+
+        self.stdout.write("{} requests in the window".format(len(records)))
+
+        if options["export"]:
+            replay.write_records(records, options["export"])
+            self.stdout.write("Requests exported to {}".format(options["export"]))
+
+        if not options["target"]:
+            if not options["export"]:
+                raise CommandError("Please inform the --target to replay the requests or the --export file")
+            return
+
+        if options["concurrency"] < 1 or options["speed"] < 0:
+            raise CommandError("The concurrency must be positive and the speed cannot be negative")
+
+        user_tokens = None
+        if options["user_tokens"]:
+            with open(options["user_tokens"], "r", encoding="utf-8") as tokens_file:
+                user_tokens = json.load(tokens_file)
+
+        try:
+            replayer = replay.TrafficReplayer(
+                options["target"],
+                speed=options["speed"],
+                concurrency=options["concurrency"],
+                tokens=replay.TokenSubstitution(
+                    default_token=options["token"], user_tokens=user_tokens, recorded_tokens=options["recorded_tokens"]
+                ),
+                timeout=options["timeout"],
+                methods=methods,
+            )
+        except ValueError as ex:
+            raise CommandError(str(ex))
+        results = replayer.replay(records)
+        report = replay.build_report(results)
+
+        self.write_report(report)
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as report_file:
+                json.dump(report, report_file, indent=2)
+            self.stdout.write("Report written to {}".format(options["output"]))
+
+    def write_report(self, report):
+        for template, stats in report.items():
+            self.stdout.write(
+                "\n{} - {} requests, {} errors, {} status changes, status codes {}".format(
+                    template, stats["requests"], stats["errors"], stats["status_changes"], stats["status_codes"]
+                )
+            )
+
+            for name in ("recorded", "replayed"):
+                latency = stats[name]["latency"]
+                if latency is None:
+                    self.stdout.write("  {:<9} -".format(name))
+                    continue
+
+                self.stdout.write(
+                    "  {:<9} p50 {:>9.1f}ms  p95 {:>9.1f}ms  p99 {:>9.1f}ms  max {:>9.1f}ms".format(
+                        name, latency["p50"], latency["p95"], latency["p99"], latency["max"]
+                    )
+                )
+                buckets = [
+                    "{}: {}".format(bucket, count) for bucket, count in stats[name]["histogram"].items() if count
+                ]
+                self.stdout.write("  {:<9} {}".format("", "  ".join(buckets)))
@@ -3,8 +3,11 @@
 # All rights reserved.
 import inspect
 import logging
+import re
+from xml.etree import ElementTree
 
 from caravaggio_rest_api.haystack.indexes import TextField
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.db import connections
 from django_cassandra_engine.utils import get_engine_from_db_alias
@@ -28,6 +31,19 @@ from caravaggio_rest_api.haystack.indexes import TextField
 
 _logger = logging.getLogger(__name__)
 
+# Shortcut options accepted by ALTER SEARCH INDEX CONFIG and the element path
+# in the solrconfig.xml where DSE persists them. We need the path to be able
+# to compare the desired value with the current configuration of the index.
+SEARCH_CONFIG_SHORTCUTS = {
+    "autoCommitTime": "updateHandler.autoSoftCommit.maxTime",
+    "ramBufferSize": "indexConfig.ramBufferSizeMB",
+    "realtime": "indexConfig.rt",
+    "filterCacheLowWaterMark": "query.filterCache@lowWaterMarkMB",
+    "filterCacheHighWaterMark": "query.filterCache@highWaterMarkMB",
+    "mergeMaxThreadCount": "indexConfig.mergeScheduler.int[@name='maxThreadCount']",
+    "mergeMaxMergeCount": "indexConfig.mergeScheduler.int[@name='maxMergeCount']",
+}
+
 
 TEXT_SEARCH_JSON_SNIPPED = """
 $${
@@ -227,7 +243,7 @@ def _process_field(
         pass
 
 
-def create_index(model, index, keyspaces=None, connections=None):
+def create_index(model, index, keyspaces=None, connections=None, config_only=False, dry_run=False):
     """
     Creates a new Search Index for the table indicated by the model,
     if it not exists.
@@ -249,12 +265,23 @@ def create_index(model, index, keyspaces=None, connections=None):
 
     *There are plans to guard schema-modifying functions with an
     environment-driven conditional.*
+
+    If `config_only` is True, only the search index config (see
+    `get_search_config`) is synchronized. With `dry_run` the config changes
+    are only reported, not applied.
+
+    Returns the list of search config options that have not the expected
+    value once the index has been synchronized.
     """
 
+    mismatches = []
     context = management._get_context(keyspaces, connections)
     for connection, keyspace in context:
         with query.ContextQuery(model, keyspace=keyspace) as m:
-            _create_index(m, index, connection=connection)
+            mismatches.extend(
+                _create_index(m, index, connection=connection, config_only=config_only, dry_run=dry_run) or []
+            )
+    return mismatches
 
 
 def _find_udt_attribute(model, field_name):
@@ -354,10 +381,173 @@ def _get_solr_type(model, index, search_field):
         raise ex
 
 
+def get_search_config(model, index):
+    """
+    Returns the declarative configuration (solrconfig.xml) of the search
+    index associated to the model.
+
+    The options are taken, in order of precedence, from:
+
+    - `settings.SEARCH_INDEX_CONFIG[<app_label>.<model_name>]`
+    - The `search_config` attribute of the `Meta` class of the index
+    - The `index_settings` attribute of the `Meta` class of the index
+        (legacy)
+
+    The keys are the shortcuts accepted by `ALTER SEARCH INDEX CONFIG`
+    (ex. `autoCommitTime`) or an element path of the solrconfig.xml
+    (ex. `query.queryResultCache@size`).
+    """
+    search_config = {}
+    search_config.update(getattr(index.Meta, "index_settings", {}))
+    search_config.update(getattr(index.Meta, "search_config", {}))
+    search_config.update(getattr(settings, "SEARCH_INDEX_CONFIG", {}).get(model._meta.label_lower, {}))
+    return search_config
+
+
+def _config_element_path(option):
+    """
+    Translates a search config option into the XPath of the element that
+    holds its value in the solrconfig.xml, and the attribute of the element
+    that contains the value, if any.
+
+    Returns (None, None) if the option is a shortcut we don't know how to
+    locate in the configuration.
+    """
+    element_path = SEARCH_CONFIG_SHORTCUTS.get(option, option)
+    if "." not in element_path and "@" not in element_path:
+        return None, None
+
+    segments = re.findall(r"[^.\[]+(?:\[[^\]]*\][^.\[]*)*", element_path)
+    last_segment = re.match(r"^(?P<tag>[^@\[]+(?:\[[^\]]*\])*)(?:@(?P<attr>\w+))?$", segments[-1])
+    if not last_segment:
+        return None, None
+
+    return "/".join(segments[:-1] + [last_segment.group("tag")]), last_segment.group("attr")
+
+
+def _config_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value).strip().strip("'\"")
+
+
+def _cql_config_value(value):
+    value = _config_value(value)
+    if value.lower() in ("true", "false") or re.match(r"^-?\d+(\.\d+)?$", value):
+        return value
+    return "'{}'".format(value)
+
+
+def _describe_search_config(ks_name, raw_cf_name, active=False):
+    rows = execute(
+        "DESCRIBE {0} SEARCH INDEX CONFIG ON {1}.{2};".format("ACTIVE" if active else "PENDING", ks_name, raw_cf_name)
+    )
+    row = rows.one()
+    xml = list(row.values())[0] if isinstance(row, dict) else row[0]
+    return ElementTree.fromstring(xml)
+
+
+def _get_config_value(config, option):
+    if config is None:
+        return None
+
+    xpath, attribute = _config_element_path(option)
+    if xpath is None:
+        return None
+
+    element = config.find(xpath)
+    if element is None:
+        return None
+
+    value = element.get(attribute) if attribute else element.text
+    return value.strip() if value is not None else None
+
+
+def _diff_search_config(config, search_config):
+    """
+    Returns the options of `search_config` that have a different value in
+    the current `config` of the index, as a dict of
+    option -> (current value, desired value).
+
+    The options we don't know how to locate in the solrconfig.xml (ex.
+    `directoryFactory`) cannot be compared, they are always returned (with
+    None as current value) to be applied on every run.
+    """
+    changes = {}
+    for option, value in search_config.items():
+        current_value = _get_config_value(config, option)
+        if current_value is None or current_value.lower() != _config_value(value).lower():
+            changes[option] = (current_value, value)
+    return changes
+
+
+def _sync_search_config(ks_name, raw_cf_name, search_config, dry_run=False):
+    """
+    Applies the `search_config` to the search index using
+    `ALTER SEARCH INDEX CONFIG`, only for the options that differ from the
+    pending configuration of the index.
+
+    Once the changes are applied the index is reloaded and we verify that
+    the active configuration contains the expected values.
+
+    Returns the list of options that didn't pass the verification.
+    """
+    if not search_config:
+        return []
+
+    try:
+        current_config = _describe_search_config(ks_name, raw_cf_name)
+    except Exception as ex:
+        _logger.warning(
+            "Unable to read the search index config of {0}.{1}. Cause: {2}".format(ks_name, raw_cf_name, ex)
+        )
+        current_config = None
+
+    changes = _diff_search_config(current_config, search_config)
+    if not changes:
+        _logger.info("The search index config of {0}.{1} is up to date".format(ks_name, raw_cf_name))
+        return []
+
+    for option, (current_value, value) in changes.items():
+        _logger.info(
+            "{0}Search index config {1}.{2}: {3} = {4} (current: {5})".format(
+                "[DRY RUN] " if dry_run else "", ks_name, raw_cf_name, option, value, current_value
+            )
+        )
+        if not dry_run:
+            execute(
+                "ALTER SEARCH INDEX CONFIG ON {0}.{1}"
+                " SET {2} = {3};".format(ks_name, raw_cf_name, option, _cql_config_value(value))
+            )
+
+    if dry_run:
+        return []
+
+    # Reload the index for the changes to take effect
+    execute("RELOAD SEARCH INDEX ON {0}.{1};".format(ks_name, raw_cf_name), timeout=30)
+
+    # Verify the active configuration, we can only verify the options we
+    # know how to locate in the solrconfig.xml
+    active_config = _describe_search_config(ks_name, raw_cf_name, active=True)
+    applied_config = {
+        option: value for option, (_, value) in changes.items() if _config_element_path(option)[0] is not None
+    }
+    mismatches = []
+    for option, (active_value, value) in _diff_search_config(active_config, applied_config).items():
+        _logger.error(
+            "Search index config {0}.{1}: {2} is {3} but {4} was expected".format(
+                ks_name, raw_cf_name, option, active_value, value
+            )
+        )
+        mismatches.append("{0}.{1}: {2}".format(ks_name, raw_cf_name, option))
+
+    return mismatches
+
+
 # def _extra_create_search_index_params(model, exclude_fields):
 
 
-def _create_index(model, index, connection=None):
+def _create_index(model, index, connection=None, config_only=False, dry_run=False):
     if not management._allow_schema_modification():
         return
 
@@ -369,6 +559,9 @@ def _create_index(model, index, connection=None):
     ks_name = model._get_keyspace()
     raw_cf_name = model._raw_column_family_name()
 
+    if config_only or dry_run:
+        return _sync_search_config(ks_name, raw_cf_name, get_search_config(model, index), dry_run=dry_run)
+
     try:
         _logger.info("Creating SEARCH INDEX if not exists for model: {}".format(model))
 
@@ -389,13 +582,6 @@ def _create_index(model, index, connection=None):
             "CREATE SEARCH INDEX IF NOT EXISTS ON {0}.{1}{2};".format(ks_name, raw_cf_name, extra_params), timeout=30.0
         )
 
-        if hasattr(index.Meta, "index_settings"):
-            for param, value in index.Meta.index_settings.items():
-                _logger.info("Setting index parameters: {0} = {1}".format(param, value))
-                execute(
-                    "ALTER SEARCH INDEX CONFIG ON {0}.{1}" " SET {2} = {3};".format(ks_name, raw_cf_name, param, value)
-                )
-
         _define_types(ks_name, raw_cf_name)
 
         search_fields = [
@@ -559,12 +745,15 @@ def _create_index(model, index, connection=None):
         # Reload the index for the changes to take effect
         execute("RELOAD SEARCH INDEX ON {0}.{1};".format(ks_name, raw_cf_name), timeout=30)
 
+        # Apply the performance settings (caches, commits, buffers, etc.)
+        return _sync_search_config(ks_name, raw_cf_name, get_search_config(model, index))
+
     except KeyError:
         _logger.exception("Unable to create the search index")
         pass
 
 
-def sync(alias, only_model=None):
+def sync(alias, only_model=None, config_only=False, dry_run=False):
     engine = get_engine_from_db_alias(alias)
 
     if engine != "django_cassandra_engine":
@@ -581,6 +770,7 @@ def sync(alias, only_model=None):
 
     indexes_by_model = UnifiedIndex().get_indexes()
 
+    mismatches = []
     for app_name, app_models in connection.introspection.cql_models.items():
         for model in app_models:
             # If the app model is registered as a SearchIndex
@@ -593,7 +783,11 @@ def sync(alias, only_model=None):
                             app_name, indexes_by_model.get(model).__class__.__name__
                         )
                     )
-                    create_index(model, indexes_by_model.get(model))
+                    mismatches.extend(
+                        create_index(model, indexes_by_model.get(model), config_only=config_only, dry_run=dry_run)
+                    )
+
+    return mismatches
 
 
 class Command(BaseCommand):
@@ -610,21 +804,42 @@ class Command(BaseCommand):
             default=None,
             help="The name of the model class we" " want to generate the indexes.",
         )
+        parser.add_argument(
+            "--config-only",
+            action="store_true",
+            dest="config_only",
+            default=False,
+            help="Only synchronize the search index config (caches, commits, buffers, etc.), not the schema.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            dest="dry_run",
+            default=False,
+            help="Report the search index config changes without applying them. Implies --config-only.",
+        )
 
     def handle(self, **options):
 
         model = options.get("model")
+        config_only = options.get("config_only")
+        dry_run = options.get("dry_run")
+
+        mismatches = []
 
         database = options.get("database")
         if database is not None:
-            return sync(database, model)
-
-        cassandra_alias = None
-        for alias in connections:
-            engine = get_engine_from_db_alias(alias)
-            if engine == "django_cassandra_engine":
-                sync(alias, model)
-                cassandra_alias = alias
-
-        if cassandra_alias is None:
-            raise CommandError("Please add django_cassandra_engine backend to DATABASES!")
+            mismatches.extend(sync(database, model, config_only=config_only, dry_run=dry_run))
+        else:
+            cassandra_alias = None
+            for alias in connections:
+                engine = get_engine_from_db_alias(alias)
+                if engine == "django_cassandra_engine":
+                    mismatches.extend(sync(alias, model, config_only=config_only, dry_run=dry_run))
+                    cassandra_alias = alias
+
+            if cassandra_alias is None:
+                raise CommandError("Please add django_cassandra_engine backend to DATABASES!")
+
+        if mismatches:
+            raise CommandError("The search index config verification failed for: {}".format(", ".join(mismatches)))
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+# This software is proprietary and confidential and may not under
+# any circumstances be used, copied, or distributed.
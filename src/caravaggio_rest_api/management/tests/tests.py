@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+import logging
+
+from unittest import mock
+from xml.etree import ElementTree
+
+from caravaggio_rest_api.tests import CaravaggioBaseTest
+
+from caravaggio_rest_api.management.commands import sync_indexes
+
+_logger = logging.getLogger()
+
+SOLR_CONFIG = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<config>
+  <luceneMatchVersion>LUCENE_6_0_0</luceneMatchVersion>
+  <directoryFactory class="solr.StandardDirectoryFactory" name="DirectoryFactory"/>
+  <indexConfig>
+    <rt>false</rt>
+    <ramBufferSizeMB>512</ramBufferSizeMB>
+    <mergeScheduler class="org.apache.lucene.index.ConcurrentMergeScheduler">
+      <int name="maxThreadCount">4</int>
+      <int name="maxMergeCount">8</int>
+    </mergeScheduler>
+  </indexConfig>
+  <updateHandler class="solr.DirectUpdateHandler2">
+    <autoSoftCommit>
+      <maxTime>10000</maxTime>
+    </autoSoftCommit>
+  </updateHandler>
+  <query>
+    <filterCache class="solr.SolrFilterCache" highWaterMarkMB="2048" lowWaterMarkMB="1024"/>
+    <queryResultCache class="solr.LRUCache" size="512" initialSize="512"/>
+  </query>
+</config>
+"""
+
+
+class SearchIndexConfigTest(CaravaggioBaseTest):
+    """ Test module for the declarative search index config of sync_indexes """
+
+    def step01_config_element_path(self):
+        self.assertEqual(
+            sync_indexes._config_element_path("autoCommitTime"), ("updateHandler/autoSoftCommit/maxTime", None)
+        )
+        self.assertEqual(
+            sync_indexes._config_element_path("filterCacheLowWaterMark"), ("query/filterCache", "lowWaterMarkMB")
+        )
+        self.assertEqual(
+            sync_indexes._config_element_path("mergeMaxThreadCount"),
+            ("indexConfig/mergeScheduler/int[@name='maxThreadCount']", None),
+        )
+        self.assertEqual(
+            sync_indexes._config_element_path("query.queryResultCache@size"), ("query/queryResultCache", "size")
+        )
+        self.assertEqual(
+            sync_indexes._config_element_path("indexConfig.ramBufferSizeMB"), ("indexConfig/ramBufferSizeMB", None)
+        )
+
+        # The options we don't know how to locate
+        self.assertEqual(sync_indexes._config_element_path("directoryFactory"), (None, None))
+        self.assertEqual(sync_indexes._config_element_path("defaultQueryField"), (None, None))
+
+        # All the element paths can be found in the solrconfig.xml
+        config = ElementTree.fromstring(SOLR_CONFIG)
+        for option in sync_indexes.SEARCH_CONFIG_SHORTCUTS.keys():
+            self.assertIsNotNone(sync_indexes._get_config_value(config, option), option)
+
+    def step02_diff_search_config(self):
+        config = ElementTree.fromstring(SOLR_CONFIG)
+
+        # Same values, written as the user would do it in the settings
+        search_config = {
+            "autoCommitTime": 10000,
+            "realtime": False,
+            "ramBufferSize": "512",
+            "filterCacheHighWaterMark": 2048,
+            "mergeMaxMergeCount": 8,
+            "query.queryResultCache@size": "'512'",
+        }
+        self.assertEqual(sync_indexes._diff_search_config(config, search_config), {})
+
+        search_config.update({"realtime": True, "ramBufferSize": 1024, "query.queryResultCache@initialSize": 256})
+        self.assertEqual(
+            sync_indexes._diff_search_config(config, search_config),
+            {
+                "realtime": ("false", True),
+                "ramBufferSize": ("512", 1024),
+                "query.queryResultCache@initialSize": ("512", 256),
+            },
+        )
+
+        # The options we cannot locate are always applied
+        self.assertEqual(
+            sync_indexes._diff_search_config(
+                config,
+                {"autoCommitTime": 10000, "directoryFactory": "encrypted", "defaultQueryField": "name"},
+            ),
+            {"directoryFactory": (None, "encrypted"), "defaultQueryField": (None, "name")},
+        )
+
+        # Without the current config (ex. a new index) all the options are
+        # applied
+        self.assertEqual(
+            sync_indexes._diff_search_config(None, {"autoCommitTime": 10000, "directoryFactory": "encrypted"}),
+            {"autoCommitTime": (None, 10000), "directoryFactory": (None, "encrypted")},
+        )
+
+    def step03_cql_config_value(self):
+        self.assertEqual(sync_indexes._cql_config_value(True), "true")
+        self.assertEqual(sync_indexes._cql_config_value(False), "false")
+        self.assertEqual(sync_indexes._cql_config_value("True"), "True")
+        self.assertEqual(sync_indexes._cql_config_value(10000), "10000")
+        self.assertEqual(sync_indexes._cql_config_value(-1), "-1")
+        self.assertEqual(sync_indexes._cql_config_value(0.5), "0.5")
+        self.assertEqual(sync_indexes._cql_config_value("512"), "512")
+        self.assertEqual(sync_indexes._cql_config_value("encrypted"), "'encrypted'")
+        self.assertEqual(sync_indexes._cql_config_value("'encrypted'"), "'encrypted'")
+        self.assertEqual(sync_indexes._cql_config_value(' "name" '), "'name'")
+
+    def step04_sync_search_config(self):
+        config = ElementTree.fromstring(SOLR_CONFIG)
+        statements = []
+
+        with mock.patch.object(sync_indexes, "_describe_search_config", return_value=config), mock.patch.object(
+            sync_indexes, "execute", side_effect=lambda statement, **kwargs: statements.append(statement)
+        ):
+            # Nothing to change
+            self.assertEqual(sync_indexes._sync_search_config("ks", "company", {"autoCommitTime": 10000}), [])
+            self.assertEqual(statements, [])
+
+            # The active config does not have the new value of the RAM
+            # buffer, the option we cannot locate is applied but not verified
+            mismatches = sync_indexes._sync_search_config(
+                "ks", "company", {"autoCommitTime": 10000, "ramBufferSize": 1024, "directoryFactory": "encrypted"}
+            )
+
+        self.assertEqual(
+            statements,
+            [
+                "ALTER SEARCH INDEX CONFIG ON ks.company SET ramBufferSize = 1024;",
+                "ALTER SEARCH INDEX CONFIG ON ks.company SET directoryFactory = 'encrypted';",
+                "RELOAD SEARCH INDEX ON ks.company;",
+            ],
+        )
+        self.assertEqual(mismatches, ["ks.company: ramBufferSize"])
@@ -1,9 +1,253 @@
 # -*- coding: utf-8 -*-
 # Copyright (c) 2019 BuildGroup Data Services Inc.
 # All rights reserved.
+import base64
+import binascii
+import json
+import logging
 
-from rest_framework.pagination import PageNumberPagination
+try:
+    from dse import InvalidRequest
+    from dse.cqlengine import connection
+    from dse.protocol import ProtocolException
+    from dse.query import SimpleStatement
+except ImportError:
+    from cassandra import InvalidRequest
+    from cassandra.cqlengine import connection
+    from cassandra.protocol import ProtocolException
+    from cassandra.query import SimpleStatement
+
+from collections import OrderedDict
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+LOGGER = logging.getLogger(__name__)
+
+# The number of tokens of the ring of the Murmur3Partitioner
+MURMUR3_RING_SIZE = 2 ** 64
 
 
 class CustomPageNumberPagination(PageNumberPagination):
     page_size_query_param = "limit"
+
+
+class CassandraPagingStatePagination(CursorPagination):
+    """
+    Pagination of cqlengine querysets based on the `paging_state` of the
+    driver. Each page is a single request to Cassandra with a `fetch_size`
+    equal to the page size, and the paging state of the response is sent
+    back to the client as an opaque token in the `next` link. We do not
+    count or skip rows, the cost of a page does not depend on its position.
+
+    There is no link to the previous page and no total count. If
+    `approximate_count` is True, we add an `approximate_count` with the
+    estimated number of partitions of the table, only when the queryset is
+    not filtered (it is null otherwise, or if the estimation is not
+    available). See `get_approximate_count`.
+
+    A cursor that can not be decoded, or that the cluster rejects (ex. a
+    paging state of another query), is answered with a 404.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    invalid_cursor_message = "Invalid cursor"
+
+    approximate_count = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+
+        paging_state = self.decode_paging_state(request)
+
+        # The select statement without the default LIMIT of cqlengine
+        queryset = queryset.limit(None)
+        select_query = queryset._select_query()
+
+        statement = SimpleStatement(
+            str(select_query),
+            fetch_size=self.page_size,
+            consistency_level=queryset._consistency or self.model._cassandra_consistency_level_read,
+        )
+
+        session = connection.get_session(connection=self.model._get_connection())
+        try:
+            result_set = session.execute(statement, select_query.get_context(), paging_state=paging_state)
+        except (InvalidRequest, ProtocolException) as ex:
+            if paging_state is None:
+                raise
+            LOGGER.warning("The paging state of the cursor has been rejected: {0}".format(ex))
+            raise NotFound(self.invalid_cursor_message)
+
+        self.next_paging_state = result_set.paging_state if result_set.has_more_pages else None
+        self.count = self.get_approximate_count(queryset) if self.approximate_count else None
+
+        constructor = queryset._maybe_inject_deferred(queryset._get_result_constructor())
+        return [constructor(row) for row in result_set.current_rows]
+
+    def decode_paging_state(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            return base64.urlsafe_b64decode(encoded.encode("ascii"))
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_paging_state(self, paging_state):
+        encoded = base64.urlsafe_b64encode(paging_state).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_approximate_count(self, queryset):
+        """
+        Estimation of the number of partitions of the table.
+
+        `system.size_estimates` is local to each node, it only has the
+        estimations of the token ranges of the node that answers the query.
+        We extrapolate them to the whole ring: the partitions of these
+        ranges divided by the fraction of the ring they cover (tokens of the
+        Murmur3Partitioner). The result is an approximation that assumes the
+        partitions are evenly distributed over the ring.
+        """
+        if queryset._where:
+            return None
+
+        session = connection.get_session(connection=self.model._get_connection())
+        try:
+            rows = session.execute(
+                "SELECT range_start, range_end, partitions_count FROM system.size_estimates "
+                "WHERE keyspace_name = %s AND table_name = %s",
+                (self.model._get_keyspace(), self.model._raw_column_family_name()),
+            )
+            partitions = 0
+            tokens = 0
+            for row in rows:
+                range_tokens = int(row["range_end"]) - int(row["range_start"])
+                # The last range wraps around the ring
+                tokens += range_tokens if range_tokens > 0 else range_tokens + MURMUR3_RING_SIZE
+                partitions += row["partitions_count"]
+        except Exception as ex:
+            LOGGER.warning("Unable to estimate the number of rows of {0}: {1}".format(self.model.__name__, ex))
+            return None
+
+        if not tokens:
+            return None
+        return int(round(partitions * MURMUR3_RING_SIZE / min(tokens, MURMUR3_RING_SIZE)))
+
+    def get_next_link(self):
+        if self.next_paging_state is None:
+            return None
+        return self.encode_paging_state(self.next_paging_state)
+
+    def get_previous_link(self):
+        return None
+
+    def get_html_context(self):
+        return {"previous_url": self.get_previous_link(), "next_url": self.get_next_link()}
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.approximate_count:
+            response["approximate_count"] = self.count
+        response["next"] = self.get_next_link()
+        response["results"] = data
+        return Response(response)
+
+
+class CaravaggioFederatedSearchPagination(CursorPagination):
+    """
+    Pagination of the searches over several models (federated searches).
+    Every page sends the query to the core of each model with a composite
+    cursor, the number of results already consumed of each model, and the
+    results of the cores are merged. The cursor of the next page is sent to
+    the client as an opaque token in the `next` link.
+
+    The results are rendered with the search serializer, they are not read
+    from Cassandra.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+
+        queryset = queryset.federated_cursor(self.decode_offsets(request))
+        queryset.query.set_limits(0, self.page_size)
+        results = queryset.post_process_results(queryset.query.get_results())
+
+        self.count = queryset.query.get_count()
+        self.next_offsets = queryset.query.get_next_federated_offsets()
+        return results
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Coroutine version of `paginate_queryset`.
+        """
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+
+        queryset = queryset.federated_cursor(self.decode_offsets(request))
+        queryset.query.set_limits(0, self.page_size)
+        results = queryset.post_process_results(await queryset.query.aget_results())
+
+        self.count = await queryset.query.aget_count()
+        self.next_offsets = queryset.query.get_next_federated_offsets()
+        return results
+
+    def decode_offsets(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return {}
+
+        try:
+            offsets = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")).decode("utf-8"))
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(offsets, dict) or not all(isinstance(offset, int) for offset in offsets.values()):
+            raise NotFound(self.invalid_cursor_message)
+        return offsets
+
+    def get_next_link(self):
+        if not self.next_offsets or sum(self.next_offsets.values()) >= (self.count or 0):
+            return None
+
+        encoded = base64.urlsafe_b64encode(json.dumps(self.next_offsets, sort_keys=True).encode("utf-8"))
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded.decode("ascii"))
+
+    def get_previous_link(self):
+        return None
+
+    def get_html_context(self):
+        return {"previous_url": self.get_previous_link(), "next_url": self.get_next_link()}
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict(
+                [
+                    ("total", self.count),
+                    ("page", len(data)),
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("results", data),
+                ]
+            )
+        )
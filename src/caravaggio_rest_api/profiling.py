@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+A sampling profiler for single requests. A background thread takes the
+stack of the thread that is serving the request every few milliseconds, the
+profile is the number of samples of every stack in the collapsed stack
+format (`frame;frame;frame count`) used by flamegraph.pl and speedscope.
+
+See `caravaggio_rest_api.drf.mixins.RequestProfileViewMixin`.
+"""
+import logging
+import os
+import sys
+import threading
+
+from collections import Counter
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.005
+DEFAULT_MAX_DEPTH = 128
+DEFAULT_MAX_FILES = 100
+
+PROFILE_EXTENSION = ".collapsed"
+
+
+class StackSampler(object):
+    """
+    Samples the stack of a thread (by default the current one) every
+    `interval` seconds until it is stopped.
+    """
+
+    def __init__(self, thread_id=None, interval=DEFAULT_INTERVAL, max_depth=DEFAULT_MAX_DEPTH):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.max_depth = max_depth
+
+        self.stacks = Counter()
+        self.samples = 0
+
+        # The names of the frames, by code object
+        self._names = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="caravaggio-stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def get_frame_name(self, code):
+        name = self._names.get(code, None)
+        if name is None:
+            name = "{0} ({1}:{2})".format(
+                getattr(code, "co_qualname", code.co_name), os.path.basename(code.co_filename), code.co_firstlineno
+            ).replace(";", ",")
+            self._names[code] = name
+        return name
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id, None)
+            if frame is None:
+                continue
+
+            names = []
+            while frame is not None and len(names) < self.max_depth:
+                names.append(self.get_frame_name(frame.f_code))
+                frame = frame.f_back
+
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def to_collapsed(self, root=None):
+        """
+        The profile in the collapsed stack format. The `root` frame (ex. the
+        name of the view) is added to all the stacks.
+        """
+        prefix = "{0};".format(root.replace(";", ",")) if root else ""
+        return "".join("{0}{1} {2}\n".format(prefix, stack, count) for stack, count in sorted(self.stacks.items()))
+
+
+class ProfileStore(object):
+    """
+    Keeps the profiles in a local directory, removing the oldest ones when
+    there are more than `max_files`.
+    """
+
+    def __init__(self, directory, max_files=DEFAULT_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+
+    def get_profiles(self):
+        """
+        The paths of the stored profiles, the oldest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+
+        names = [name for name in os.listdir(self.directory) if name.endswith(PROFILE_EXTENSION)]
+        return sorted((os.path.join(self.directory, name) for name in names), key=os.path.getmtime)
+
+    def save(self, name, content):
+        os.makedirs(self.directory, exist_ok=True)
+
+        path = os.path.join(self.directory, "{0}{1}".format(name, PROFILE_EXTENSION))
+        with open(path, "w", encoding="utf-8") as profile_file:
+            profile_file.write(content)
+
+        self.rotate()
+        return path
+
+    def rotate(self):
+        profiles = self.get_profiles()
+        for path in profiles[: max(len(profiles) - self.max_files, 0)]:
+            try:
+                os.remove(path)
+            except OSError as ex:
+                LOGGER.warning("Unable to remove the profile {0}: {1}".format(path, ex))
@@ -84,6 +84,7 @@ class Common(Configuration):
     ]
 
     MIDDLEWARE = [
+        "caravaggio_rest_api.drf.middleware.ServerTimingMiddleware",
         "django.middleware.security.SecurityMiddleware",
         "django.contrib.sessions.middleware.SessionMiddleware",
         "django.middleware.common.CommonMiddleware",
@@ -93,6 +94,28 @@ class Common(Configuration):
         "django.middleware.clickjacking.XFrameOptionsMiddleware",
     ]
 
+    # Server-Timing header with the duration of the phases of every request
+    # (filters, search, hydration, serialization, access log...)
+    SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "True") == "True"
+
+    # Dotted path of the callable that receives the request, the response and
+    # the timings of every request, ex. "caravaggio_rest_api.timing.log_timings"
+    SERVER_TIMING_SINK = os.getenv("SERVER_TIMING_SINK", None)
+
+    # Profiling of requests with a stack sampler: staff users can ask for the
+    # profile of a request with `?_profile=1` (or `?_profile=inline`), and
+    # 1 of every PROFILING_SAMPLE_RATE requests is profiled (0 disables it)
+    PROFILING_SAMPLE_RATE = int(os.getenv("PROFILING_SAMPLE_RATE", 0))
+    PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", 0.005))
+    PROFILING_DIR = os.getenv("PROFILING_DIR", "/tmp/caravaggio_profiles")
+    PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", 100))
+
+    # Comma separated base URLs of the instances the `replay_api_access`
+    # command can send the tokens of the recorded users to (--recorded-tokens)
+    REPLAY_ALLOWED_TARGETS = [
+        target.strip() for target in os.getenv("REPLAY_ALLOWED_TARGETS", "").split(",") if target.strip()
+    ]
+
     ROOT_URLCONF = "caravaggio_rest_api.urls"
 
     TEMPLATES = [
@@ -328,6 +351,17 @@ class Common(Configuration):
             "drf_haystack.filters.HaystackBoostFilter",
             "drf_haystack.filters.HaystackOrderingFilter",
         ),
+        # JSON encoded and decoded with orjson, same output as the DRF
+        # JSONRenderer
+        "DEFAULT_RENDERER_CLASSES": (
+            "caravaggio_rest_api.drf.renderers.FastJSONRenderer",
+            "rest_framework.renderers.BrowsableAPIRenderer",
+        ),
+        "DEFAULT_PARSER_CLASSES": (
+            "caravaggio_rest_api.drf.parsers.FastJSONParser",
+            "rest_framework.parsers.FormParser",
+            "rest_framework.parsers.MultiPartParser",
+        ),
         "TEST_REQUEST_DEFAULT_FORMAT": "json",
         "ORDERING_PARAM": "order_by",
         # https://www.django-rest-framework.org/api-guide/fields/#decimalfield
@@ -369,6 +403,8 @@ class Common(Configuration):
     PATCH_THROTTLE_RATE = "100/minute"
     METADATA_THROTTLE_RATE = "6000/minute"
     FACETS_THROTTLE_RATE = "6000/minute"
+    BULK_THROTTLE_RATE = "20/minute"
+    BATCH_RETRIEVE_THROTTLE_RATE = "200/minute"
 
     THROTTLE_OPERATIONS = {
         "retrieve": GET_THROTTLE_RATE,
@@ -381,6 +417,8 @@ class Common(Configuration):
         "partial_update": PATCH_THROTTLE_RATE,
         "metadata": METADATA_THROTTLE_RATE,
         "facets": FACETS_THROTTLE_RATE,
+        "bulk": BULK_THROTTLE_RATE,
+        "batch_retrieve": BATCH_RETRIEVE_THROTTLE_RATE,
     }
 
     HAYSTACK_DJANGO_ID_FIELD = "id"
@@ -389,33 +427,70 @@ class Common(Configuration):
     if "test" in sys.argv:
         HAYSTACK_KEYSPACE = "test_{}".format(HAYSTACK_KEYSPACE)
 
+    # A comma separated list with the URL of every search node, the requests
+    # are routed to the healthiest node
     HAYSTACK_URL = os.getenv("HAYSTACK_URL", "http://127.0.0.1:8983/solr")
+    HAYSTACK_URLS = [url.strip() for url in HAYSTACK_URL.split(",") if url.strip()]
     HAYSTACK_ADMIN_URL = os.getenv("HAYSTACK_ADMIN_URL", "http://127.0.0.1:8983/solr/admin/cores")
 
     HAYSTACK_CONNECTIONS = {
         "default": {
             "ENGINE": "caravaggio_rest_api.haystack.backends." "solr_backend.CassandraSolrEngine",
-            "URL": HAYSTACK_URL,
+            "URL": HAYSTACK_URLS,
             "KEYSPACE": HAYSTACK_KEYSPACE,
             "ADMIN_URL": HAYSTACK_ADMIN_URL,
             "BATCH_SIZE": 100,
             "INCLUDE_SPELLING": True,
             "DISTANCE_AVAILABLE": True,
+            "ROUTING": {
+                # Send the request to a second node if the first one does not
+                # answer before the p95 of its latency
+                "HEDGE": os.getenv("HAYSTACK_HEDGE", "False") == "True",
+                # Consecutive failures before a node is put to cool down
+                "FAILURE_THRESHOLD": int(os.getenv("HAYSTACK_FAILURE_THRESHOLD", 5)),
+                "COOLDOWN": int(os.getenv("HAYSTACK_COOLDOWN", 30)),
+            },
+            # Identical concurrent searches of the DSE backend are sent once,
+            # the callers wait for the results of the first one. With a
+            # CACHE (django_redis) also across processes
+            "COALESCING": {
+                "ENABLED": os.getenv("HAYSTACK_COALESCING", "False") == "True",
+                "TIMEOUT": int(os.getenv("HAYSTACK_COALESCING_TIMEOUT", 10)),
+                "CACHE": os.getenv("HAYSTACK_COALESCING_CACHE", None),
+            },
         },
     }
 
+    # Configuration of the DSE Search indexes (solrconfig.xml) by model,
+    # applied by the `sync_indexes` command. It overrides the
+    # `search_config` defined in the Meta class of the SearchIndex.
+    # Ex. {"company.company": {"autoCommitTime": "1000"}}
+    SEARCH_INDEX_CONFIG = {}
+
     # Caching: Redis backend for caching
     REDIS_HOST_PRIMARY = os.getenv("REDIS_HOST_PRIMARY", "127.0.0.1")
     REDIS_PORT_PRIMARY = os.getenv("REDIS_PORT_PRIMARY", "6379")
     REDIS_PASS_PRIMARY = os.getenv("REDIS_PASS_PRIMARY", "")
 
+    # Two-tier cache: a per-process LRU in front of Redis for the hot keys,
+    # the invalidations are broadcast to all the instances over pub/sub.
+    # Disabled by default, the deployments opt in with CACHE_LOCAL_TIER=True
+    CACHE_LOCAL_TIER = os.getenv("CACHE_LOCAL_TIER", "False") == "True"
+
     CACHES = {
         "default": {
-            "BACKEND": "django_redis.cache.RedisCache",
+            "BACKEND": "caravaggio_rest_api.cache.TwoTierRedisCache"
+            if CACHE_LOCAL_TIER
+            else "django_redis.cache.RedisCache",
             "LOCATION": "redis://{0}{1}:{2}/1".format(
                 ":{0}@".format(REDIS_PASS_PRIMARY) if REDIS_PASS_PRIMARY else "", REDIS_HOST_PRIMARY, REDIS_PORT_PRIMARY
             ),
-            "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient",},
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+                # Max keys and seconds a key is kept in the local tier
+                "LOCAL_MAX_ENTRIES": int(os.getenv("CACHE_LOCAL_MAX_ENTRIES", 1000)),
+                "LOCAL_TIMEOUT": int(os.getenv("CACHE_LOCAL_TIMEOUT", 5)),
+            },
             "KEY_PREFIX": "caravaggio_rest_api",
         },
         "disk_cache": {
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*
+# Copyright (c) 2019 BuildGroup Data Services Inc.
+# All rights reserved.
+"""
+Durations of the phases of a request (filters, search, hydration,
+serialization, access log...), sent to the client in the `Server-Timing`
+header and to the metrics sink by the `ServerTimingMiddleware`.
+
+The phases are measured with the `phase` context manager:
+
+    with timing.phase("solr"):
+        raw_results = self.conn.search(query_string, **search_kwargs)
+
+Outside of a request, or if `SERVER_TIMING_ENABLED` is False, `phase`
+returns a shared context manager that does nothing.
+"""
+import logging
+
+from contextvars import ContextVar
+from time import perf_counter
+
+LOGGER = logging.getLogger(__name__)
+
+_request_timings = ContextVar("request_timings", default=None)
+
+
+class RequestTimings(object):
+    """
+    The accumulated duration (seconds) of every phase of a request, in the
+    order they finished.
+    """
+
+    __slots__ = ("durations",)
+
+    def __init__(self):
+        self.durations = {}
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+    def to_header(self):
+        return ", ".join("{0};dur={1:.2f}".format(name, duration * 1000) for name, duration in self.durations.items())
+
+
+class Phase(object):
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timings.add(self.name, perf_counter() - self.start)
+
+
+class NoPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NO_PHASE = NoPhase()
+
+
+def phase(name):
+    """
+    Context manager that adds the duration of the block to the phase `name`
+    of the current request.
+    """
+    timings = _request_timings.get()
+    if timings is None:
+        return NO_PHASE
+    return Phase(timings, name)
+
+
+def record(name, duration):
+    """
+    Adds a duration (seconds) measured somewhere else to the phase `name` of
+    the current request. Ex. the `QTime` of Solr.
+    """
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add(name, duration)
+
+
+def get_request_timings():
+    return _request_timings.get()
+
+
+def start_request_timings():
+    """
+    Starts the timings of a new request. Returns the token to pass to
+    `finish_request_timings`.
+    """
+    return _request_timings.set(RequestTimings())
+
+
+def finish_request_timings(token):
+    _request_timings.reset(token)
+
+
+def log_timings(request, response, timings):
+    """
+    A metrics sink that logs the timings of every request.
+    """
+    LOGGER.info("{0} {1} {2}: {3}".format(request.method, request.path, response.status_code, timings.to_header()))
@@ -84,3 +84,59 @@ def delete_all_records(model_clazz, database=None):
 
 def get_primary_keys_values(instance, model):
     return {pk: getattr(instance, pk) for pk in model._primary_keys.keys()}
+
+
+def get_query_projection(model, query_params):
+    """
+    Translates the `fields` and `fields!` query parameters into the list of
+    columns we need to read from Cassandra. The primary keys are always
+    included.
+
+    Returns None if there is nothing to project or if some of the requested
+    fields are not columns of the model (ex. fields computed by the
+    serializer), in which case we need to read the full row.
+    """
+    include_fields = {name for value in query_params.getlist("fields") for name in value.split(",") if name}
+    exclude_fields = {name for value in query_params.getlist("fields!") for name in value.split(",") if name}
+
+    if not include_fields and not exclude_fields:
+        return None
+
+    if include_fields:
+        if not include_fields.issubset(model._columns.keys()):
+            return None
+        selected_fields = include_fields - exclude_fields
+    else:
+        selected_fields = set(model._columns.keys()) - exclude_fields
+
+    primary_keys = list(model._primary_keys.keys())
+    return primary_keys + [
+        name for name in model._columns.keys() if name in selected_fields and name not in primary_keys
+    ]
+
+
+def percentile(values, fraction):
+    """
+    The nearest-rank percentile of a sorted list.
+    """
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+def summarize(values, scale=1.0, digits=3):
+    """
+    Statistics of a list of measures, multiplied by `scale` (ex. 1000 to
+    report seconds in milliseconds).
+    """
+    if not values:
+        return None
+
+    values = sorted(value * scale for value in values)
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), digits),
+        "min": round(values[0], digits),
+        "p50": round(percentile(values, 0.5), digits),
+        "p95": round(percentile(values, 0.95), digits),
+        "p99": round(percentile(values, 0.99), digits),
+        "max": round(values[-1], digits),
+    }